@@ -4,16 +4,23 @@
 Zeigt alle Peer-Nachrichten in Echtzeit an.
 Läuft in einem separaten Terminal-Fenster.
 
+Der Viewer meldet sich als Observer an: er erscheint nicht in der
+Peer-Liste und bekommt eine Kopie aller gerouteten Nachrichten. Filter
+werden schon auf dem Server angewendet.
+
 Verwendung:
     python chat_viewer.py
     # oder
     ./chat_viewer.py
+    # nur ein Peer bzw. nur Broadcasts
+    ./chat_viewer.py --peer "mini (*)" --channel broadcast
 """
 
 import asyncio
 import json
 import sys
 from datetime import datetime
+from typing import Optional
 
 import websockets
 
@@ -32,14 +39,21 @@ class Colors:
     MAGENTA = "\033[95m"   # Context
 
 
-def format_time() -> str:
-    """Formatiert aktuelle Zeit."""
+def format_time(timestamp: Optional[str] = None) -> str:
+    """Formatiert die Zeit eines Eintrags (ISO-Zeitstempel in UTC) oder jetzt."""
+    if timestamp:
+        try:
+            utc = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+            return utc.astimezone().strftime("%d.%m. %H:%M:%S")
+        except ValueError:
+            pass
     return datetime.now().strftime("%H:%M:%S")
 
 
-def print_message(msg: dict) -> None:
-    """Gibt eine Nachricht formatiert aus."""
+def format_message(msg: dict) -> str:
+    """Formatiert ein Ereignis für die Ausgabe ("" für nicht angezeigte)."""
     msg_type = msg.get("type", "")
+    stamp = f"\n{Colors.DIM}[{format_time(msg.get('timestamp'))}]{Colors.RESET} "
 
     if msg_type == "message":
         sender = msg.get("from", "?")
@@ -48,13 +62,16 @@ def print_message(msg: dict) -> None:
         context = msg.get("context")
 
         # Header
-        print(f"\n{Colors.DIM}[{format_time()}]{Colors.RESET} ", end="")
-        print(f"{Colors.CYAN}{Colors.BOLD}{sender}{Colors.RESET}", end="")
-        print(f" → ", end="")
-        print(f"{Colors.CYAN}{Colors.BOLD}{recipient}{Colors.RESET}")
+        lines = [
+            f"{stamp}{Colors.CYAN}{Colors.BOLD}{sender}{Colors.RESET} → "
+            f"{Colors.CYAN}{Colors.BOLD}{recipient}{Colors.RESET}"
+            + (f" {Colors.DIM}({', '.join(msg['recipients'])}){Colors.RESET}" if msg.get("recipients") else "")
+        ]
 
-        # Content
-        print(f"  {content}")
+        # Content (große Inhalte kommen nur als Vorschau)
+        lines.append(f"  {content}")
+        if msg.get("content_ref"):
+            lines.append(f"  {Colors.DIM}… {msg.get('content_size', '?')} Zeichen{Colors.RESET}")
 
         # Context falls vorhanden
         if context:
@@ -64,18 +81,58 @@ def print_message(msg: dict) -> None:
             if context.get("lines"):
                 ctx_parts.append(f"Z.{context['lines']}")
             if ctx_parts:
-                print(f"  {Colors.MAGENTA}📎 {' '.join(ctx_parts)}{Colors.RESET}")
+                lines.append(f"  {Colors.MAGENTA}📎 {' '.join(ctx_parts)}{Colors.RESET}")
+        return "\n".join(lines) + "\n"
 
     elif msg_type == "peer_joined":
-        peer = msg.get("peer", {})
-        name = peer.get("name", "?")
-        print(f"\n{Colors.DIM}[{format_time()}]{Colors.RESET} ", end="")
-        print(f"{Colors.GREEN}✓ {name} ist beigetreten{Colors.RESET}")
+        name = msg.get("peer", {}).get("name", "?")
+        return f"{stamp}{Colors.GREEN}✓ {name} ist beigetreten{Colors.RESET}\n"
 
     elif msg_type == "peer_left":
-        peer = msg.get("peer", "?")
-        print(f"\n{Colors.DIM}[{format_time()}]{Colors.RESET} ", end="")
-        print(f"{Colors.YELLOW}✗ {peer} hat die Verbindung getrennt{Colors.RESET}")
+        return f"{stamp}{Colors.YELLOW}✗ {msg.get('peer', '?')} hat die Verbindung getrennt{Colors.RESET}\n"
+
+    elif msg_type == "tap_dropped":
+        return f"{stamp}{Colors.YELLOW}⚠ {msg.get('count', '?')} Ereignisse ausgelassen (Verbindung zu langsam){Colors.RESET}\n"
+
+    return ""
+
+
+class TerminalWriter:
+    """Gepufferte Terminalausgabe.
+
+    Statt mehrerer print() plus flush pro Nachricht wird gesammelt und
+    höchstens alle interval Sekunden (oder ab max_bytes) in einem write()
+    ausgegeben - bei Bursts bremst das Terminal so nicht den Empfang.
+    """
+
+    def __init__(self, stream=sys.stdout, interval: float = 0.05, max_bytes: int = 256 * 1024):
+        self.stream = stream
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._chunks: list[str] = []
+        self._size = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.max_bytes:
+            self.flush()
+        elif self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    def flush(self) -> None:
+        if self._chunks:
+            self.stream.write("".join(self._chunks))
+            self.stream.flush()
+            self._chunks.clear()
+            self._size = 0
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self.flush()
 
 
 def print_header() -> None:
@@ -83,12 +140,38 @@ def print_header() -> None:
     print(f"\n{Colors.BOLD}{'═' * 50}{Colors.RESET}")
     print(f"{Colors.BOLD}  🔗 AI-Connect Live Chat Viewer{Colors.RESET}")
     print(f"{Colors.BOLD}{'═' * 50}{Colors.RESET}")
-    print(f"{Colors.DIM}  Drücke Ctrl+C zum Beenden{Colors.RESET}\n")
+    print(f"{Colors.DIM}  Enter: ältere Nachrichten laden · Ctrl+C zum Beenden{Colors.RESET}\n")
+
+
+def _watch_stdin(ws, state: dict) -> None:
+    """Enter auf der Konsole lädt die nächste ältere Seite."""
+    loop = asyncio.get_running_loop()
 
+    def on_input() -> None:
+        sys.stdin.readline()
+        if state["more"] and not state["loading"]:
+            state["loading"] = True
+            asyncio.create_task(ws.send(json.dumps({
+                "type": "scrollback",
+                "before": state["cursor"],
+                "limit": state["page_size"]
+            })))
+
+    try:
+        loop.add_reader(sys.stdin, on_input)
+    except (NotImplementedError, ValueError, OSError):
+        pass  # Kein Terminal (z.B. umgeleitet oder Windows) - nur Live-Ansicht
 
-async def viewer(host: str = "192.168.0.252", port: int = 9999) -> None:
+
+async def viewer(
+    host: str = "192.168.0.252",
+    port: int = 9999,
+    filters: Optional[dict] = None,
+    scrollback: int = 50
+) -> None:
     """Verbindet zur Bridge und zeigt Nachrichten an."""
     uri = f"ws://{host}:{port}"
+    out = TerminalWriter()
 
     print_header()
     print(f"{Colors.DIM}Verbinde zu {uri}...{Colors.RESET}")
@@ -99,30 +182,48 @@ async def viewer(host: str = "192.168.0.252", port: int = 9999) -> None:
             await ws.send(json.dumps({
                 "type": "register",
                 "name": "_viewer_",
-                "observer": True
+                "observer": True,
+                "filters": filters or {}
             }))
 
+            # Letzte Nachrichten als Ausgangspunkt, ältere auf Anfrage
+            state = {"cursor": None, "more": scrollback > 0, "loading": False, "page_size": scrollback}
+            if scrollback > 0:
+                state["loading"] = True
+                await ws.send(json.dumps({"type": "scrollback", "limit": scrollback}))
+            _watch_stdin(ws, state)
+
             print(f"{Colors.GREEN}✓ Verbunden! Warte auf Nachrichten...{Colors.RESET}")
 
             async for raw in ws:
                 try:
                     msg = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
 
-                    # Pings/Pongs ignorieren
-                    if msg.get("type") in ("ping", "pong"):
-                        continue
+                msg_type = msg.get("type")
+                # Pings/Pongs ignorieren
+                if msg_type in ("ping", "pong", "registered"):
+                    continue
 
-                    print_message(msg)
-                    sys.stdout.flush()
+                if msg_type == "scrollback":
+                    state.update(cursor=msg.get("cursor"), more=msg.get("more", False), loading=False)
+                    older = "".join(format_message({"type": "message", **m}) for m in msg.get("messages", []))
+                    hint = "Enter für ältere" if state["more"] else "Anfang des Verlaufs"
+                    out.write(f"\n{Colors.DIM}── Verlauf ({len(msg.get('messages', []))} Nachrichten) ──{Colors.RESET}\n")
+                    out.write(older)
+                    out.write(f"{Colors.DIM}── Ende Verlauf · {hint} ──{Colors.RESET}\n")
+                    continue
 
-                except json.JSONDecodeError:
-                    pass
+                out.write(format_message(msg))
 
     except ConnectionRefusedError:
         print(f"{Colors.YELLOW}⚠ Bridge Server nicht erreichbar: {uri}{Colors.RESET}")
         print(f"{Colors.DIM}  Stelle sicher, dass der Bridge Server läuft.{Colors.RESET}")
     except KeyboardInterrupt:
         print(f"\n\n{Colors.DIM}Viewer beendet.{Colors.RESET}")
+    finally:
+        out.flush()
 
 
 def main() -> None:
@@ -132,10 +233,15 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="AI-Connect Live Chat Viewer")
     parser.add_argument("--host", default="192.168.0.252", help="Bridge Server Host")
     parser.add_argument("--port", type=int, default=9999, help="Bridge Server Port")
+    parser.add_argument("--peer", action="append", help="Nur Nachrichten von/an diese Peers (Glob, mehrfach möglich)")
+    parser.add_argument("--channel", action="append", choices=["direct", "broadcast", "pattern"], help="Nur diese Kanäle")
+    parser.add_argument("--type", action="append", choices=["message", "peer_joined", "peer_left"], help="Nur diese Ereignisse")
+    parser.add_argument("--scrollback", type=int, default=50, help="Nachrichten pro Verlaufsseite (0: kein Verlauf)")
     args = parser.parse_args()
 
+    filters = {"peers": args.peer, "channels": args.channel, "types": args.type}
     try:
-        asyncio.run(viewer(args.host, args.port))
+        asyncio.run(viewer(args.host, args.port, {k: v for k, v in filters.items() if v}, args.scrollback))
     except KeyboardInterrupt:
         pass
 
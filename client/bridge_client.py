@@ -1,8 +1,15 @@
 """WebSocket Client für Verbindung zum AI-Connect Bridge Server."""
 
 import asyncio
+import difflib
+import hashlib
 import json
 import logging
+import os
+import random
+import socket
+import uuid
+from collections import OrderedDict
 from typing import Optional, Callable
 from pathlib import Path
 
@@ -11,6 +18,11 @@ from websockets import ClientConnection
 
 logger = logging.getLogger(__name__)
 
+# Grenzen für Kontext-Anfragen anderer Peers (peer_fetch)
+CONTEXT_MAX_FILE_BYTES = 4 * 1024 * 1024  # Größere Dateien werden nicht gelesen
+CONTEXT_MAX_CHARS = 64 * 1024             # Maximale Antwortgröße
+CONTEXT_CACHE_ENTRIES = 32                # Gecachte Dateien (nach mtime invalidiert)
+
 
 class BridgeClient:
     """Verbindet sich zum Bridge Server und verwaltet Kommunikation."""
@@ -20,10 +32,17 @@ class BridgeClient:
         host: str = "192.168.0.252",
         port: int = 9999,
         peer_name: str = "default",
-        project: Optional[str] = None
+        project: Optional[str] = None,
+        context_root: Optional[str] = None,
+        serve_context: bool = True,
+        unix_socket: Optional[str] = None
     ):
         self.host = host
         self.port = port
+        # Unix Socket des Bridge Servers - genutzt, wenn dieser auf demselben Rechner läuft
+        self.unix_socket = os.path.expanduser(unix_socket) if unix_socket else None
+        self._local_bridge: Optional[bool] = None
+        self.transport = "tcp"
         self._base_name = peer_name  # Original-Name für Registrierung
         self.peer_name = peer_name   # Kann vom Server überschrieben werden
         self.project = project or self._detect_project()
@@ -33,11 +52,42 @@ class BridgeClient:
         self._reconnecting = False
         self._should_reconnect = True  # Auto-Reconnect aktiviert
         self._message_queue: list[dict] = []
-        self._peers: list[dict] = []
+        self._seen_ids: OrderedDict[str, None] = OrderedDict()  # Duplikaterkennung
+        self._last_seq = 0  # Höchste empfangene seq der aktuellen Verbindung
+        self._acked_seq = 0  # Höchste bereits bestätigte seq
+        self._ack_task: Optional[asyncio.Task] = None
+        self._retry_after: Optional[float] = None  # Wartezeit-Vorgabe des Servers
+        # Vom Server gedrosselte Nachrichten (client_id), werden nacheinander wiederholt
+        self._throttled: OrderedDict[str, None] = OrderedDict()
+        self._throttle_delay = 1.0
+        self._throttle_task: Optional[asyncio.Task] = None
+        # Gesendete, vom Server noch nicht bestätigte Nachrichten (client_id -> Frame).
+        # Nach einem Reconnect werden sie mit derselben client_id erneut gesendet.
+        self._outbox: OrderedDict[str, dict] = OrderedDict()
+        # Peer-Verzeichnis (Name -> Info) mit Stand des Servers: nach einem
+        # Reconnect werden nur die Änderungen seit _peer_version geholt
+        self._peers: dict[str, dict] = {}
+        self._peer_epoch: Optional[str] = None
+        self._peer_version = 0
         self._on_message: Optional[Callable] = None
         self._reconnect_task: Optional[asyncio.Task] = None
         self._receive_task: Optional[asyncio.Task] = None
         self._ping_task: Optional[asyncio.Task] = None
+        self._pending: dict[str, asyncio.Future] = {}  # request_id -> Antwort
+        self._blob_cache: dict[str, str] = {}
+
+        # Dateien, die andere Peers per context_request anfragen dürfen:
+        # nur was dieser Client selbst per peer_send/peer_context geteilt hat
+        self._context_root = Path(context_root or Path.cwd()).resolve()
+        self._context_sharing = serve_context
+        self._shared_context: set[tuple[Path, Optional[str]]] = set()
+        self._file_cache: OrderedDict[tuple, list[str]] = OrderedDict()
+
+        # Snapshot-Caches für Delta-Übertragung, Schlüssel (Peer, Datei, Zeilen):
+        # _sent_snapshots: zuletzt an einen Peer gesendete Version
+        # _received_snapshots: zuletzt von einem Peer erhaltene Version
+        self._sent_snapshots: OrderedDict[tuple, tuple[str, str]] = OrderedDict()
+        self._received_snapshots: OrderedDict[tuple, tuple[str, str]] = OrderedDict()
 
     def _detect_project(self) -> str:
         """Erkennt das aktuelle Projekt basierend auf cwd.
@@ -59,7 +109,7 @@ class BridgeClient:
 
     @property
     def peers(self) -> list[dict]:
-        return self._peers.copy()
+        return list(self._peers.values())
 
     @property
     def messages(self) -> list[dict]:
@@ -70,21 +120,43 @@ class BridgeClient:
         self._on_message = callback
 
     async def connect(self) -> bool:
-        """Verbindet zum Bridge Server."""
+        """Verbindet zum Bridge Server.
+
+        Erfolgreich erst, wenn der Server die Registrierung bestätigt hat.
+        Bei retry_later (Server ausgelastet) wird nach dessen Vorgabe erneut
+        versucht.
+        """
         try:
             uri = f"ws://{self.host}:{self.port}"
             # Längere Timeouts für stabilere Verbindungen
             # Ping alle 60s, Timeout nach 300s (5 Minuten)
-            self._ws = await websockets.connect(uri, ping_interval=60, ping_timeout=300)
-            self._connected = True
-            self._reconnecting = False
+            self._ws = await self._open(uri, ping_interval=60, ping_timeout=300)
+            self._last_seq = self._acked_seq = 0  # seq zählt pro Verbindung
 
             # Registrieren - immer den Original-Namen senden, nicht den zugewiesenen
             await self._send({
                 "type": "register",
                 "name": self._base_name,
-                "project": self.project
+                "project": self.project,
+                "unread_ack": True,  # Ungelesene seitenweise mit Bestätigung
+                "acks": True         # Live-Nachrichten per kumulativem ack bestätigen
             })
+            if not await self._await_registered():
+                await self._ws.close()
+                self._ws = None
+                self._connected = False
+                if self._retry_after is not None and self._should_reconnect and not self._reconnecting:
+                    asyncio.create_task(self._reconnect())
+                return False
+            self._connected = True
+            self._reconnecting = False
+
+            # Peer-Verzeichnis abgleichen - nur Änderungen seit dem letzten Stand
+            await self._send(self._peer_sync_request())
+
+            # Unbestätigte Nachrichten wiederholen - der Server verwirft Duplikate
+            for data in list(self._outbox.values()):
+                await self._send(data)
 
             # Alte Tasks canceln falls vorhanden
             if self._receive_task and not self._receive_task.done():
@@ -97,7 +169,7 @@ class BridgeClient:
             # Ping-Loop starten
             self._ping_task = asyncio.create_task(self._ping_loop())
 
-            logger.info(f"Verbunden mit Bridge: {uri}")
+            logger.info(f"Verbunden mit Bridge: {uri} ({self.transport})")
             return True
 
         except Exception as e:
@@ -105,6 +177,59 @@ class BridgeClient:
             self._connected = False
             return False
 
+    async def _await_registered(self, timeout: float = 10) -> bool:
+        """Wartet auf die Antwort des Servers auf register.
+
+        Returns:
+            True bei "registered", False bei "retry_later" (Wartezeit steht
+            dann in _retry_after), Fehler oder ausbleibender Antwort
+        """
+        try:
+            while True:
+                data = json.loads(await asyncio.wait_for(self._ws.recv(), timeout))
+                msg_type = data.get("type")
+                if msg_type == "registered":
+                    # Server hat uns evtl. einen anderen Namen zugewiesen
+                    assigned_name = data.get("name")
+                    if assigned_name and assigned_name != self.peer_name:
+                        logger.info(f"Server hat Namen zugewiesen: {assigned_name} (angefragt: {self.peer_name})")
+                        self.peer_name = assigned_name
+                    return True
+                if msg_type == "retry_later":
+                    # Server nimmt gerade keine Registrierungen an
+                    self._retry_after = float(data.get("retry_after", 0))
+                    logger.info(f"Bridge ausgelastet, neuer Versuch in {self._retry_after:.1f}s")
+                    return False
+                if msg_type == "error":
+                    logger.error(f"Registrierung abgelehnt: {data.get('error')}")
+                    return False
+        except asyncio.TimeoutError:
+            logger.error("Keine Antwort auf die Registrierung")
+            return False
+        except websockets.exceptions.ConnectionClosed:
+            logger.error("Verbindung während der Registrierung geschlossen")
+            return False
+
+    async def _open(self, uri: str, **kwargs) -> ClientConnection:
+        """Öffnet die WebSocket-Verbindung, lokal bevorzugt über den Unix Socket.
+
+        Das Protokoll ist auf beiden Wegen identisch. Ist der Socket nicht
+        erreichbar (Server ohne unix_socket, anderer Rechner), geht es per TCP.
+        """
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            if self._local_bridge is None:
+                self._local_bridge = await asyncio.to_thread(_is_local_host, self.host)
+            if self._local_bridge:
+                try:
+                    ws = await websockets.unix_connect(self.unix_socket, uri, **kwargs)
+                    self.transport = "unix"
+                    return ws
+                except OSError as e:
+                    logger.info(f"Unix Socket {self.unix_socket} nicht nutzbar ({e}), verbinde per TCP")
+        ws = await websockets.connect(uri, **kwargs)
+        self.transport = "tcp"
+        return ws
+
     async def disconnect(self) -> None:
         """Trennt die Verbindung."""
         self._connected = False
@@ -126,28 +251,101 @@ class BridgeClient:
         self,
         to: str,
         content: str,
-        context: Optional[dict] = None
+        context: Optional[dict] = None,
+        ttl: Optional[int] = None
     ) -> bool:
-        """Sendet eine Nachricht an einen Peer."""
+        """Sendet eine Nachricht an einen Peer.
+
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             vom Bridge Server archiviert und gelöscht (sofern dort
+             retention.enabled gesetzt ist).
+        """
         if not self._connected:
             return False
 
-        return await self._send({
+        data = {
             "type": "message",
+            "client_id": uuid.uuid4().hex,
             "to": to,
             "content": content,
             "context": context
-        })
+        }
+        if ttl:
+            data["ttl"] = ttl
+        if context and context.get("file"):
+            self._share_context(context["file"], context.get("lines"))
+
+        # Bis zum "sent" des Servers aufheben - bei Verbindungsabbruch ist
+        # sonst unklar, ob die Nachricht angekommen ist
+        self._outbox[data["client_id"]] = data
+        if len(self._outbox) > 1000:
+            self._outbox.popitem(last=False)
+
+        if await self._send(data):
+            return True
+        # Wird nach dem Reconnect mit derselben client_id wiederholt
+        return self._should_reconnect
 
     async def list_peers(self) -> list[dict]:
         """Fragt die Liste der online Peers ab."""
         if not self._connected:
             return []
 
-        await self._send({"type": "list_peers"})
-        # Warte kurz auf Antwort
-        await asyncio.sleep(0.5)
-        return self._peers
+        reply = await self._request(self._peer_sync_request(), timeout=5.0)
+        if reply and reply.get("type") == "peer_delta":
+            await self._apply_peer_delta(reply)
+        return self.peers
+
+    def _peer_sync_request(self) -> dict:
+        return {"type": "peer_sync", "epoch": self._peer_epoch, "since": self._peer_version}
+
+    async def _apply_peer_delta(self, data: dict) -> None:
+        """Übernimmt ein Delta (oder bei full=True das volle Verzeichnis).
+
+        Deltas kommen als Antwort auf peer_sync oder gebündelt vom Server,
+        solange er sich nach einem Neustart einpendelt. Passt ein Delta nicht
+        an den eigenen Stand, wird nachsynchronisiert.
+        """
+        full = bool(data.get("full"))
+        same_epoch = data.get("epoch") == self._peer_epoch
+        if not full and same_epoch and data.get("version", 0) <= self._peer_version:
+            return  # Bereits enthalten
+        gap = not full and (not same_epoch or data.get("since", 0) > self._peer_version)
+
+        if full:
+            self._peers = {}
+        for peer in data.get("joined", []):
+            self._peers[peer["name"]] = peer
+        for name in data.get("left", []):
+            self._peers.pop(name, None)
+
+        if gap:
+            await self._send(self._peer_sync_request())
+        else:
+            self._peer_epoch = data.get("epoch")
+            self._peer_version = data.get("version", 0)
+
+    async def _apply_presence(self, data: dict, joined: bool) -> None:
+        """Wendet ein peer_joined/peer_left an und prüft die Versionsfolge.
+
+        Ereignisse, die der Stand schon enthält, werden ignoriert. Fehlt
+        eines dazwischen, wird nachsynchronisiert.
+        """
+        version = data.get("version")
+        in_order = data.get("epoch") == self._peer_epoch and version == self._peer_version + 1
+        if data.get("epoch") == self._peer_epoch and version is not None and version <= self._peer_version:
+            return
+
+        peer = data.get("peer")
+        if joined:
+            self._peers[peer.get("name")] = peer
+        else:
+            self._peers.pop(peer, None)
+
+        if in_order:
+            self._peer_version = version
+        else:
+            await self._send(self._peer_sync_request())
 
     async def get_history(self, peer: str, limit: int = 50) -> list[dict]:
         """Holt den Chatverlauf mit einem Peer."""
@@ -165,12 +363,267 @@ class BridgeClient:
         # Vereinfacht: Antwort kommt über _receive_loop
         return []
 
+    async def search(
+        self,
+        query: str,
+        peer: Optional[str] = None,
+        file: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 10,
+        offset: int = 0
+    ) -> Optional[dict]:
+        """Durchsucht gespeicherte Nachrichten auf dem Bridge Server (FTS5)."""
+        response = await self._request({
+            "type": "search",
+            "query": query,
+            "peer": peer,
+            "file": file,
+            "since": since,
+            "until": until,
+            "limit": limit,
+            "offset": offset
+        })
+        if not response or response.get("type") != "search_results":
+            return None
+        return response
+
+    async def file_history(
+        self,
+        file: str,
+        prefix: bool = False,
+        lines: Optional[str] = None,
+        limit: int = 10,
+        offset: int = 0
+    ) -> Optional[dict]:
+        """Fragt Nachrichten ab, die sich auf eine Datei (oder ein Verzeichnis) beziehen."""
+        response = await self._request({
+            "type": "file_history",
+            "file": file,
+            "prefix": prefix,
+            "lines": lines,
+            "limit": limit,
+            "offset": offset
+        })
+        if not response or response.get("type") != "file_history":
+            return None
+        return response
+
+    async def unread_counts(self) -> Optional[dict]:
+        """Zählt ungelesene Nachrichten je Absender, ohne sie zu laden.
+
+        Kombiniert die lokal empfangenen, noch nicht gelesenen Nachrichten
+        mit den Zählern des Bridge Servers (noch nicht zugestellt). Offene
+        Bestätigungen gehen vorher raus, damit der Server empfangene
+        Nachrichten nicht noch einmal mitzählt.
+
+        Returns:
+            {"total": n, "senders": {Absender: n}} oder None ohne Antwort
+        """
+        await self._flush_ack()
+        response = await self._request({"type": "unread_count"}, timeout=5.0)
+        if not response or response.get("type") != "unread_count":
+            return None
+        senders = dict(response.get("senders", {}))
+        for msg in self._message_queue:
+            sender = msg.get("from", "unbekannt")
+            senders[sender] = senders.get(sender, 0) + 1
+        return {"total": sum(senders.values()), "senders": senders}
+
+    async def fetch_blob(self, ref: str) -> Optional[str]:
+        """Lädt einen ausgelagerten Inhalt vom Bridge Server nach."""
+        if ref in self._blob_cache:
+            return self._blob_cache[ref]
+
+        response = await self._request({"type": "blob_get", "ref": ref})
+        if not response or response.get("type") != "blob":
+            return None
+
+        # Kleiner FIFO-Cache, große Inhalte sollen nicht ewig im Speicher bleiben
+        if len(self._blob_cache) >= 32:
+            self._blob_cache.pop(next(iter(self._blob_cache)))
+        self._blob_cache[ref] = response["data"]
+        return response["data"]
+
+    async def resolve_payloads(self, messages: list[dict]) -> list[dict]:
+        """Ersetzt Vorschau/Referenzen großer Nachrichten durch den vollen Inhalt.
+
+        Nicht nachladbare Inhalte behalten ihre Vorschau.
+        """
+        for msg in messages:
+            if msg.get("content_ref"):
+                data = await self.fetch_blob(msg["content_ref"])
+                if data is not None:
+                    msg["content"] = data
+                    del msg["content_ref"]
+            if msg.get("context_ref"):
+                data = await self.fetch_blob(msg["context_ref"])
+                if data is not None:
+                    msg["context"] = json.loads(data)
+                    del msg["context_ref"]
+        return messages
+
+    async def fetch_context(self, peer: str, file: str, lines: Optional[str] = None) -> dict:
+        """Holt Dateiinhalt vom MCP Client eines anderen Peers (Pull statt Push).
+
+        Liegt bereits eine frühere Version vor, wird deren Hash als "base"
+        mitgeschickt; der Peer antwortet dann nur mit einem Delta.
+
+        Returns:
+            Antwort mit "content" (und ggf. "truncated"/"delta") oder "error"
+        """
+        key = (peer, file, lines)
+        cached = self._received_snapshots.get(key)
+        response = await self._request({
+            "type": "context_request",
+            "to": peer,
+            "file": file,
+            "lines": lines,
+            "base": cached[0] if cached else None
+        }, timeout=15.0)
+
+        if response is None:
+            return {"error": "Keine Antwort vom Peer"}
+        if response.get("type") == "error" or response.get("error"):
+            return {"error": response.get("error", "Unbekannter Fehler")}
+
+        if response.get("unchanged") and cached:
+            response["content"] = cached[1]
+        elif "delta" in response and cached:
+            content = "".join(_apply_delta(cached[1].splitlines(keepends=True), response["delta"]))
+            if _content_hash(content) != response.get("hash"):
+                # Basis passt nicht (mehr) - Cache verwerfen und voll nachladen
+                self._received_snapshots.pop(key, None)
+                return await self.fetch_context(peer, file, lines)
+            response["content"] = content
+        elif "content" not in response:
+            self._received_snapshots.pop(key, None)
+            return await self.fetch_context(peer, file, lines)
+
+        _remember(self._received_snapshots, key, (response.get("hash") or _content_hash(response["content"]), response["content"]))
+        return response
+
+    async def _serve_context(self, request: dict) -> None:
+        """Beantwortet einen context_request eines anderen Peers von der Platte."""
+        if self._context_sharing:
+            result = await asyncio.to_thread(self._read_context, request.get("file") or "", request.get("lines"))
+        else:
+            result = {"error": "Peer teilt keine Dateiinhalte"}
+
+        if "content" in result:
+            result = self._encode_snapshot(request, result)
+
+        await self._send({
+            "type": "context_response",
+            "to": request.get("from"),
+            "request_id": request.get("request_id"),
+            "file": request.get("file"),
+            "lines": request.get("lines"),
+            **result
+        })
+
+    def _encode_snapshot(self, request: dict, result: dict) -> dict:
+        """Ersetzt den vollen Inhalt durch ein Delta, wenn der Peer die Basis hat.
+
+        Die Basis ist der Hash, den der Empfänger in seiner Anfrage als
+        vorhanden bestätigt. Stimmt er nicht mit der zuletzt an ihn
+        gesendeten Version überein, geht der volle Inhalt raus.
+        """
+        key = (request.get("from"), request.get("file"), request.get("lines"))
+        content = result["content"]
+        digest = _content_hash(content)
+        base = request.get("base")
+        previous = self._sent_snapshots.get(key)
+        _remember(self._sent_snapshots, key, (digest, content))
+
+        if not base or not previous or previous[0] != base:
+            return {**result, "hash": digest}
+
+        encoded = {k: v for k, v in result.items() if k != "content"}
+        if base == digest:
+            return {**encoded, "hash": digest, "unchanged": True}
+
+        delta = _make_delta(previous[1].splitlines(keepends=True), content.splitlines(keepends=True))
+        if len(json.dumps(delta)) >= len(content):
+            return {**result, "hash": digest}
+        return {**encoded, "hash": digest, "base": base, "delta": delta}
+
+    def _share_context(self, file: str, lines: Optional[str]) -> None:
+        """Gibt eine geteilte Datei (bzw. einen Zeilenbereich) für context_request frei."""
+        path = (self._context_root / file).resolve()
+        if path == self._context_root or self._context_root in path.parents:
+            self._shared_context.add((path, lines or None))
+
+    def _read_context(self, file: str, lines: Optional[str]) -> dict:
+        """Liest eine geteilte Datei (optional Zeilenbereich) innerhalb des Projektverzeichnisses.
+
+        Beantwortet werden nur Dateien, die dieser Client selbst geteilt hat -
+        ganz oder genau mit diesem Zeilenbereich. Alles andere im Projekt
+        (.env, .git/config, ...) bleibt unzugänglich.
+        """
+        path = (self._context_root / file).resolve()
+        if path != self._context_root and self._context_root not in path.parents:
+            return {"error": f"Datei liegt außerhalb des Projekts: {file}"}
+        if (path, None) not in self._shared_context and (path, lines or None) not in self._shared_context:
+            return {"error": f"Datei wurde nicht geteilt: {file}"}
+        try:
+            stat = path.stat()
+        except OSError:
+            return {"error": f"Datei nicht gefunden: {file}"}
+        if not path.is_file():
+            return {"error": f"Keine Datei: {file}"}
+        if stat.st_size > CONTEXT_MAX_FILE_BYTES:
+            return {"error": f"Datei zu groß ({stat.st_size} Bytes)"}
+
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        file_lines = self._file_cache.get(key)
+        if file_lines is None:
+            try:
+                file_lines = path.read_text(errors="replace").splitlines(keepends=True)
+            except OSError as e:
+                return {"error": f"Lesen fehlgeschlagen: {e}"}
+            self._file_cache[key] = file_lines
+            if len(self._file_cache) > CONTEXT_CACHE_ENTRIES:
+                self._file_cache.popitem(last=False)
+        else:
+            self._file_cache.move_to_end(key)
+
+        if lines:
+            span = _parse_line_range(lines)
+            if span is None:
+                return {"error": f"Ungültiger Zeilenbereich: {lines}"}
+            start, end = span
+            file_lines = file_lines[start - 1:end]
+
+        content = "".join(file_lines)
+        if len(content) > CONTEXT_MAX_CHARS:
+            return {"content": content[:CONTEXT_MAX_CHARS], "truncated": True}
+        return {"content": content}
+
     def pop_messages(self) -> list[dict]:
         """Holt und leert die Nachrichtenwarteschlange."""
         messages = self._message_queue.copy()
         self._message_queue.clear()
         return messages
 
+    async def _request(self, data: dict, timeout: float = 10.0) -> Optional[dict]:
+        """Sendet eine Anfrage und wartet auf die Antwort mit gleicher request_id."""
+        if not self._connected:
+            return None
+
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            if not await self._send({**data, "request_id": request_id}):
+                return None
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Keine Antwort auf {data.get('type')} innerhalb {timeout}s")
+            return None
+        finally:
+            self._pending.pop(request_id, None)
+
     async def _send(self, data: dict) -> bool:
         """Sendet JSON-Daten über WebSocket."""
         if not self._ws:
@@ -200,38 +653,57 @@ class BridgeClient:
                     data = json.loads(raw)
                     msg_type = data.get("type")
 
+                    # Antworten auf _request() direkt zustellen
+                    future = self._pending.get(data.get("request_id") or "")
+                    if future and not future.done():
+                        future.set_result(data)
+                        continue
+
                     if msg_type == "message":
-                        self._message_queue.append(data)
-                        if self._on_message:
+                        if self._queue_message(data) and self._on_message:
                             await self._on_message(data)
+                        if data.get("seq"):
+                            self._schedule_ack(data["seq"])
 
                     elif msg_type == "unread":
                         for msg in data.get("messages", []):
-                            self._message_queue.append(msg)
+                            self._queue_message(msg)
+                        # Seite übernommen - Server darf sie als zugestellt markieren
+                        if data.get("cursor") is not None:
+                            await self._send({"type": "unread_ack", "cursor": data["cursor"]})
 
                     elif msg_type == "peer_list":
-                        self._peers = data.get("peers", [])
+                        await self._apply_peer_delta({**data, "full": True, "joined": data.get("peers", [])})
+
+                    elif msg_type == "peer_delta":
+                        await self._apply_peer_delta(data)
 
                     elif msg_type == "peer_joined":
-                        peer = data.get("peer", {})
-                        self._peers.append(peer)
-                        logger.info(f"Peer beigetreten: {peer.get('name')}")
+                        await self._apply_presence(data, joined=True)
+                        logger.info(f"Peer beigetreten: {data.get('peer', {}).get('name')}")
 
                     elif msg_type == "peer_left":
-                        peer_name = data.get("peer")
-                        self._peers = [p for p in self._peers if p.get("name") != peer_name]
-                        logger.info(f"Peer gegangen: {peer_name}")
-
-                    elif msg_type == "registered":
-                        # Server hat uns einen Namen zugewiesen
-                        assigned_name = data.get("name")
-                        if assigned_name and assigned_name != self.peer_name:
-                            logger.info(f"Server hat Namen zugewiesen: {assigned_name} (angefragt: {self.peer_name})")
-                            self.peer_name = assigned_name
+                        await self._apply_presence(data, joined=False)
+                        logger.info(f"Peer gegangen: {data.get('peer')}")
 
                     elif msg_type == "pong":
                         pass  # Heartbeat-Antwort
 
+                    elif msg_type == "sent":
+                        self._outbox.pop(data.get("client_id"), None)
+
+                    elif msg_type == "context_request":
+                        asyncio.create_task(self._serve_context(data))
+
+                    elif msg_type == "error":
+                        logger.warning(f"Fehler vom Bridge Server: {data.get('error')}")
+                        if data.get("code") == "rate_limited" and data.get("client_id") in self._outbox:
+                            # Nachricht bleibt in der Outbox und wird gedrosselt erneut gesendet
+                            self._throttle(data["client_id"], float(data.get("retry_after", 1)))
+                        elif data.get("code") == "invalid_request":
+                            # Wird nie angenommen - nicht nach dem Reconnect wiederholen
+                            self._outbox.pop(data.get("client_id"), None)
+
                 except json.JSONDecodeError:
                     logger.warning("Ungültige JSON-Nachricht empfangen")
 
@@ -242,6 +714,59 @@ class BridgeClient:
             if self._should_reconnect and not self._reconnecting:
                 asyncio.create_task(self._reconnect())
 
+    def _throttle(self, client_id: str, retry_after: float) -> None:
+        """Reiht eine vom Server gedrosselte Nachricht zum erneuten Senden ein."""
+        self._throttled[client_id] = None
+        self._throttle_delay = retry_after
+        if self._throttle_task is None or self._throttle_task.done():
+            self._throttle_task = asyncio.create_task(self._resend_throttled())
+
+    async def _resend_throttled(self) -> None:
+        """Sendet gedrosselte Nachrichten der Reihe nach im vorgegebenen Abstand.
+
+        Einzeln statt alle auf einmal - sonst würden sie gemeinsam wieder
+        am Limit abprallen.
+        """
+        while self._throttled:
+            await asyncio.sleep(self._throttle_delay * random.uniform(1.0, 1.2))
+            client_id, _ = self._throttled.popitem(last=False)
+            data = self._outbox.get(client_id)
+            if data and self._connected:
+                await self._send(data)
+
+    def _queue_message(self, msg: dict) -> bool:
+        """Reiht eine Nachricht ein, sofern sie nicht schon empfangen wurde.
+
+        Nach einem Verbindungsabbruch kann der Server unbestätigte Nachrichten
+        erneut senden; diese werden hier verworfen.
+        """
+        msg_id = msg.get("id")
+        if msg_id:
+            if msg_id in self._seen_ids:
+                return False
+            self._seen_ids[msg_id] = None
+            if len(self._seen_ids) > 1000:
+                self._seen_ids.popitem(last=False)
+        self._message_queue.append(msg)
+        return True
+
+    def _schedule_ack(self, seq: int) -> None:
+        """Bestätigt empfangene Nachrichten gebündelt (kumulativ bis seq)."""
+        self._last_seq = max(self._last_seq, seq)
+        if self._ack_task is None or self._ack_task.done():
+            self._ack_task = asyncio.create_task(self._send_ack())
+
+    async def _send_ack(self) -> None:
+        # Kurz sammeln, damit bei Bursts ein ack viele Nachrichten abdeckt
+        await asyncio.sleep(0.05)
+        await self._flush_ack()
+
+    async def _flush_ack(self) -> None:
+        """Bestätigt sofort alles bis _last_seq, falls seit dem letzten ack Neues kam."""
+        if self._last_seq > self._acked_seq:
+            self._acked_seq = self._last_seq
+            await self._send({"type": "ack", "seq": self._acked_seq})
+
     async def _ping_loop(self) -> None:
         """Sendet regelmäßig Pings."""
         while self._connected:
@@ -261,8 +786,12 @@ class BridgeClient:
 
         while not self._connected and self._should_reconnect:
             attempt += 1
-            logger.info(f"Reconnect Versuch {attempt} in {delay}s...")
-            await asyncio.sleep(delay)
+            # Vorgabe des Servers (retry_later) hat Vorrang. Der Jitter verteilt
+            # Clients, die gleichzeitig getrennt wurden, über das Zeitfenster.
+            wait = max(delay, self._retry_after or 0) * random.uniform(1.0, 1.5)
+            self._retry_after = None
+            logger.info(f"Reconnect Versuch {attempt} in {wait:.1f}s...")
+            await asyncio.sleep(wait)
 
             if not self._should_reconnect:
                 break
@@ -280,6 +809,74 @@ class BridgeClient:
         self._reconnecting = False
 
 
+def _is_local_host(host: str) -> bool:
+    """Prüft, ob host eine Adresse dieses Rechners ist (binden gelingt nur lokal)."""
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_DGRAM)
+    except OSError:
+        return False
+    for family, _, _, _, sockaddr in infos:
+        try:
+            with socket.socket(family, socket.SOCK_DGRAM) as probe:
+                probe.bind((sockaddr[0], 0))
+            return True
+        except OSError:
+            continue
+    return False
+
+
+def _content_hash(content: str) -> str:
+    """Hash einer Snapshot-Version."""
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _remember(cache: OrderedDict, key: tuple, value: tuple) -> None:
+    """Legt einen Snapshot im LRU-Cache ab."""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > CONTEXT_CACHE_ENTRIES:
+        cache.popitem(last=False)
+
+
+def _make_delta(old: list[str], new: list[str]) -> list:
+    """Zeilen-Delta: Liste von [von, bis, neue_zeilen] für geänderte Blöcke.
+
+    Alles zwischen den Blöcken wird unverändert aus old übernommen.
+    """
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    return [
+        [i1, i2, new[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def _apply_delta(old: list[str], delta: list) -> list[str]:
+    """Wendet ein Delta aus _make_delta() auf old an."""
+    result: list[str] = []
+    pos = 0
+    for start, end, lines in delta:
+        result.extend(old[pos:start])
+        result.extend(lines)
+        pos = end
+    result.extend(old[pos:])
+    return result
+
+
+def _parse_line_range(lines: str) -> Optional[tuple[int, int]]:
+    """Parst "42-58" oder "42" in (Start, Ende), 1-basiert und inklusiv."""
+    try:
+        if "-" in lines:
+            start, end = (int(part) for part in lines.split("-", 1))
+        else:
+            start = end = int(lines)
+    except ValueError:
+        return None
+    if start < 1 or end < start:
+        return None
+    return start, end
+
+
 # Globale Instanz für MCP Tools
 _client: Optional[BridgeClient] = None
 
@@ -292,11 +889,12 @@ def get_client() -> Optional[BridgeClient]:
 async def init_client(
     host: str = "192.168.0.252",
     port: int = 9999,
-    peer_name: str = "default"
+    peer_name: str = "default",
+    unix_socket: Optional[str] = None
 ) -> BridgeClient:
     """Initialisiert und verbindet den globalen Client."""
     global _client
-    _client = BridgeClient(host=host, port=port, peer_name=peer_name)
+    _client = BridgeClient(host=host, port=port, peer_name=peer_name, unix_socket=unix_socket)
     await _client.connect()
     return _client
 
@@ -20,6 +20,7 @@ import yaml
 from fastmcp import FastMCP
 
 from bridge_client import BridgeClient, get_client, init_client
+import tools
 
 # Log-Verzeichnis erstellen
 log_dir = Path.home() / ".config" / "ai-connect"
@@ -75,7 +76,8 @@ async def lifespan(app):
             client = await init_client(
                 host=host,
                 port=port,
-                peer_name=base_name
+                peer_name=base_name,
+                unix_socket=bridge.get("unix_socket")
             )
             logger.info(f"Mit Bridge verbunden als '{client.peer_name}'")
         except Exception as e:
@@ -129,19 +131,26 @@ async def peer_list() -> str:
 
 
 @mcp.tool()
-async def peer_send(to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None) -> str:
+async def peer_send(
+    to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Sendet eine Nachricht an einen anderen Peer.
 
     Args:
-        to: Name des Ziel-Peers (oder '*' für Broadcast)
+        to: Name des Ziel-Peers, '*' für Broadcast oder ein Muster
+            wie 'mini (*)' (alle Projekte auf mini) bzw. '* (AI-Connect)'
         message: Die Nachricht die gesendet werden soll
         file: Optional - Dateipfad für Kontext
         lines: Optional - Zeilennummern (z.B. "42-58")
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
 
     Beispiele:
         peer_send("mini", "Was hältst du von diesem Ansatz?")
         peer_send("Aragon", "Schau dir mal die Funktion an", file="src/api.py", lines="42-58")
         peer_send("*", "Hat jemand Zeit für ein Review?")
+        peer_send("* (AI-Connect)", "Alle im Projekt: bitte pullen")
+        peer_send("*", "Deploy läuft, bitte nicht pushen", ttl=1800)
     """
     client = get_client()
     if not client or not client.connected:
@@ -155,7 +164,7 @@ async def peer_send(to: str, message: str, file: Optional[str] = None, lines: Op
         if lines:
             context["lines"] = lines
 
-    success = await client.send_message(to, message, context)
+    success = await client.send_message(to, message, context, ttl=ttl)
     if success:
         timestamp = format_timestamp()
         return f"📤 [{timestamp}] [{client.peer_name} → {to}]: {message}"
@@ -174,7 +183,7 @@ async def peer_read() -> str:
     if not client or not client.connected:
         return "Nicht mit Bridge Server verbunden."
 
-    messages = client.pop_messages()
+    messages = await client.resolve_payloads(client.pop_messages())
     if not messages:
         return "Keine neuen Nachrichten."
 
@@ -200,6 +209,16 @@ async def peer_read() -> str:
     return "\n".join(result_lines)
 
 
+@mcp.tool()
+async def peer_unread() -> str:
+    """Zählt neue Nachrichten je Absender, ohne sie zu lesen.
+
+    Günstige Prüfung, ob sich peer_read lohnt - die Nachrichten bleiben
+    ungelesen und kosten keine Tokens.
+    """
+    return await tools.peer_unread()
+
+
 @mcp.tool()
 async def peer_history(peer: str, limit: int = 20) -> str:
     """Zeigt den Chatverlauf mit einem bestimmten Peer.
@@ -230,7 +249,9 @@ async def peer_history(peer: str, limit: int = 20) -> str:
 
 
 @mcp.tool()
-async def peer_context(file: str, lines: Optional[str] = None, message: Optional[str] = None) -> str:
+async def peer_context(
+    file: str, lines: Optional[str] = None, message: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Teilt den aktuellen Datei-Kontext mit allen Peers.
 
     Nützlich um anderen KI-Assistenten zu zeigen woran du arbeitest.
@@ -239,6 +260,8 @@ async def peer_context(file: str, lines: Optional[str] = None, message: Optional
         file: Pfad zur Datei die geteilt werden soll
         lines: Optional - Zeilennummern (z.B. "42-58")
         message: Optional - Begleitende Nachricht
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
     """
     client = get_client()
     if not client or not client.connected:
@@ -252,13 +275,74 @@ async def peer_context(file: str, lines: Optional[str] = None, message: Optional
     if lines:
         content += f" (Zeilen {lines})"
 
-    success = await client.send_message("*", content, context)
+    success = await client.send_message("*", content, context, ttl=ttl)
     if success:
         return f"Kontext geteilt: {file}"
     else:
         return "Fehler beim Teilen des Kontexts."
 
 
+@mcp.tool()
+async def peer_fetch(peer: str, file: str, lines: Optional[str] = None) -> str:
+    """Holt den Inhalt einer Datei, die ein anderer Peer geteilt hat.
+
+    Der Inhalt wird nur bei Bedarf vom MCP Client des Peers gelesen,
+    auch wenn die Datei nicht auf diesem Rechner liegt.
+
+    Args:
+        peer: Name des Peers, der die Datei geteilt hat
+        file: Dateipfad aus dem geteilten Kontext
+        lines: Optional - Zeilennummern (z.B. "42-58")
+    """
+    return await tools.peer_fetch(peer, file, lines)
+
+
+@mcp.tool()
+async def peer_search(
+    query: str,
+    peer: Optional[str] = None,
+    file: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Durchsucht frühere Nachrichten per Volltextsuche.
+
+    Liefert nach Relevanz sortierte Treffer mit Ausschnitt, statt ganze
+    Chatverläufe zu laden.
+
+    Args:
+        query: Suchbegriffe (z.B. "retry timeout")
+        peer: Optional - nur Nachrichten mit diesem Peer
+        file: Optional - nur Nachrichten mit diesem Datei-Kontext
+        since: Optional - ab Zeitpunkt (ISO, z.B. "2025-01-03")
+        until: Optional - bis Zeitpunkt (ISO, exklusiv)
+        page: Ergebnisseite (Standard: 1)
+    """
+    return await tools.peer_search(query, peer, file, since, until, page)
+
+
+@mcp.tool()
+async def peer_file_history(
+    file: str,
+    prefix: bool = False,
+    lines: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Findet frühere Nachrichten, die sich auf eine Datei beziehen.
+
+    Nutzt den Dateiindex des Bridge Servers - z.B. um frühere
+    Review-Kommentare zu einer Datei zu finden, ohne Verläufe zu laden.
+
+    Args:
+        file: Dateipfad wie im geteilten Kontext (z.B. "src/api.py")
+        prefix: file als Pfadpräfix behandeln (z.B. "src/")
+        lines: Optional - nur Nachrichten zu diesen Zeilen (z.B. "42-58")
+        page: Ergebnisseite (Standard: 1)
+    """
+    return await tools.peer_file_history(file, prefix, lines, page)
+
+
 @mcp.tool()
 async def peer_status() -> str:
     """Zeigt den Verbindungsstatus zum Bridge Server."""
@@ -267,7 +351,7 @@ async def peer_status() -> str:
         return "Client nicht initialisiert."
 
     if client.connected:
-        return f"Verbunden als '{client.peer_name}' mit Bridge Server {client.host}:{client.port}"
+        return f"Verbunden als '{client.peer_name}' mit Bridge Server {client.host}:{client.port} ({client.transport})"
     elif client.reconnecting:
         return f"Reconnect läuft... (Bridge Server: {client.host}:{client.port})"
     else:
@@ -68,7 +68,8 @@ async def lifespan(app):
             client = await init_client(
                 host=host,
                 port=port,
-                peer_name=unique_name
+                peer_name=unique_name,
+                unix_socket=bridge.get("unix_socket")
             )
             # Tatsächlicher Name kann abweichen (vom Server zugewiesen)
             logger.info(f"Mit Bridge verbunden als '{client.peer_name}'")
@@ -100,21 +101,28 @@ async def peer_list() -> str:
 
 
 @mcp.tool()
-async def peer_send(to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None) -> str:
+async def peer_send(
+    to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Sendet eine Nachricht an einen anderen Peer.
 
     Args:
-        to: Name des Ziel-Peers (oder '*' für Broadcast)
+        to: Name des Ziel-Peers, '*' für Broadcast oder ein Muster
+            wie 'mini (*)' (alle Projekte auf mini) bzw. '* (AI-Connect)'
         message: Die Nachricht die gesendet werden soll
         file: Optional - Dateipfad für Kontext
         lines: Optional - Zeilennummern (z.B. "42-58")
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
 
     Beispiele:
         peer_send("minipc", "Was hältst du von diesem Ansatz?")
         peer_send("laptop", "Schau dir mal die Funktion an", file="src/api.py", lines="42-58")
         peer_send("*", "Hat jemand Zeit für ein Review?")
+        peer_send("* (AI-Connect)", "Alle im Projekt: bitte pullen")
+        peer_send("*", "Deploy läuft, bitte nicht pushen", ttl=1800)
     """
-    return await tools.peer_send(to, message, file, lines)
+    return await tools.peer_send(to, message, file, lines, ttl)
 
 
 @mcp.tool()
@@ -127,6 +135,16 @@ async def peer_read() -> str:
     return await tools.peer_read()
 
 
+@mcp.tool()
+async def peer_unread() -> str:
+    """Zählt neue Nachrichten je Absender, ohne sie zu lesen.
+
+    Günstige Prüfung, ob sich peer_read lohnt - die Nachrichten bleiben
+    ungelesen und kosten keine Tokens.
+    """
+    return await tools.peer_unread()
+
+
 @mcp.tool()
 async def peer_history(peer: str, limit: int = 20) -> str:
     """Zeigt den Chatverlauf mit einem bestimmten Peer.
@@ -139,7 +157,9 @@ async def peer_history(peer: str, limit: int = 20) -> str:
 
 
 @mcp.tool()
-async def peer_context(file: str, lines: Optional[str] = None, message: Optional[str] = None) -> str:
+async def peer_context(
+    file: str, lines: Optional[str] = None, message: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Teilt den aktuellen Datei-Kontext mit allen Peers.
 
     Nützlich um anderen KI-Assistenten zu zeigen woran du arbeitest.
@@ -148,8 +168,71 @@ async def peer_context(file: str, lines: Optional[str] = None, message: Optional
         file: Pfad zur Datei die geteilt werden soll
         lines: Optional - Zeilennummern (z.B. "42-58")
         message: Optional - Begleitende Nachricht
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
+    """
+    return await tools.peer_context(file, lines, message, ttl)
+
+
+@mcp.tool()
+async def peer_fetch(peer: str, file: str, lines: Optional[str] = None) -> str:
+    """Holt den Inhalt einer Datei, die ein anderer Peer geteilt hat.
+
+    Der Inhalt wird nur bei Bedarf vom MCP Client des Peers gelesen,
+    auch wenn die Datei nicht auf diesem Rechner liegt.
+
+    Args:
+        peer: Name des Peers, der die Datei geteilt hat
+        file: Dateipfad aus dem geteilten Kontext
+        lines: Optional - Zeilennummern (z.B. "42-58")
+    """
+    return await tools.peer_fetch(peer, file, lines)
+
+
+@mcp.tool()
+async def peer_search(
+    query: str,
+    peer: Optional[str] = None,
+    file: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Durchsucht frühere Nachrichten per Volltextsuche.
+
+    Liefert nach Relevanz sortierte Treffer mit Ausschnitt, statt ganze
+    Chatverläufe zu laden.
+
+    Args:
+        query: Suchbegriffe (z.B. "retry timeout")
+        peer: Optional - nur Nachrichten mit diesem Peer
+        file: Optional - nur Nachrichten mit diesem Datei-Kontext
+        since: Optional - ab Zeitpunkt (ISO, z.B. "2025-01-03")
+        until: Optional - bis Zeitpunkt (ISO, exklusiv)
+        page: Ergebnisseite (Standard: 1)
+    """
+    return await tools.peer_search(query, peer, file, since, until, page)
+
+
+@mcp.tool()
+async def peer_file_history(
+    file: str,
+    prefix: bool = False,
+    lines: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Findet frühere Nachrichten, die sich auf eine Datei beziehen.
+
+    Nutzt den Dateiindex des Bridge Servers - z.B. um frühere
+    Review-Kommentare zu einer Datei zu finden, ohne Verläufe zu laden.
+
+    Args:
+        file: Dateipfad wie im geteilten Kontext (z.B. "src/api.py")
+        prefix: file als Pfadpräfix behandeln (z.B. "src/")
+        lines: Optional - nur Nachrichten zu diesen Zeilen (z.B. "42-58")
+        page: Ergebnisseite (Standard: 1)
     """
-    return await tools.peer_context(file, lines, message)
+    return await tools.peer_file_history(file, prefix, lines, page)
 
 
 @mcp.tool()
@@ -160,7 +243,7 @@ async def peer_status() -> str:
         return "Client nicht initialisiert."
 
     if client.connected:
-        return f"✅ Verbunden als '{client.peer_name}' mit Bridge Server {client.host}:{client.port}"
+        return f"✅ Verbunden als '{client.peer_name}' mit Bridge Server {client.host}:{client.port} ({client.transport})"
     elif client.reconnecting:
         return f"🔄 Reconnect läuft... (Bridge Server: {client.host}:{client.port})"
     else:
@@ -27,14 +27,19 @@ async def peer_list() -> str:
     return "\n".join(lines)
 
 
-async def peer_send(to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None) -> str:
+async def peer_send(
+    to: str, message: str, file: Optional[str] = None, lines: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Sendet eine Nachricht an einen anderen Peer.
 
     Args:
-        to: Name des Ziel-Peers (oder '*' für Broadcast)
+        to: Name des Ziel-Peers, '*' für Broadcast oder ein Muster
+            wie 'mini (*)' (alle Projekte auf mini) bzw. '* (AI-Connect)'
         message: Die Nachricht die gesendet werden soll
         file: Optional - Dateipfad für Kontext
         lines: Optional - Zeilennummern (z.B. "42-58")
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
     """
     client = get_client()
     if not client or not client.connected:
@@ -48,7 +53,7 @@ async def peer_send(to: str, message: str, file: Optional[str] = None, lines: Op
         if lines:
             context["lines"] = lines
 
-    success = await client.send_message(to, message, context)
+    success = await client.send_message(to, message, context, ttl=ttl)
     if success:
         me = client.peer_name
         return f"📤 [{me} → {to}]: {message}"
@@ -66,7 +71,7 @@ async def peer_read() -> str:
     if not client or not client.connected:
         return "❌ Nicht mit Bridge Server verbunden."
 
-    messages = client.pop_messages()
+    messages = await client.resolve_payloads(client.pop_messages())
     if not messages:
         return "📭 Keine neuen Nachrichten."
 
@@ -93,6 +98,28 @@ async def peer_read() -> str:
     return "\n".join(lines)
 
 
+async def peer_unread() -> str:
+    """Zählt neue Nachrichten je Absender, ohne sie zu lesen.
+
+    Günstige Prüfung, ob sich peer_read lohnt - die Nachrichten bleiben
+    ungelesen.
+    """
+    client = get_client()
+    if not client or not client.connected:
+        return "❌ Nicht mit Bridge Server verbunden."
+
+    counts = await client.unread_counts()
+    if counts is None:
+        return "❌ Abfrage fehlgeschlagen."
+    if not counts["total"]:
+        return "📭 Keine neuen Nachrichten."
+
+    lines = [f"📬 {counts['total']} neue Nachrichten:"]
+    for sender, n in sorted(counts["senders"].items(), key=lambda item: -item[1]):
+        lines.append(f"  - {sender}: {n}")
+    return "\n".join(lines)
+
+
 async def peer_history(peer: str, limit: int = 20) -> str:
     """Zeigt den Chatverlauf mit einem bestimmten Peer.
 
@@ -121,13 +148,17 @@ async def peer_history(peer: str, limit: int = 20) -> str:
     return "\n".join(lines)
 
 
-async def peer_context(file: str, lines: Optional[str] = None, message: Optional[str] = None) -> str:
+async def peer_context(
+    file: str, lines: Optional[str] = None, message: Optional[str] = None, ttl: Optional[int] = None
+) -> str:
     """Teilt den aktuellen Datei-Kontext mit allen Peers.
 
     Args:
         file: Pfad zur Datei die geteilt werden soll
         lines: Optional - Zeilennummern (z.B. "42-58")
         message: Optional - Begleitende Nachricht
+        ttl: Optional - Lebensdauer in Sekunden, danach wird die Nachricht
+             archiviert und gelöscht (z.B. 3600 für kurzlebige Hinweise)
     """
     client = get_client()
     if not client or not client.connected:
@@ -141,8 +172,117 @@ async def peer_context(file: str, lines: Optional[str] = None, message: Optional
     if lines:
         content += f" (Zeilen {lines})"
 
-    success = await client.send_message("*", content, context)
+    success = await client.send_message("*", content, context, ttl=ttl)
     if success:
         return f"Kontext geteilt: {file}"
     else:
         return "Fehler beim Teilen des Kontexts."
+
+
+async def peer_fetch(peer: str, file: str, lines: Optional[str] = None) -> str:
+    """Holt den Inhalt einer geteilten Datei direkt vom Peer.
+
+    Args:
+        peer: Name des Peers, der die Datei geteilt hat
+        file: Dateipfad (relativ zum Projekt des Peers)
+        lines: Optional - Zeilennummern (z.B. "42-58")
+    """
+    client = get_client()
+    if not client or not client.connected:
+        return "Nicht mit Bridge Server verbunden."
+
+    result = await client.fetch_context(peer, file, lines)
+    if result.get("error"):
+        return f"❌ {result['error']}"
+
+    header = f"📄 {file}" + (f" Z.{lines}" if lines else "") + f" von {result.get('from', peer)}"
+    if result.get("truncated"):
+        header += " (gekürzt)"
+    if result.get("unchanged"):
+        header += " (unverändert)"
+    elif result.get("delta") is not None:
+        header += " (als Delta übertragen)"
+    return f"{header}:\n```\n{result.get('content', '')}\n```"
+
+
+async def peer_search(
+    query: str,
+    peer: Optional[str] = None,
+    file: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Durchsucht frühere Nachrichten (Volltext, nach Relevanz sortiert).
+
+    Args:
+        query: Suchbegriffe (FTS5-Syntax erlaubt, z.B. "retry AND timeout")
+        peer: Optional - nur Nachrichten mit diesem Peer
+        file: Optional - nur Nachrichten mit diesem Datei-Kontext
+        since: Optional - ab Zeitpunkt (ISO, z.B. "2025-01-03")
+        until: Optional - bis Zeitpunkt (ISO, exklusiv)
+        page: Ergebnisseite (10 Treffer pro Seite)
+    """
+    client = get_client()
+    if not client or not client.connected:
+        return "Nicht mit Bridge Server verbunden."
+
+    page_size = 10
+    response = await client.search(query, peer, file, since, until, limit=page_size, offset=(max(page, 1) - 1) * page_size)
+    if response is None:
+        return "❌ Suche fehlgeschlagen."
+
+    results = response.get("results", [])
+    if not results:
+        return f"🔍 Keine Treffer für '{query}'."
+
+    lines = [f"🔍 Treffer für '{query}' (Seite {page}):"]
+    for hit in results:
+        timestamp = hit.get("timestamp", "")[:19].replace("T", " ")
+        lines.append(f"\n[{timestamp}] {hit['from']} → {hit['to']} (id {hit['id']})")
+        if hit.get("file"):
+            lines.append(f"   📎 {hit['file']}")
+        lines.append(f"   {hit.get('snippet', '')}")
+
+    if response.get("has_more"):
+        lines.append(f"\nWeitere Treffer: page={page + 1}")
+    return "\n".join(lines)
+
+
+async def peer_file_history(
+    file: str,
+    prefix: bool = False,
+    lines: Optional[str] = None,
+    page: int = 1
+) -> str:
+    """Findet frühere Nachrichten zu einer Datei (z.B. Review-Kommentare).
+
+    Args:
+        file: Dateipfad wie im geteilten Kontext (z.B. "src/api.py")
+        prefix: file als Pfadpräfix behandeln (z.B. "src/" für ein Verzeichnis)
+        lines: Optional - nur Nachrichten zu diesen Zeilen (z.B. "42-58")
+        page: Ergebnisseite (10 Nachrichten pro Seite, neueste zuerst)
+    """
+    client = get_client()
+    if not client or not client.connected:
+        return "Nicht mit Bridge Server verbunden."
+
+    page_size = 10
+    response = await client.file_history(file, prefix, lines, limit=page_size, offset=(max(page, 1) - 1) * page_size)
+    if response is None:
+        return "❌ Abfrage fehlgeschlagen."
+
+    messages = response.get("messages", [])
+    if not messages:
+        return f"📎 Keine Nachrichten zu '{file}'."
+
+    lines_out = [f"📎 Nachrichten zu '{file}' (Seite {page}):"]
+    for msg in messages:
+        timestamp = msg.get("timestamp", "")[:19].replace("T", " ")
+        location = msg["file"] + (f" Z.{msg['lines']}" if msg.get("lines") else "")
+        lines_out.append(f"\n[{timestamp}] {msg['from']} → {msg['to']} ({location})")
+        lines_out.append(f"   {msg.get('content', '')}")
+
+    if response.get("has_more"):
+        lines_out.append(f"\nWeitere Nachrichten: page={page + 1}")
+    return "\n".join(lines_out)
@@ -0,0 +1,95 @@
+"""Vergleichsbenchmark der Speicher-Backends (sqlite vs. log).
+
+Misst mit identischer Last in einem temporären Verzeichnis:
+- store: Nachrichten schreiben (90% direkt, 10% Broadcast)
+- unread: ungelesene Nachrichten je Peer holen und als zugestellt markieren
+- history: Verläufe zufälliger Peer-Paare lesen
+- reopen: Datenbestand neu öffnen (beim Log: Indizes neu aufbauen)
+
+Verwendung:
+    python -m server.bench_storage --messages 50000 --peers 20 --size 300
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from .storage import StorageBackend, create_store
+
+
+def _backend_config(name: str, root: Path, args: argparse.Namespace) -> dict:
+    if name == "log":
+        return {"backend": "log", "log_dir": str(root / "log"), "segment_bytes": args.segment_bytes}
+    return {"backend": "sqlite", "db_path": str(root / "messages.db")}
+
+
+async def _timed(results: dict, label: str, count: int, coro) -> None:
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    results[label] = (count / elapsed if elapsed else float("inf"), elapsed)
+
+
+async def bench(name: str, args: argparse.Namespace) -> dict:
+    """Führt alle Messungen für ein Backend aus."""
+    rng = random.Random(args.seed)
+    peers = [f"peer{i}" for i in range(args.peers)]
+    content = "x" * args.size
+    results: dict = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = _backend_config(name, Path(tmp), args)
+        store: StorageBackend = create_store(config)
+        await store.connect()
+
+        async def write() -> None:
+            for _ in range(args.messages):
+                sender = rng.choice(peers)
+                to_peer = "*" if rng.random() < 0.1 else rng.choice(peers)
+                await store.store(sender, to_peer, content)
+
+        async def unread() -> None:
+            for peer in peers:
+                messages = await store.get_unread(peer)
+                await store.mark_delivered([m["id"] for m in messages])
+
+        pairs = [(rng.choice(peers), rng.choice(peers)) for _ in range(args.history)]
+
+        async def history() -> None:
+            for a, b in pairs:
+                await store.get_history(a, b, 50)
+
+        await _timed(results, "store", args.messages, write())
+        await _timed(results, "unread", args.peers, unread())
+        await _timed(results, "history", len(pairs), history())
+        await store.close()
+
+        store = create_store(config)
+        await _timed(results, "reopen", 1, store.connect())
+        await store.close()
+    return results
+
+
+def main() -> None:
+    """CLI Einstiegspunkt."""
+    parser = argparse.ArgumentParser(description="AI-Connect Speicher-Backends vergleichen")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "log"], choices=["sqlite", "log"])
+    parser.add_argument("--messages", type=int, default=20000, help="Zu schreibende Nachrichten")
+    parser.add_argument("--peers", type=int, default=20)
+    parser.add_argument("--size", type=int, default=300, help="Inhaltsgröße in Zeichen")
+    parser.add_argument("--history", type=int, default=500, help="Anzahl Verlaufsabfragen")
+    parser.add_argument("--segment-bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'Backend':<8} {'Messung':<8} {'Ops/s':>12} {'Sekunden':>10}")
+    for name in args.backends:
+        for label, (rate, elapsed) in asyncio.run(bench(name, args)).items():
+            print(f"{name:<8} {label:<8} {rate:>12.0f} {elapsed:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
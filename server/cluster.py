@@ -0,0 +1,200 @@
+"""Multi-Prozess-Betrieb: mehrere Worker hinter einem Port.
+
+Aufbau:
+- Der Supervisor startet den BusHub (Unix Socket) und N Worker-Prozesse.
+- Jeder Worker ist ein vollständiger BridgeServer, alle lauschen mit
+  SO_REUSEPORT auf demselben Port; der Kernel verteilt die Verbindungen.
+- Ein Worker besitzt die bei ihm verbundenen Peers. Über den Bus tauschen
+  die Worker Presence (join/leave) und zu routende Frames aus.
+
+Bus-Protokoll: eine JSON-Nachricht pro Zeile. Der Hub setzt "source" und
+leitet an "target" weiter bzw. an alle anderen Worker, wenn kein Ziel
+angegeben ist.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from typing import Awaitable, Callable, Optional
+
+from .storage import create_store
+
+logger = logging.getLogger(__name__)
+
+# Maximale Zeilenlänge auf dem Bus (große Inhalte liegen ohnehin im Blob-Store)
+BUS_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class BusHub:
+    """Vermittelt Nachrichten zwischen den Worker-Prozessen."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._workers: dict[int, asyncio.StreamWriter] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """Startet den Unix-Socket-Server."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path, limit=BUS_LINE_LIMIT)
+
+    async def stop(self) -> None:
+        """Stoppt den Hub und entfernt den Socket."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker_id: Optional[int] = None
+        try:
+            hello = json.loads(await reader.readline())
+            worker_id = hello["worker"]
+            self._workers[worker_id] = writer
+            logger.info(f"Worker {worker_id} am Bus angemeldet")
+
+            while line := await reader.readline():
+                message = json.loads(line)
+                message["source"] = worker_id
+                await self._dispatch(message)
+        except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"Bus-Verbindung zu Worker {worker_id} fehlerhaft: {e}")
+        finally:
+            if worker_id is not None and self._workers.get(worker_id) is writer:
+                del self._workers[worker_id]
+                await self._dispatch({"op": "worker_down", "source": worker_id})
+            writer.close()
+
+    async def _dispatch(self, message: dict) -> None:
+        target = message.get("target")
+        if target is not None:
+            writers = [self._workers[target]] if target in self._workers else []
+        else:
+            writers = [w for wid, w in self._workers.items() if wid != message["source"]]
+
+        line = (json.dumps(message) + "\n").encode()
+        for writer in writers:
+            try:
+                writer.write(line)
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+
+class BusClient:
+    """Verbindung eines Workers zum BusHub."""
+
+    def __init__(self, path: str, worker_id: int, handler: Callable[[dict], Awaitable[None]]):
+        self.path = path
+        self.worker_id = worker_id
+        self._handler = handler
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> None:
+        """Verbindet zum Hub (wartet, bis dieser erreichbar ist)."""
+        for _ in range(50):
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=BUS_LINE_LIMIT)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Bus nicht erreichbar: {self.path}")
+
+        self._writer.write((json.dumps({"worker": self.worker_id}) + "\n").encode())
+        await self._writer.drain()
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    async def close(self) -> None:
+        """Trennt die Verbindung zum Hub."""
+        if self._reader_task:
+            self._reader_task.cancel()
+        if self._writer:
+            self._writer.close()
+
+    async def send(self, message: dict, target: Optional[int] = None) -> None:
+        """Sendet an einen Worker (target) oder an alle anderen."""
+        if not self._writer:
+            return
+        if target is not None:
+            message = {**message, "target": target}
+        self._writer.write((json.dumps(message) + "\n").encode())
+        await self._writer.drain()
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            try:
+                await self._handler(json.loads(line))
+            except Exception as e:
+                logger.error(f"Bus-Nachricht fehlgeschlagen: {e}")
+        logger.error("Verbindung zum Bus verloren")
+
+
+class WorkerLink:
+    """Route zu Peers, die bei einem anderen Worker verbunden sind."""
+
+    def __init__(self, bus: BusClient, worker_id: int):
+        self.bus = bus
+        self.worker_id = worker_id
+
+    async def forward(self, peer_name: str, frame: dict) -> None:
+        """Übergibt einen Frame an den Worker, der peer_name besitzt."""
+        await self.bus.send({"op": "deliver", "peer": peer_name, "frame": frame}, target=self.worker_id)
+
+
+def _worker_main(config: dict, host: str, port: int, worker_id: int, bus_path: str) -> None:
+    """Einstiegspunkt eines Worker-Prozesses."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s [%(levelname)s] [worker {worker_id}] %(message)s"
+    )
+    # Ctrl+C geht an die ganze Prozessgruppe - der Supervisor beendet die Worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from .websocket_server import BridgeServer
+
+    async def run() -> None:
+        server = BridgeServer(host=host, port=port, config=config, worker_id=worker_id, bus_path=bus_path)
+        stop_event = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+        await server.start()
+        await stop_event.wait()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+async def run_cluster(config: dict, host: str, port: int, workers: int, stop_event: asyncio.Event) -> None:
+    """Startet Bus und Worker und läuft bis stop_event gesetzt ist."""
+    bus_path = config.get("bridge", {}).get("bus_path", f"/tmp/ai-connect-bus-{port}.sock")
+    hub = BusHub(bus_path)
+    await hub.start()
+
+    # Speicher einmal vorbereiten, bevor die Worker ihn gleichzeitig öffnen
+    # (z.B. Übernahme einer messages.db in Shards)
+    store = create_store(config.get("storage", {}))
+    await store.connect()
+    await store.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_worker_main, args=(config, host, port, i, bus_path), name=f"ai-connect-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"{workers} Worker gestartet (Bus: {bus_path})")
+
+    await stop_event.wait()
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        await asyncio.to_thread(process.join, 10)
+    await hub.stop()
@@ -0,0 +1,21 @@
+"""Laden der Server-Konfiguration (config.yaml)."""
+
+from pathlib import Path
+
+import yaml
+
+
+def load_config() -> dict:
+    """Lädt die Konfiguration aus config.yaml."""
+    config_paths = [
+        Path("config.yaml"),
+        Path(__file__).parent.parent / "config.yaml",
+        Path.home() / ".config" / "ai-connect" / "config.yaml"
+    ]
+
+    for path in config_paths:
+        if path.exists():
+            with open(path) as f:
+                return yaml.safe_load(f)
+
+    return {"bridge": {"host": "0.0.0.0", "port": 9999}}
@@ -0,0 +1,38 @@
+"""Zeitfenster-Deduplizierung für wiederholte Sendeversuche."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class DedupWindow:
+    """LRU-Cache bereits verarbeiteter Client-Nachrichten-IDs.
+
+    Einträge verfallen nach window_seconds; bei mehr als max_entries
+    fliegt der älteste raus. Was hier nicht mehr steht, fängt der
+    Unique-Index in messages.db ab.
+    """
+
+    def __init__(self, max_entries: int = 10000, window_seconds: float = 600):
+        self.max_entries = max_entries
+        self.window = window_seconds
+        self._entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[Any]:
+        """Ergebnis der ersten Verarbeitung oder None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def remember(self, key: tuple, result: Any) -> None:
+        """Merkt sich das Ergebnis für key."""
+        self._entries[key] = (time.monotonic() + self.window, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
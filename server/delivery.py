@@ -0,0 +1,50 @@
+"""Gebündelte Zustellbestätigungen für den Message Store."""
+
+import asyncio
+import logging
+from typing import Optional
+
+from .storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryBatcher:
+    """Sammelt zugestellte Nachrichten-IDs und schreibt sie gebündelt.
+
+    Statt eines UPDATE+commit pro Nachricht wird geschrieben, sobald
+    batch_size IDs gesammelt sind oder flush_interval Sekunden seit der
+    ersten offenen ID vergangen sind.
+    """
+
+    def __init__(self, store: StorageBackend, batch_size: int = 100, flush_interval: float = 0.2):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: list[str] = []
+        self._timer: Optional[asyncio.Task] = None
+
+    async def add(self, message_ids: list[str]) -> None:
+        """Merkt IDs zum Markieren vor."""
+        if not message_ids:
+            return
+        self._pending.extend(message_ids)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        """Schreibt alle offenen IDs in einem UPDATE."""
+        if self._timer and not self._timer.done() and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        ids, self._pending = self._pending, []
+        if ids:
+            try:
+                await self.store.mark_delivered(ids)
+            except Exception as e:
+                logger.error(f"Zustellstatus konnte nicht geschrieben werden: {e}")
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
@@ -0,0 +1,257 @@
+"""Export des Message Stores für Auswertungen.
+
+Liest die Tabelle messages über einen laufenden SQLite-Cursor (konstanter
+Speicherbedarf, auch während der Server läuft) und schreibt nach Datum
+partitionierte Dateien:
+
+    <out>/date=YYYY-MM-DD/messages-<erste seq>.ndjson[.gz]
+    <out>/date=YYYY-MM-DD/messages-<erste seq>.parquet   (--format parquet)
+
+Der Export ist inkrementell: <out>/export_state.json merkt sich die
+zuletzt exportierte Sequenznummer (rowid), ein nächtlicher Lauf liest
+nur neue Zeilen.
+
+Mit storage.shards > 1 (messages.shards.json neben messages.db) wird
+jeder Shard exportiert. seq zählt dann pro Shard; Dateinamen und Stand
+tragen deshalb den Shard (messages-shard0-<erste seq>.ndjson).
+
+Verwendung:
+    ai-connect-export --out ~/ai-connect-export
+    ai-connect-export --out /data/export --format parquet --resolve-blobs
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterator
+
+from .config import load_config
+from .storage import shard_layout_path, shard_path
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "export_state.json"
+
+# Spalten in Exportreihenfolge (seq = rowid)
+EXPORT_COLUMNS = [
+    "seq", "id", "from", "to", "content", "context", "timestamp", "delivered",
+    "content_ref", "context_ref", "conversation", "expires_at", "client_id"
+]
+
+
+def sources(db_path: str) -> list[tuple[str, Path]]:
+    """Zu exportierende Datenbanken als (Name, Pfad): messages.db oder alle Shards."""
+    layout = shard_layout_path(db_path)
+    if not layout.exists():
+        return [("messages", Path(db_path).expanduser())]
+    shards = json.loads(layout.read_text())["shards"]
+    return [(f"messages-shard{i}", shard_path(db_path, i)) for i in range(shards)]
+
+
+def read_state(out_dir: Path) -> dict[str, int]:
+    """Zuletzt exportierte seq je Datenbank (leer wenn noch nie exportiert)."""
+    path = out_dir / STATE_FILE
+    if not path.exists():
+        return {}
+    last_seq = json.loads(path.read_text()).get("last_seq", 0)
+    # Ältere Stände kennen nur die eine messages.db
+    return last_seq if isinstance(last_seq, dict) else {"messages": last_seq}
+
+
+def write_state(out_dir: Path, last_seq: dict[str, int]) -> None:
+    """Speichert den Stand atomar (erst nach vollständig geschriebenen Dateien)."""
+    path = out_dir / STATE_FILE
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"last_seq": last_seq}))
+    os.replace(tmp, path)
+
+
+def iter_rows(db_path: Path, after: int, resolve_blobs: bool, batch_size: int) -> Iterator[dict]:
+    """Liefert Nachrichten mit seq > after in seq-Reihenfolge."""
+    # Nur lesend öffnen - im WAL-Modus blockiert das den Server nicht
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if resolve_blobs:
+            content, context = "COALESCE(b.data, m.content)", "COALESCE(bc.data, m.context)"
+            join = "LEFT JOIN blobs b ON b.hash = m.content_ref LEFT JOIN blobs bc ON bc.hash = m.context_ref"
+        else:
+            content, context, join = "m.content", "m.context", ""
+        cursor = db.execute(
+            f"""
+            SELECT m.rowid, m.id, m.from_peer, m.to_peer, {content}, {context},
+                   m.timestamp, m.delivered, m.content_ref, m.context_ref,
+                   m.conversation, m.expires_at, m.client_id
+            FROM messages m {join}
+            WHERE m.rowid > ?
+            ORDER BY m.rowid
+            """,
+            (after,)
+        )
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield dict(zip(EXPORT_COLUMNS, row))
+    finally:
+        db.close()
+
+
+class NdjsonPartitions:
+    """Offene NDJSON-Dateien je Datum (seq-Reihenfolge ist fast zeitlich,
+    es sind also selten mehr als ein, zwei Dateien gleichzeitig offen)."""
+
+    def __init__(self, out_dir: Path, name: str, compress: bool, max_open: int = 8):
+        self.out_dir = out_dir
+        self.name = name
+        self.compress = compress
+        self.max_open = max_open
+        self.files: list[Path] = []
+        self._open: dict[str, Any] = {}
+
+    def write(self, row: dict) -> None:
+        if row["context"]:
+            row = {**row, "context": json.loads(row["context"])}
+        self._handle(row["timestamp"][:10], row["seq"]).write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def _handle(self, day: str, seq: int):
+        handle = self._open.get(day)
+        if handle is None:
+            if len(self._open) >= self.max_open:
+                oldest = next(iter(self._open))
+                self._open.pop(oldest).close()
+            suffix = ".ndjson.gz" if self.compress else ".ndjson"
+            path = self.out_dir / f"date={day}" / f"{self.name}-{seq}{suffix}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Wurde die Partition in diesem Lauf schon einmal geschlossen, geht es
+            # in derselben Datei weiter
+            mode = "a" if path in self.files else "w"
+            handle = gzip.open(path, mode + "t", encoding="utf-8") if self.compress else open(path, mode, encoding="utf-8")
+            self._open[day] = handle
+            if mode == "w":
+                self.files.append(path)
+        return handle
+
+    def close(self) -> None:
+        for handle in self._open.values():
+            handle.close()
+        self._open.clear()
+
+
+class ParquetPartitions:
+    """Parquet-Dateien je Datum, geschrieben in Row Groups zu batch_size Zeilen.
+
+    Benötigt pyarrow (optional: pip install pyarrow).
+    """
+
+    def __init__(self, out_dir: Path, name: str, batch_size: int):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Für --format parquet wird pyarrow benötigt: pip install pyarrow")
+        self.pa, self.pq = pa, pq
+        self.schema = pa.schema([
+            (name, pa.int64() if name in ("seq", "delivered") else pa.string())
+            for name in EXPORT_COLUMNS
+        ])
+        self.out_dir = out_dir
+        self.name = name
+        self.batch_size = batch_size
+        self.files: list[Path] = []
+        self._writers: dict[str, Any] = {}
+        self._buffers: dict[str, list[dict]] = {}
+
+    def write(self, row: dict) -> None:
+        day = row["timestamp"][:10]
+        if day not in self._writers:
+            path = self.out_dir / f"date={day}" / f"{self.name}-{row['seq']}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._writers[day] = self.pq.ParquetWriter(path, self.schema)
+            self._buffers[day] = []
+            self.files.append(path)
+        buffer = self._buffers[day]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self._flush(day)
+
+    def _flush(self, day: str) -> None:
+        rows = self._buffers[day]
+        if rows:
+            self._writers[day].write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+            rows.clear()
+
+    def close(self) -> None:
+        for day, writer in self._writers.items():
+            self._flush(day)
+            writer.close()
+
+
+def export(
+    db_path: str,
+    out_dir: Path,
+    fmt: str = "ndjson",
+    compress: bool = False,
+    full: bool = False,
+    resolve_blobs: bool = False,
+    batch_size: int = 5000
+) -> tuple[int, dict[str, int]]:
+    """Exportiert neue Nachrichten aller Datenbanken (bzw. Shards).
+
+    Returns:
+        (Anzahl exportierter Zeilen, letzte seq je Datenbank)
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    last_seq = {} if full else read_state(out_dir)
+
+    count = 0
+    files = 0
+    for name, path in sources(db_path):
+        if fmt == "parquet":
+            partitions = ParquetPartitions(out_dir, name, batch_size)
+        else:
+            partitions = NdjsonPartitions(out_dir, name, compress)
+        try:
+            for row in iter_rows(path, last_seq.get(name, 0), resolve_blobs, batch_size):
+                partitions.write(row)
+                last_seq[name] = row["seq"]
+                count += 1
+        finally:
+            partitions.close()
+        files += len(partitions.files)
+
+    if count:
+        write_state(out_dir, last_seq)
+    logger.info(f"{count} Nachrichten exportiert (bis seq {last_seq}) in {files} Dateien")
+    return count, last_seq
+
+
+def main() -> None:
+    """CLI Einstiegspunkt."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    storage_config = load_config().get("storage", {})
+    parser = argparse.ArgumentParser(description="AI-Connect Message Store exportieren")
+    parser.add_argument("--db", default=storage_config.get("db_path", "~/.config/ai-connect/messages.db"), help="Pfad zu messages.db (Shards werden automatisch gefunden)")
+    parser.add_argument("--out", required=True, help="Zielverzeichnis")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="NDJSON gzip-komprimieren")
+    parser.add_argument("--full", action="store_true", help="Alles exportieren, nicht nur neue Zeilen")
+    parser.add_argument("--resolve-blobs", action="store_true", help="Ausgelagerte Inhalte vollständig exportieren")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Zeilen pro Lesevorgang bzw. Row Group")
+    args = parser.parse_args()
+
+    export(
+        args.db,
+        Path(args.out).expanduser(),
+        fmt=args.format,
+        compress=args.gzip,
+        full=args.full,
+        resolve_blobs=args.resolve_blobs,
+        batch_size=args.batch_size
+    )
+
+
+if __name__ == "__main__":
+    main()
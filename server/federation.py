@@ -0,0 +1,361 @@
+"""Föderation: mehrere Bridges (z.B. in getrennten LANs) verbinden.
+
+Jede Bridge ist ein Knoten mit eindeutiger node_id. Knoten verbinden sich
+über den normalen WebSocket-Port (erste Nachricht "node_hello") und
+tauschen ihr Peer-Verzeichnis aus. Beide Seiten müssen im node_hello das
+gemeinsame token aus der Konfiguration mitschicken, sonst wird der Link
+abgelehnt.
+
+Austausch:
+
+- node_directory: vollständige Liste der lokalen Peers mit Version
+- node_delta: einzelne Änderung (joined/left) mit fortlaufender Version
+- node_digest: periodischer Abgleich der Versionen (Gossip); wer eine
+  Lücke sieht, fordert per node_sync das volle Verzeichnis an
+
+Nachrichten an entfernte Peers gehen als node_forward bzw. node_fanout
+über den Link. Ist kein Link offen, werden sie gepuffert und beim
+nächsten Verbindungsaufbau nachgesendet (store-and-forward). Läuft der
+Puffer über, merkt sich der Link die Empfänger der verdrängten
+Nachrichten und sendet deren unzugestellte Nachrichten nach der
+Wiederverbindung aus der Datenbank nach. Sobald der
+Zielknoten eine Nachricht übernommen hat, speichert er sie selbst - lokal
+gilt sie dann als zugestellt. Lokale Peers werden weiterhin direkt
+zugestellt.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+from collections import deque
+from typing import Any, Optional
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+
+class NodeLink:
+    """Route zu einem anderen Bridge-Knoten (für Peer.link)."""
+
+    def __init__(self, federation: "Federation", node_id: str, backlog_size: int = 1000):
+        self.federation = federation
+        self.node_id = node_id
+        self.version = 0  # Zuletzt übernommene Verzeichnis-Version des Knotens
+        self._sockets: list[Any] = []
+        self._backlog: deque[dict] = deque(maxlen=backlog_size)
+        # Empfänger, deren node_forward aus dem vollen Puffer verdrängt wurde
+        self._replay: set[str] = set()
+        self._dropped = 0
+        self._expiry: Optional[asyncio.Task] = None
+
+    @property
+    def up(self) -> bool:
+        return bool(self._sockets)
+
+    def attach(self, websocket: Any) -> None:
+        self._sockets.append(websocket)
+        if self._expiry:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def detach(self, websocket: Any) -> None:
+        if websocket in self._sockets:
+            self._sockets.remove(websocket)
+
+    def schedule_expiry(self) -> None:
+        """Entfernt die Peers des Knotens nach link_grace, falls er nicht zurückkommt."""
+        if self._expiry is None or self._expiry.done():
+            self._expiry = asyncio.create_task(self.federation.expire(self))
+
+    async def forward(self, peer_name: str, frame: dict) -> bool:
+        """Übergibt einen Frame an den Knoten, bei dem peer_name verbunden ist.
+
+        Returns:
+            True wenn der Frame gesendet wurde, False wenn er gepuffert ist
+        """
+        return await self.send({"type": "node_forward", "peer": peer_name, "frame": await self.federation.inline(frame)})
+
+    async def fanout(self, frame: dict, exclude: Optional[str]) -> None:
+        """Broadcast an alle Peers des Knotens."""
+        await self.send({"type": "node_fanout", "exclude": exclude, "frame": await self.federation.inline(frame)})
+
+    async def send(self, data: dict) -> bool:
+        """Sendet über einen offenen Link oder puffert zustellrelevante Frames.
+
+        Returns:
+            True wenn der Frame gesendet wurde
+        """
+        raw = json.dumps(data)
+        for websocket in reversed(self._sockets):
+            try:
+                await websocket.send(raw)
+                return True
+            except Exception:
+                self.detach(websocket)
+
+        if data["type"] in ("node_forward", "node_fanout"):
+            if len(self._backlog) == self._backlog.maxlen:
+                self._drop(self._backlog.popleft())
+            self._backlog.append(data)
+            self.federation.server.metrics.incr("federation_buffered")
+        return False
+
+    def _drop(self, data: dict) -> None:
+        """Verdrängt den ältesten gepufferten Frame.
+
+        Direkte Nachrichten bleiben unzugestellt in der Datenbank und werden
+        nach der Wiederverbindung von dort nachgesendet; Broadcasts gehen
+        für diesen Knoten verloren.
+        """
+        self.federation.server.metrics.incr("federation_dropped")
+        if not self._dropped:
+            logger.warning(f"Föderation: Puffer für {self.node_id} voll, verdränge älteste Frames")
+        self._dropped += 1
+        if data["type"] == "node_forward":
+            self._replay.add(data["peer"])
+
+    async def flush_backlog(self) -> None:
+        """Sendet gepufferte Frames nach Wiederverbindung, danach verdrängte
+        Nachrichten aus der Datenbank."""
+        while self._backlog and self.up:
+            data = self._backlog.popleft()
+            if await self.send(data) and data["type"] == "node_forward":
+                await self.federation.handed_over(data["frame"])
+        if self._dropped and self.up:
+            logger.info(f"Föderation: {self._dropped} verdrängte Frames für {self.node_id}, sende aus der Datenbank nach")
+            self._dropped = 0
+        if self._replay and self.up:
+            await self.federation.replay(self, self._replay)
+
+
+class Federation:
+    """Verwaltet Links zu anderen Bridges und deren Peer-Verzeichnisse."""
+
+    def __init__(self, server: Any, config: dict):
+        self.server = server
+        self.node_id: str = config["node_id"]
+        self.token: str = config.get("token") or ""
+        self.seeds: list[str] = config.get("peers", [])
+        self.gossip_interval = config.get("gossip_interval", 30)
+        self.link_grace = config.get("link_grace", 60)
+        self.backlog_size = config.get("backlog_size", 1000)
+        self.version = 0  # Version des eigenen Verzeichnisses
+        self._links: dict[str, NodeLink] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Baut Links zu den konfigurierten Knoten auf und startet den Gossip."""
+        for url in self.seeds:
+            self._tasks.append(asyncio.create_task(self._dial(url)))
+        self._tasks.append(asyncio.create_task(self._gossip_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    # --- Verbindungsaufbau ---
+
+    async def _dial(self, url: str) -> None:
+        """Hält eine ausgehende Verbindung zu einem anderen Knoten offen."""
+        delay = 1.0
+        while True:
+            try:
+                async with websockets.connect(url, ping_interval=30, ping_timeout=60) as websocket:
+                    await websocket.send(json.dumps(self._hello()))
+                    hello = json.loads(await websocket.recv())
+                    if hello.get("type") != "node_hello":
+                        raise ConnectionError(f"Kein Bridge-Knoten: {url}")
+                    if not self._authorized(hello):
+                        raise ConnectionError(f"Ungültiges Föderations-Token von {url}")
+                    delay = 1.0
+                    await self._serve(websocket, hello["node"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Föderation: {url} nicht erreichbar ({e})")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def accept(self, websocket: Any, hello: dict) -> None:
+        """Übernimmt eine eingehende Knoten-Verbindung (erste Nachricht node_hello)."""
+        if not self._authorized(hello):
+            logger.warning(f"Föderation: node_hello von {hello.get('node')} mit ungültigem Token abgelehnt")
+            await websocket.send(json.dumps({"type": "error", "code": "unauthorized", "error": "Ungültiges Föderations-Token"}))
+            await websocket.close()
+            return
+        await websocket.send(json.dumps(self._hello()))
+        try:
+            await self._serve(websocket, hello["node"])
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _serve(self, websocket: Any, node_id: str) -> None:
+        if node_id == self.node_id:
+            raise ConnectionError("Verbindung zu sich selbst")
+
+        link = self._links.get(node_id)
+        if link is None:
+            link = self._links[node_id] = NodeLink(self, node_id, self.backlog_size)
+        link.attach(websocket)
+        logger.info(f"Föderation: Link zu {node_id} aufgebaut")
+
+        try:
+            await link.send(self._directory())
+            await link.flush_backlog()
+            async for raw in websocket:
+                try:
+                    await self._handle(link, json.loads(raw))
+                except json.JSONDecodeError:
+                    logger.warning(f"Föderation: ungültige Nachricht von {node_id}")
+        finally:
+            link.detach(websocket)
+            if not link.up:
+                logger.warning(f"Föderation: Link zu {node_id} getrennt, puffere Nachrichten")
+                link.schedule_expiry()
+
+    def _hello(self) -> dict:
+        return {"type": "node_hello", "node": self.node_id, "token": self.token}
+
+    def _authorized(self, hello: dict) -> bool:
+        """Prüft das gemeinsame Token (ohne konfiguriertes Token: keine Links)."""
+        token = hello.get("token")
+        if not self.token or not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    async def expire(self, link: NodeLink) -> None:
+        """Entfernt die Peers eines Knotens, wenn der Link zu lange weg ist."""
+        await asyncio.sleep(self.link_grace)
+        if not link.up:
+            removed = await self.server.registry.remove_link(link)
+            link.version = 0
+            logger.info(f"Föderation: {len(removed)} Peers von {link.node_id} entfernt")
+
+    # --- Verzeichnis ---
+
+    def _directory(self) -> dict:
+        return {
+            "type": "node_directory",
+            "node": self.node_id,
+            "version": self.version,
+            "peers": [p.describe() for p in self.server.registry.local_peers()]
+        }
+
+    async def local_changed(self, peer: Any, joined: bool) -> None:
+        """Meldet eine lokale Presence-Änderung als Delta an alle Knoten."""
+        self.version += 1
+        delta = {"type": "node_delta", "node": self.node_id, "version": self.version}
+        if joined:
+            delta["joined"] = [peer.describe()]
+        else:
+            delta["left"] = [peer.name]
+        for link in self._links.values():
+            if link.up:
+                await link.send(delta)
+
+    async def _handle(self, link: NodeLink, data: dict) -> None:
+        msg_type = data.get("type")
+        registry = self.server.registry
+
+        if msg_type == "node_directory":
+            peers = {p["name"]: p for p in data.get("peers", [])}
+            known = {p.name for p in registry.peers_via(link)}
+            for name in known - peers.keys():
+                await registry.unregister_remote(name, link)
+            for name in peers.keys() - known:
+                await self._add_remote(link, peers[name])
+            link.version = data.get("version", 0)
+
+        elif msg_type == "node_delta":
+            if data.get("version") != link.version + 1:
+                # Lücke im Verlauf - volles Verzeichnis anfordern
+                await link.send({"type": "node_sync"})
+                return
+            for info in data.get("joined", []):
+                await self._add_remote(link, info)
+            for name in data.get("left", []):
+                await registry.unregister_remote(name, link)
+            link.version = data["version"]
+
+        elif msg_type == "node_sync":
+            await link.send(self._directory())
+
+        elif msg_type == "node_digest":
+            if data.get("version") != link.version:
+                await link.send({"type": "node_sync"})
+
+        elif msg_type == "node_forward":
+            await self.server.deliver_forwarded(data.get("peer", ""), data.get("frame", {}), persist=True)
+
+        elif msg_type == "node_fanout":
+            await self.server.fanout_forwarded(data.get("frame", {}), data.get("exclude"), persist=True)
+
+    async def _add_remote(self, link: NodeLink, info: dict) -> None:
+        peer = await self.server.registry.register_remote(
+            info["name"], info.get("ip", ""), link,
+            project=info.get("project"),
+            machine=info.get("machine"),
+            connected_at=info.get("connected_at"),
+            replace_local=False
+        )
+        if peer is None:
+            logger.warning(f"Föderation: {info['name']} ist lokal verbunden, Eintrag von {link.node_id} ignoriert")
+
+    async def _gossip_loop(self) -> None:
+        """Verteilt regelmäßig die eigene Version, damit verpasste Deltas auffallen."""
+        while True:
+            await asyncio.sleep(self.gossip_interval)
+            digest = {"type": "node_digest", "node": self.node_id, "version": self.version}
+            for link in self._links.values():
+                if link.up:
+                    await link.send(digest)
+
+    # --- Weiterleitung ---
+
+    async def fanout(self, frame: dict, exclude: Optional[str]) -> None:
+        """Broadcast an alle anderen Knoten (einmal pro Knoten)."""
+        for link in self._links.values():
+            await link.fanout(frame, exclude)
+
+    async def replay(self, link: NodeLink, peers: set[str]) -> None:
+        """Sendet die unzugestellten Nachrichten an peers (Peers des Knotens)
+        aus der Datenbank über den Link; erledigte Peers werden aus peers entfernt."""
+        # Gerade übergebene Nachrichten erst als zugestellt schreiben, sonst
+        # kämen sie doppelt (der Zielknoten würde sie anhand der ID verwerfen)
+        await self.server.deliveries.flush()
+        while peers and link.up:
+            name = peers.pop()
+            for message in await self.server.store.get_unread(name):
+                if message["to"] != name:
+                    continue
+                frame = {"type": "message", **message}
+                if not await link.forward(name, frame):
+                    # Link wieder weg - der Rest kommt beim nächsten Mal
+                    peers.add(name)
+                    return
+                await self.handed_over(frame)
+
+    async def handed_over(self, frame: dict) -> None:
+        """Markiert eine vom Zielknoten übernommene Nachricht lokal als zugestellt."""
+        if frame.get("type") == "message" and frame.get("id"):
+            await self.server.deliveries.add([frame["id"]])
+
+    async def inline(self, frame: dict) -> dict:
+        """Ersetzt Blob-Referenzen durch den Inhalt - der Zielknoten hat sie nicht."""
+        if frame.get("type") != "message" or not (frame.get("content_ref") or frame.get("context_ref")):
+            return frame
+        frame = dict(frame)
+        store = self.server.store
+        if frame.get("content_ref"):
+            data = await store.get_blob(frame.pop("content_ref"))
+            frame.pop("content_size", None)
+            if data is not None:
+                frame["content"] = data
+        if frame.get("context_ref"):
+            data = await store.get_blob(frame.pop("context_ref"))
+            if data is not None:
+                frame["context"] = json.loads(data)
+        return frame
+
@@ -0,0 +1,128 @@
+"""Firehose für Observer (z.B. chat_viewer.py).
+
+Observer sind keine Peers: sie tauchen nicht in der Peer-Liste auf und
+bekommen keine Nachrichten zugestellt. Stattdessen sehen sie eine Kopie
+aller gerouteten Nachrichten und Presence-Ereignisse.
+
+Jeder Observer hat eine eigene, begrenzte Warteschlange. Ist sie voll,
+werden die ältesten Ereignisse verworfen - das Routing wartet nie auf
+einen langsamen Observer. Filter wirken serverseitig, damit über eine
+langsame Leitung nur ankommt, was auch angezeigt wird:
+
+    {"peers": ["mini (*)", "Aragon*"],   # Absender oder Empfänger (Glob)
+     "channels": ["direct", "broadcast", "pattern"],
+     "types": ["message", "peer_joined", "peer_left"]}
+
+Fehlt ein Filter, gilt er als "alles".
+"""
+
+import asyncio
+import logging
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Awaitable, Callable, Optional
+
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+def channel_of(frame: dict) -> str:
+    """Kanal einer Nachricht: direct, broadcast oder pattern."""
+    if frame.get("to") == "*":
+        return "broadcast"
+    if frame.get("via"):
+        return "pattern"
+    return "direct"
+
+
+class Observer:
+    """Ein angemeldeter Observer mit Filtern und verlustbehafteter Warteschlange."""
+
+    def __init__(self, send: Callable[[dict], Awaitable[None]], filters: Optional[dict], queue_size: int):
+        self._send = send
+        self._queue: deque[dict] = deque(maxlen=queue_size)
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.set_filters(filters)
+        self._task = asyncio.create_task(self._run())
+
+    def set_filters(self, filters: Optional[dict]) -> None:
+        filters = filters or {}
+        self.peers: Optional[list[str]] = filters.get("peers") or None
+        self.channels: Optional[set[str]] = set(filters["channels"]) if filters.get("channels") else None
+        self.types: Optional[set[str]] = set(filters["types"]) if filters.get("types") else None
+
+    def matches(self, event: dict) -> bool:
+        """Prüft die Filter gegen ein Ereignis."""
+        if self.types and event.get("type") not in self.types:
+            return False
+        if event.get("type") == "message":
+            if self.channels and channel_of(event) not in self.channels:
+                return False
+            names = [event.get("from") or "", event.get("to") or "", *event.get("recipients", [])]
+        else:
+            peer = event.get("peer")
+            names = [peer.get("name", "") if isinstance(peer, dict) else peer or ""]
+        if self.peers and not any(fnmatchcase(n, p) for n in names for p in self.peers):
+            return False
+        return True
+
+    def offer(self, event: dict) -> bool:
+        """Reiht ein Ereignis ein; bei voller Warteschlange fliegt das älteste raus.
+
+        Returns False, wenn dafür ein Ereignis verworfen wurde.
+        """
+        lossless = len(self._queue) < (self._queue.maxlen or 0)
+        if not lossless:
+            self.dropped += 1
+        self._queue.append(event)
+        self._ready.set()
+        return lossless
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            try:
+                if self.dropped:
+                    # Observer über die Lücke informieren
+                    dropped, self.dropped = self.dropped, 0
+                    await self._send({"type": "tap_dropped", "count": dropped})
+                await self._send(self._queue.popleft())
+            except Exception as e:
+                logger.debug(f"Observer nicht erreichbar: {e}")
+                return
+
+
+class Firehose:
+    """Verteilt Ereignisse an alle Observer, ohne den Aufrufer zu blockieren."""
+
+    def __init__(self, metrics: Metrics, queue_size: int = 1000):
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self._observers: list[Observer] = []
+
+    def __len__(self) -> int:
+        return len(self._observers)
+
+    def add(self, send: Callable[[dict], Awaitable[None]], filters: Optional[dict] = None) -> Observer:
+        observer = Observer(send, filters, self.queue_size)
+        self._observers.append(observer)
+        return observer
+
+    def remove(self, observer: Observer) -> None:
+        if observer in self._observers:
+            self._observers.remove(observer)
+        observer.close()
+
+    def publish(self, event: dict) -> None:
+        """Gibt ein Ereignis an alle passenden Observer (synchron, nie wartend)."""
+        for observer in self._observers:
+            if observer.matches(event) and not observer.offer(event):
+                self.metrics.incr("tap_dropped")
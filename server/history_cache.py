@@ -0,0 +1,117 @@
+"""Cache für die letzten Nachrichten aktiver Konversationen.
+
+Assistenten fragen immer wieder die letzten 20-50 Nachrichten derselben
+wenigen Konversationen ab. Der Cache hält pro Konversation das Ende des
+Verlaufs (bis zu tail Nachrichten) und wird beim Routing fortgeschrieben,
+Treffer brauchen also keinen Datenbankzugriff.
+
+Verdrängt wird nach Speicherbedarf (max_bytes, geschätzt aus den
+Inhaltslängen) in LRU-Reihenfolge. Treffer und Fehlschläge zählen als
+history_cache_hits / history_cache_misses in den Metriken.
+"""
+
+import json
+from collections import OrderedDict, deque
+from typing import Optional
+
+from .metrics import Metrics
+from .storage import conversation_key
+
+# Geschätzter Grundbedarf einer Nachricht im Speicher (Dict, IDs, Zeitstempel)
+_MESSAGE_OVERHEAD = 400
+
+
+def _size(message: dict) -> int:
+    context = message.get("context")
+    return _MESSAGE_OVERHEAD + len(message.get("content") or "") + (len(json.dumps(context)) if context else 0)
+
+
+class _Tail:
+    """Ende eines Verlaufs, alt -> neu."""
+
+    def __init__(self, messages: list[dict], complete: bool, tail: int):
+        self.messages: deque[dict] = deque(messages[-tail:], maxlen=tail)
+        # Der ganze Verlauf ist kürzer als tail - jede Anfrage ist ein Treffer
+        self.complete = complete and len(messages) <= tail
+        self.bytes = sum(_size(m) for m in self.messages)
+
+
+class HistoryCache:
+    """LRU-Cache der Verlaufsenden, begrenzt über den Speicherbedarf."""
+
+    def __init__(self, metrics: Metrics, max_bytes: int = 8 * 1024 * 1024, tail: int = 50):
+        self.metrics = metrics
+        self.max_bytes = max_bytes
+        self.tail = tail
+        self.bytes = 0
+        self._tails: OrderedDict[str, _Tail] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _key(self, peer1: str, peer2: str) -> Optional[str]:
+        # Broadcasts teilen sich einen Schlüssel über alle Absender - nicht cachen
+        if not self.enabled or not peer1 or not peer2 or "*" in (peer1, peer2):
+            return None
+        return conversation_key(peer1, peer2)
+
+    def get(self, peer1: str, peer2: str, limit: int) -> Optional[list[dict]]:
+        """Die letzten limit Nachrichten, oder None wenn die Datenbank gefragt ist."""
+        key = self._key(peer1, peer2)
+        if key is None:
+            return None
+        tail = self._tails.get(key)
+        if tail is None or (limit > len(tail.messages) and not tail.complete):
+            self.metrics.incr("history_cache_misses")
+            return None
+        self._tails.move_to_end(key)
+        self.metrics.incr("history_cache_hits")
+        return list(tail.messages)[-limit:] if limit > 0 else []
+
+    def fill(self, peer1: str, peer2: str, messages: list[dict], limit: int) -> None:
+        """Übernimmt ein Ergebnis von get_history (angefragt mit limit)."""
+        key = self._key(peer1, peer2)
+        if key is None:
+            return
+        self._drop(key)
+        tail = _Tail(messages, complete=len(messages) < limit, tail=self.tail)
+        self._tails[key] = tail
+        self.bytes += tail.bytes
+        self._evict()
+
+    def append(self, message: dict) -> None:
+        """Schreibt eine neu gespeicherte Nachricht fort (nur bereits gecachte Verläufe)."""
+        key = self._key(message["from"], message["to"])
+        tail = self._tails.get(key) if key else None
+        if tail is None:
+            return
+        if len(tail.messages) == tail.messages.maxlen:
+            self.bytes -= _size(tail.messages[0])
+            tail.bytes -= _size(tail.messages[0])
+            tail.complete = False
+        tail.messages.append(message)
+        size = _size(message)
+        tail.bytes += size
+        self.bytes += size
+        self._evict()
+
+    def invalidate(self, peer1: str, peer2: str) -> None:
+        key = self._key(peer1, peer2)
+        if key:
+            self._drop(key)
+
+    def clear(self) -> None:
+        self._tails.clear()
+        self.bytes = 0
+
+    def _drop(self, key: str) -> None:
+        tail = self._tails.pop(key, None)
+        if tail:
+            self.bytes -= tail.bytes
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self._tails:
+            _, tail = self._tails.popitem(last=False)
+            self.bytes -= tail.bytes
+            self.metrics.incr("history_cache_evictions")
@@ -0,0 +1,484 @@
+"""Append-only Log als Speicher-Backend (storage.backend: log).
+
+Nachrichten werden nur angehängt, nie an Ort und Stelle geändert. Das Log
+besteht aus Segmenten (segment_bytes groß, per mmap gelesen und beschrieben):
+
+    <log_dir>/segment-000001.log
+    <log_dir>/segment-000002.log   <- aktives Segment
+
+Jeder Eintrag ist Länge (4 Byte) + CRC32 (4 Byte) + JSON. Zustellungen
+werden als eigene "ack"-Einträge angehängt. Beim Start wird das Log einmal
+gelesen und daraus die Indizes im Speicher aufgebaut:
+
+- seq -> Segment und Offset des Eintrags
+- Konversation -> seqs (Historie)
+- Empfänger -> ungelesene seqs (Offline-Zustellung)
+
+Ist das aktive Segment voll, beginnt ein neues. Versiegelte Segmente, in
+denen der Anteil überholter Einträge (acks, abgelaufene TTL) compact_ratio
+übersteigt, werden im Hintergrund neu geschrieben: der Zustellstatus steht
+dann direkt im Nachrichteneintrag, abgelaufene Nachrichten entfallen.
+
+Schreibvorgänge landen im Page Cache und überstehen einen Absturz des
+Prozesses, ohne sync aber nicht unbedingt einen Stromausfall. Die
+Indizes liegen im Prozess - das Backend ist nur für den Ein-Prozess-Betrieb
+gedacht (bridge.workers: 1). Volltextsuche und Blob-Store gibt es nicht.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from datetime import timedelta
+from heapq import merge
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .message_store import _EPOCH, _new_message_id, _utc_timestamp
+from .storage import DuplicateMessageError, StorageBackend, UnreadCounters, conversation_key
+
+logger = logging.getLogger(__name__)
+
+# Länge und CRC32 des JSON-Inhalts
+_HEADER = struct.Struct("<II")
+
+
+def _encode(record: dict) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class Segment:
+    """Eine Segmentdatei, per mmap eingeblendet.
+
+    Aktive Segmente sind auf capacity vorbelegt und beschreibbar; nach dem
+    Versiegeln wird die Datei auf die tatsächlich belegte Größe gekürzt.
+    """
+
+    def __init__(self, path: Path, number: int, capacity: Optional[int] = None):
+        self.path = path
+        self.number = number
+        self.end = 0          # Ende der gültigen Einträge
+        self.reclaimable = 0  # Bytes, die eine Kompaktierung freigeben würde
+        self._file = open(path, "r+b" if path.exists() else "w+b")
+        self._map: Optional[mmap.mmap] = None
+        self._open(capacity)
+
+    def _open(self, capacity: Optional[int]) -> None:
+        self.writable = capacity is not None
+        size = os.fstat(self._file.fileno()).st_size
+        if capacity is not None and capacity > size:
+            self._file.truncate(capacity)
+            size = capacity
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+        self._map = mmap.mmap(self._file.fileno(), size, access=access) if size else None
+
+    @property
+    def capacity(self) -> int:
+        return len(self._map) if self._map else 0
+
+    def scan(self) -> Iterator[tuple[int, int, dict]]:
+        """Liefert (Offset, Größe, Eintrag) bis zum ersten leeren oder
+        beschädigten Eintrag (z.B. abgebrochener Schreibvorgang) und setzt end."""
+        offset = 0
+        while offset + _HEADER.size <= self.capacity:
+            length, crc = _HEADER.unpack_from(self._map, offset)
+            start = offset + _HEADER.size
+            if length == 0 or start + length > self.capacity:
+                break
+            payload = self._map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                logger.warning(f"{self.path.name}: beschädigter Eintrag bei Offset {offset}, Rest wird ignoriert")
+                break
+            yield offset, _HEADER.size + length, json.loads(payload)
+            offset = start + length
+        self.end = offset
+
+    def fits(self, size: int) -> bool:
+        return self.writable and self.end + size <= self.capacity
+
+    def append(self, data: bytes) -> int:
+        """Hängt einen kodierten Eintrag an und gibt seinen Offset zurück."""
+        offset = self.end
+        self._map[offset:offset + len(data)] = data
+        self.end += len(data)
+        # Endmarke, falls hier vorher ein abgebrochener Eintrag stand
+        if self.end + _HEADER.size <= self.capacity:
+            self._map[self.end:self.end + _HEADER.size] = bytes(_HEADER.size)
+        return offset
+
+    def read(self, offset: int) -> dict:
+        length, _ = _HEADER.unpack_from(self._map, offset)
+        start = offset + _HEADER.size
+        return json.loads(self._map[start:start + length])
+
+    def flush(self) -> None:
+        if self._map and self.writable:
+            self._map.flush()
+
+    def seal(self) -> None:
+        """Schreibt aus, kürzt die Datei auf end und blendet sie nur lesend ein."""
+        self.flush()
+        if self._map:
+            self._map.close()
+        self._file.truncate(self.end)
+        self._open(None)
+
+    def close(self) -> None:
+        self.flush()
+        if self._map:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class LogStore(StorageBackend):
+    """Speicher-Backend auf Basis eines segmentierten Append-only Logs."""
+
+    supports_paging = True
+    supports_scrollback = True
+    supports_unread_counts = True
+
+    def __init__(
+        self,
+        log_dir: str = "~/.config/ai-connect/messages.log",
+        segment_bytes: int = 64 * 1024 * 1024,
+        compact_ratio: float = 0.5,
+        sync: bool = False
+    ):
+        self.log_dir = Path(log_dir).expanduser()
+        self.segment_bytes = segment_bytes
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        self._segments: dict[int, Segment] = {}
+        self._active: Optional[Segment] = None
+        self._next_seq = 1
+        # seq -> (Segment, Offset, Empfänger, Größe)
+        self._index: dict[int, tuple[int, int, str, int]] = {}
+        self._order: list[int] = []  # alle seqs aufsteigend
+        self._ids: dict[str, int] = {}
+        self._conversations: dict[str, list[int]] = {}
+        self._unread: dict[str, dict[int, str]] = {}  # Empfänger -> seq -> Absender (geordnet)
+        self._unread_counts = UnreadCounters()
+        self._expires: dict[int, int] = {}  # seq -> Ablauf in ms
+        self._client_ids: dict[tuple[str, str, str], str] = {}
+        self._compaction: Optional[asyncio.Task] = None
+
+    # --- Öffnen und Schließen ---
+
+    async def connect(self) -> None:
+        """Liest das Log ein und baut die Indizes auf."""
+        await asyncio.to_thread(self._load)
+        logger.info(
+            f"Log-Store: {len(self._index)} Nachrichten in {len(self._segments)} Segmenten ({self.log_dir})"
+        )
+        self._schedule_compaction()
+
+    def _load(self) -> None:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        paths = sorted(self.log_dir.glob("segment-*.log"))
+        for i, path in enumerate(paths):
+            number = int(path.stem.split("-")[1])
+            last = i == len(paths) - 1
+            # Das letzte Segment wird weiterbeschrieben
+            segment = Segment(path, number, capacity=self.segment_bytes if last else None)
+            for offset, size, record in segment.scan():
+                self._apply(segment, offset, size, record)
+            self._segments[number] = segment
+            if last:
+                self._active = segment
+        if self._active is None:
+            self._roll()
+
+    async def close(self) -> None:
+        if self._compaction:
+            self._compaction.cancel()
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+        self._active = None
+
+    def _apply(self, segment: Segment, offset: int, size: int, record: dict) -> None:
+        """Übernimmt einen gelesenen Eintrag in die Indizes."""
+        if record["op"] == "msg":
+            seq = record["seq"]
+            self._add_to_index(seq, segment.number, offset, size, record)
+            if not record.get("delivered"):
+                self._unread.setdefault(record["to"], {})[seq] = record["from"]
+                self._unread_counts.add(record["to"], record["from"])
+            self._next_seq = max(self._next_seq, seq + 1)
+        elif record["op"] == "ack":
+            for seq in record["seqs"]:
+                entry = self._index.get(seq)
+                if entry:
+                    self._mark_read(entry[2], seq)
+            segment.reclaimable += size
+
+    def _add_to_index(self, seq: int, segment: int, offset: int, size: int, record: dict) -> None:
+        self._index[seq] = (segment, offset, record["to"], size)
+        if not self._order or seq > self._order[-1]:
+            self._order.append(seq)
+        else:
+            bisect.insort(self._order, seq)
+        self._ids[record["id"]] = seq
+        self._conversations.setdefault(conversation_key(record["from"], record["to"]), []).append(seq)
+        if record.get("expires_ms"):
+            self._expires[seq] = record["expires_ms"]
+        if record.get("client_id"):
+            self._client_ids[(record["from"], record["client_id"], record["to"])] = record["id"]
+
+    # --- Schreiben ---
+
+    def _append(self, record: dict) -> tuple[Segment, int, int]:
+        data = _encode(record)
+        if not self._active.fits(len(data)):
+            self._roll(len(data))
+            self._schedule_compaction()
+        offset = self._active.append(data)
+        if self.sync:
+            self._active.flush()
+        return self._active, offset, len(data)
+
+    def _roll(self, needed: int = 0) -> None:
+        """Versiegelt das aktive Segment und beginnt ein neues."""
+        if self._active:
+            self._active.seal()
+        number = max(self._segments, default=0) + 1
+        path = self.log_dir / f"segment-{number:06d}.log"
+        # Einzelne Einträge über segment_bytes bekommen ein passend großes Segment
+        self._active = Segment(path, number, capacity=max(self.segment_bytes, needed + _HEADER.size))
+        self._segments[number] = self._active
+
+    async def store(
+        self,
+        from_peer: str,
+        to_peer: str,
+        content: str,
+        context: Optional[dict] = None,
+        prepared: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        client_id: Optional[str] = None
+    ) -> str:
+        """Hängt eine Nachricht an und gibt die ID zurück.
+
+        Raises:
+            DuplicateMessageError: client_id wurde für diesen Empfänger schon gespeichert
+        """
+        if client_id and (from_peer, client_id, to_peer) in self._client_ids:
+            raise DuplicateMessageError(self._client_ids[(from_peer, client_id, to_peer)])
+
+        ts_ms = time.time_ns() // 1_000_000
+        seq = self._next_seq
+        self._next_seq += 1
+        record = {
+            "op": "msg",
+            "seq": seq,
+            "id": _new_message_id(ts_ms),
+            "from": from_peer,
+            "to": to_peer,
+            "content": content,
+            "context": context,
+            "timestamp": _utc_timestamp(_EPOCH + timedelta(milliseconds=ts_ms)),
+            "ts_ms": ts_ms,
+            "delivered": 0
+        }
+        if ttl:
+            record["expires_ms"] = ts_ms + ttl * 1000
+        if client_id:
+            record["client_id"] = client_id
+
+        segment, offset, size = self._append(record)
+        self._add_to_index(seq, segment.number, offset, size, record)
+        self._unread.setdefault(to_peer, {})[seq] = from_peer
+        self._unread_counts.add(to_peer, from_peer)
+        return record["id"]
+
+    def _mark_read(self, to_peer: str, seq: int) -> None:
+        sender = self._unread.get(to_peer, {}).pop(seq, None)
+        if sender is not None:
+            self._unread_counts.remove(to_peer, sender)
+
+    def _ack(self, seqs: list[int]) -> None:
+        """Markiert seqs als zugestellt (ein ack-Eintrag für alle)."""
+        seqs = [s for s in seqs if s in self._unread.get(self._index[s][2], {})]
+        if not seqs:
+            return
+        segment, _, size = self._append({"op": "ack", "seqs": seqs})
+        segment.reclaimable += size
+        for seq in seqs:
+            self._mark_read(self._index[seq][2], seq)
+
+    async def mark_delivered(self, message_ids: list[str]) -> None:
+        self._ack([self._ids[i] for i in message_ids if i in self._ids])
+
+    async def mark_delivered_through(self, peer: str, cursor: int) -> None:
+        self._ack([s for s in self._unread_seqs(peer) if s <= cursor])
+
+    # --- Lesen ---
+
+    def _message(self, seq: int) -> dict:
+        segment, offset, _, _ = self._index[seq]
+        record = self._segments[segment].read(offset)
+        return {
+            "id": record["id"],
+            "from": record["from"],
+            "to": record["to"],
+            "content": record["content"],
+            "context": record["context"],
+            "timestamp": record["timestamp"]
+        }
+
+    def _expired(self, seq: int, now_ms: int) -> bool:
+        expires = self._expires.get(seq)
+        return expires is not None and expires < now_ms
+
+    def _unread_seqs(self, peer: str) -> list[int]:
+        """Ungelesene seqs eines Peers inkl. Broadcasts, aufsteigend."""
+        now_ms = time.time_ns() // 1_000_000
+        seqs = merge(self._unread.get(peer, {}), self._unread.get("*", {}))
+        return [s for s in seqs if not self._expired(s, now_ms)]
+
+    async def get_unread(self, peer: str) -> list[dict]:
+        return [self._message(seq) for seq in self._unread_seqs(peer)]
+
+    async def unread_counts(self, peer: str, refresh: bool = False) -> dict[str, int]:
+        # Abgelaufene TTL-Nachrichten zählen bis zur nächsten Kompaktierung mit
+        return self._unread_counts.for_peer(peer)
+
+    async def get_unread_page(
+        self, peer: str, after: int = 0, limit: int = 100, max_bytes: int = 256 * 1024
+    ) -> tuple[list[dict], int, bool]:
+        """Seite ungelesener Nachrichten ab Cursor (seq), wie MessageStore."""
+        seqs = [s for s in self._unread_seqs(peer) if s > after]
+        messages: list[dict] = []
+        size = 0
+        last = after
+        for seq in seqs[:limit]:
+            message = self._message(seq)
+            size += len(message["content"]) + len(json.dumps(message["context"]) if message["context"] else "")
+            if messages and size > max_bytes:
+                break
+            messages.append(message)
+            last = seq
+        return messages, last, len(messages) < len(seqs)
+
+    async def get_history(self, peer1: str, peer2: str, limit: int = 50) -> list[dict]:
+        now_ms = time.time_ns() // 1_000_000
+        history: list[dict] = []
+        for seq in reversed(self._conversations.get(conversation_key(peer1, peer2), [])):
+            if self._expired(seq, now_ms):
+                continue
+            message = self._message(seq)
+            if (message["from"], message["to"]) in ((peer1, peer2), (peer2, peer1)):
+                history.append(message)
+                if len(history) >= limit:
+                    break
+        return list(reversed(history))
+
+    async def get_recent_page(
+        self, before: Optional[int] = None, limit: int = 100
+    ) -> tuple[list[dict], Optional[int], bool]:
+        """Scrollback rückwärts über alle Nachrichten, Cursor ist die seq."""
+        end = bisect.bisect_left(self._order, before) if before is not None else len(self._order)
+        page = self._order[max(0, end - limit):end]
+        oldest = page[0] if page else before
+        return [self._message(seq) for seq in page], oldest, end > limit
+
+    # --- Kompaktierung ---
+
+    def _schedule_compaction(self) -> None:
+        if self._compaction and not self._compaction.done():
+            return
+        try:
+            self._compaction = asyncio.get_running_loop().create_task(self._compact_all())
+        except RuntimeError:
+            pass  # Kein laufender Event-Loop (z.B. beim Laden)
+
+    def _candidates(self) -> list[Segment]:
+        """Versiegelte Segmente mit genug überholten Einträgen."""
+        now_ms = time.time_ns() // 1_000_000
+        expired: dict[int, int] = {}
+        for seq, expires in self._expires.items():
+            if expires < now_ms and seq in self._index:
+                number, _, _, size = self._index[seq]
+                expired[number] = expired.get(number, 0) + size
+        return [
+            segment for segment in self._segments.values()
+            if segment is not self._active and segment.end
+            and (segment.reclaimable + expired.get(segment.number, 0)) / segment.end > self.compact_ratio
+        ]
+
+    async def _compact_all(self) -> None:
+        for segment in self._candidates():
+            try:
+                await self._compact(segment)
+            except Exception as e:
+                logger.error(f"Kompaktierung von {segment.path.name} fehlgeschlagen: {e}")
+
+    async def _compact(self, segment: Segment) -> None:
+        """Schreibt ein versiegeltes Segment ohne überholte Einträge neu.
+
+        Das Neuschreiben läuft in einem Thread; Zustellungen, die währenddessen
+        eintreffen, stehen als ack im aktiven Segment und gelten weiterhin.
+        """
+        now_ms = time.time_ns() // 1_000_000
+        tmp = segment.path.with_suffix(".compact")
+        tmp.unlink(missing_ok=True)
+
+        def rewrite() -> tuple[Segment, dict[int, tuple[int, int]], list[dict]]:
+            out = Segment(tmp, segment.number, capacity=max(segment.end, _HEADER.size))
+            moved: dict[int, tuple[int, int]] = {}
+            dropped: list[dict] = []
+            acks: list[int] = []
+            for _, _, record in segment.scan():
+                if record["op"] == "ack":
+                    # Bestätigungen für Nachrichten in anderen Segmenten bleiben
+                    acks += [s for s in record["seqs"] if s in self._index and self._index[s][0] != segment.number]
+                    continue
+                seq = record["seq"]
+                if seq not in self._index:
+                    continue
+                if self._expired(seq, now_ms):
+                    dropped.append(record)
+                    continue
+                record["delivered"] = 0 if seq in self._unread.get(record["to"], {}) else 1
+                data = _encode(record)
+                moved[seq] = (out.append(data), len(data))
+            if acks:
+                out.append(_encode({"op": "ack", "seqs": acks}))
+            out.seal()
+            return out, moved, dropped
+
+        old_size = segment.end
+        out, moved, dropped = await asyncio.to_thread(rewrite)
+
+        os.replace(tmp, segment.path)
+        out.path = segment.path
+        self._segments[segment.number] = out
+        for seq, (offset, size) in moved.items():
+            entry = self._index.get(seq)
+            if entry:
+                self._index[seq] = (segment.number, offset, entry[2], size)
+        for record in dropped:
+            self._forget(record)
+        segment.close()
+        logger.info(f"Log-Store: {out.path.name} kompaktiert ({old_size} -> {out.end} Bytes, {len(dropped)} abgelaufen)")
+
+    def _forget(self, record: dict) -> None:
+        """Entfernt eine abgelaufene Nachricht aus allen Indizes."""
+        seq = record["seq"]
+        self._index.pop(seq, None)
+        self._ids.pop(record["id"], None)
+        self._expires.pop(seq, None)
+        self._mark_read(record["to"], seq)
+        if record.get("client_id"):
+            self._client_ids.pop((record["from"], record["client_id"], record["to"]), None)
+        for seqs in (self._order, self._conversations.get(conversation_key(record["from"], record["to"]), [])):
+            index = bisect.bisect_left(seqs, seq)
+            if index < len(seqs) and seqs[index] == seq:
+                del seqs[index]
@@ -4,11 +4,10 @@ import asyncio
 import logging
 import signal
 import sys
-from pathlib import Path
-
-import yaml
 
+from .config import load_config
 from .websocket_server import BridgeServer
+from .cluster import run_cluster
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,22 +16,6 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_config() -> dict:
-    """Lädt die Konfiguration aus config.yaml."""
-    config_paths = [
-        Path("config.yaml"),
-        Path(__file__).parent.parent / "config.yaml",
-        Path.home() / ".config" / "ai-connect" / "config.yaml"
-    ]
-
-    for path in config_paths:
-        if path.exists():
-            with open(path) as f:
-                return yaml.safe_load(f)
-
-    return {"bridge": {"host": "0.0.0.0", "port": 9999}}
-
-
 async def run_server() -> None:
     """Startet den Bridge Server."""
     config = load_config()
@@ -40,8 +23,11 @@ async def run_server() -> None:
 
     host = bridge_config.get("host", "0.0.0.0")
     port = bridge_config.get("port", 9999)
-
-    server = BridgeServer(host=host, port=port)
+    workers = bridge_config.get("workers", 1)
+    if workers > 1 and config.get("storage", {}).get("backend") == "log":
+        # Die Indizes des Log-Backends liegen im Prozess
+        logger.warning("storage.backend log unterstützt nur einen Prozess - starte ohne Worker")
+        workers = 1
 
     loop = asyncio.get_event_loop()
     stop_event = asyncio.Event()
@@ -53,6 +39,15 @@ async def run_server() -> None:
     for sig in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(sig, handle_signal)
 
+    if workers > 1:
+        # Multi-Prozess-Betrieb: Worker teilen sich den Port per SO_REUSEPORT
+        logger.info(f"AI-Connect Bridge läuft auf ws://{host}:{port} mit {workers} Workern")
+        logger.info("Drücke Ctrl+C zum Beenden")
+        await run_cluster(config, host, port, workers, stop_event)
+        logger.info("Server beendet")
+        return
+
+    server = BridgeServer(host=host, port=port, config=config)
     await server.start()
     logger.info(f"AI-Connect Bridge läuft auf ws://{host}:{port}")
     logger.info("Drücke Ctrl+C zum Beenden")
@@ -1,24 +1,120 @@
 """SQLite-basierter Message Store für AI-Connect."""
 
 import aiosqlite
+import hashlib
 import json
+import logging
+import os
+import sqlite3
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
 
+from . import migrations
+from .migrations import FTS_SOURCE_SQL, SCHEMA_VERSION, iso_to_ms_sql
+from .storage import (
+    DuplicateMessageError, StorageBackend, UnreadCounters, conversation_key, file_reference, parse_line_range
+)
 
-class MessageStore:
-    """Speichert Nachrichten in SQLite für Historie und Offline-Zustellung."""
+logger = logging.getLogger(__name__)
 
-    def __init__(self, db_path: str = "~/.config/ai-connect/messages.db"):
+
+# Vorschau-Länge für ausgelagerte Inhalte (in Zeichen)
+PREVIEW_CHARS = 200
+
+# Spalten für Nachrichten-Abfragen (Reihenfolge passend zu _row_to_message)
+_MESSAGE_COLUMNS = "id, from_peer, to_peer, content, context, timestamp, content_ref, context_ref"
+
+# Spalten für dump_rows/load_rows (in allen Schema-Versionen vorhanden)
+_DUMP_COLUMNS = (
+    "id", "from_peer", "to_peer", "content", "context", "timestamp", "delivered",
+    "content_ref", "context_ref", "expires_at", "client_id", "ts_ms"
+)
+
+
+class MessageStore(StorageBackend):
+    """Speichert Nachrichten in SQLite für Historie und Offline-Zustellung.
+
+    Große Inhalte (content/context über blob_threshold Bytes) werden
+    content-adressiert in der Tabelle blobs abgelegt - einmal pro Hash,
+    egal wie oft sie gesendet werden. Die Nachricht selbst trägt nur
+    eine Vorschau plus Referenz, die Clients bei Bedarf nachladen.
+
+    Das Schema ist versioniert (siehe migrations.py). Ältere Datenbanken
+    bleiben nach connect() voll nutzbar, migrate() hebt sie anschließend
+    im Hintergrund auf die aktuelle Version.
+    """
+
+    supports_retention = True
+    supports_paging = True
+    supports_scrollback = True
+    supports_search = True
+    supports_blobs = True
+    supports_file_index = True
+    supports_unread_counts = True
+
+    def __init__(
+        self,
+        db_path: str = "~/.config/ai-connect/messages.db",
+        blob_threshold: int = 8192,
+        migration_batch_size: int = 1000,
+        migration_pause: float = 0.05
+    ):
         self.db_path = Path(db_path).expanduser()
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.blob_threshold = blob_threshold
+        self.migration_batch_size = migration_batch_size
+        self.migration_pause = migration_pause
+        self.schema_version = 0
         self._db: Optional[aiosqlite.Connection] = None
+        self._incremental_vacuum = False
+        self._unread_counts = UnreadCounters()
 
     async def connect(self) -> None:
         """Verbindet zur Datenbank und erstellt Tabellen."""
         self._db = await aiosqlite.connect(self.db_path)
+        # Neue Datenbanken mit incremental auto_vacuum anlegen, damit die
+        # Retention freie Seiten schrittweise zurückgeben kann
+        await self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL + busy_timeout: mehrere Worker-Prozesse teilen sich die Datei
+        await self._db.execute("PRAGMA journal_mode = WAL")
+        await self._db.execute("PRAGMA busy_timeout = 5000")
+
+        version = await migrations.current_version(self._db)
+        if version == 0 and not await migrations.table_exists(self._db, "messages"):
+            await migrations.create_schema(self._db)
+        elif version < 2:
+            await self._ensure_legacy_schema()
+            if version == 0:
+                await migrations.mark_applied(self._db, 1)
+        await migrations.create_file_index(self._db)
+        self.schema_version = await migrations.current_version(self._db)
+
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        await self._create_search_index()
+        await self._db.commit()
+        await self._load_unread_counts()
+
+        # Bestehende Datenbanken ohne auto_vacuum brauchen einmalig ein VACUUM
+        cursor = await self._db.execute("PRAGMA auto_vacuum")
+        row = await cursor.fetchone()
+        self._incremental_vacuum = bool(row and row[0] == 2)
+        if not self._incremental_vacuum:
+            logger.info("messages.db ohne incremental auto_vacuum - Speicher wird erst nach VACUUM freigegeben")
+        if self.schema_version < SCHEMA_VERSION:
+            logger.info(f"messages.db hat Schema-Version {self.schema_version}, Migration ausstehend")
+
+    async def _ensure_legacy_schema(self) -> None:
+        """Schema-Version 1 samt nachträglich ergänzter Spalten (bis zur Migration)."""
         await self._db.execute("""
             CREATE TABLE IF NOT EXISTS messages (
                 id TEXT PRIMARY KEY,
@@ -33,7 +129,89 @@ class MessageStore:
         await self._db.execute("""
             CREATE INDEX IF NOT EXISTS idx_to_peer ON messages(to_peer, delivered)
         """)
-        await self._db.commit()
+        await self._ensure_column("messages", "content_ref", "TEXT")
+        await self._ensure_column("messages", "context_ref", "TEXT")
+        await self._ensure_column("messages", "expires_at", "TEXT")
+        await self._ensure_column("messages", "client_id", "TEXT")
+        await self._db.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_client_id
+            ON messages(from_peer, client_id, to_peer) WHERE client_id IS NOT NULL
+        """)
+        if await self._ensure_column("messages", "conversation", "TEXT"):
+            await self._db.execute(f"UPDATE messages SET conversation = {_CONVERSATION_SQL}")
+        await self._db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversation ON messages(conversation)
+        """)
+        await self._db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_expires_at ON messages(expires_at) WHERE expires_at IS NOT NULL
+        """)
+        await self._db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_timestamp ON messages(timestamp)
+        """)
+        await self._db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_content_ref ON messages(content_ref) WHERE content_ref IS NOT NULL
+        """)
+        # Neue Zeilen tragen ts_ms schon vor der Migration, die Kopie übernimmt es
+        await self._ensure_column("messages", "ts_ms", "INTEGER")
+
+    async def migrate(self) -> int:
+        """Hebt die Datenbank online auf die aktuelle Schema-Version.
+
+        Returns:
+            Erreichte Schema-Version
+        """
+        if self.schema_version < SCHEMA_VERSION:
+            self.schema_version = await migrations.migrate(
+                self._db, self.migration_batch_size, self.migration_pause
+            )
+        return self.schema_version
+
+    def _time_condition(self, column: str, op: str) -> str:
+        """Vergleich gegen einen ISO-Zeitstempel-Parameter.
+
+        Ab Schema-Version 2 als Ganzzahlvergleich auf ts_ms (der Parameter
+        wird einmal umgerechnet), davor lexikalisch auf timestamp.
+        """
+        if self.schema_version >= 2:
+            return f"{column}ts_ms {op} {iso_to_ms_sql('?')}"
+        return f"{column}timestamp {op} ?"
+
+    async def _create_search_index(self) -> None:
+        """Legt den FTS5-Index an und füllt ihn einmalig aus Bestandsdaten.
+
+        Der Index nutzt die rowid der Nachricht und indiziert immer den
+        vollen Inhalt, auch wenn dieser im Blob-Store liegt. Den Text selbst
+        speichert er nicht (external content über messages_fts_source),
+        ein Fan-out großer Inhalte legt ihn also nicht N-mal ab. Ältere
+        Datenbanken mit eigener Textkopie im Index werden einmalig umgebaut.
+        """
+        cursor = await self._db.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        )
+        row = await cursor.fetchone()
+        rebuild = row is None or "content=" not in row[0]
+        if row is not None and rebuild:
+            await self._db.execute("DROP TABLE messages_fts")
+        await self._db.execute(FTS_SOURCE_SQL)
+        await self._db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+            USING fts5(content, file, content = 'messages_fts_source', content_rowid = 'seq', tokenize = 'unicode61')
+        """)
+        if rebuild:
+            await self._db.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    async def _ensure_column(self, table: str, column: str, definition: str) -> bool:
+        """Fügt eine Spalte hinzu, falls eine ältere Datenbank sie noch nicht hat.
+
+        Returns:
+            True wenn die Spalte neu angelegt wurde
+        """
+        cursor = await self._db.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in await cursor.fetchall()]
+        if column in columns:
+            return False
+        await self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
 
     async def close(self) -> None:
         """Schließt die Datenbankverbindung."""
@@ -41,66 +219,290 @@ class MessageStore:
             await self._db.close()
             self._db = None
 
+    async def prepare(self, content: str, context: Optional[dict] = None) -> dict:
+        """Bereitet Inhalt und Kontext für Speicherung und Versand vor.
+
+        Inhalte über der Schwelle landen im Blob-Store; zurück kommen die
+        Felder, die in Nachrichten-Frames übertragen werden. Bei Fan-out an
+        mehrere Empfänger wird das Ergebnis für alle store()-Aufrufe
+        wiederverwendet, der Blob also nur einmal geschrieben.
+        """
+        fields, blobs = split_blobs(content, context, self.blob_threshold)
+        for data in blobs:
+            await self._put_blob(data)
+        return fields
+
+    async def _put_blob(self, data: str) -> str:
+        """Legt einen Blob ab (dedupliziert über SHA-256) und gibt den Hash zurück."""
+        digest = _blob_digest(data)
+        await self._db.execute(
+            "INSERT OR IGNORE INTO blobs (hash, data, size, created_at) VALUES (?, ?, ?, ?)",
+            (digest, data, len(data), _utc_timestamp())
+        )
+        return digest
+
+    async def get_blob(self, digest: str) -> Optional[str]:
+        """Holt einen Blob anhand seines Hashes."""
+        cursor = await self._db.execute("SELECT data FROM blobs WHERE hash = ?", (digest,))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
     async def store(
         self,
         from_peer: str,
         to_peer: str,
         content: str,
-        context: Optional[dict] = None
+        context: Optional[dict] = None,
+        prepared: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        client_id: Optional[str] = None
     ) -> str:
-        """Speichert eine Nachricht und gibt die ID zurück."""
-        msg_id = str(uuid.uuid4())
-        # ISO-Format mit Millisekunden: 2024-01-03T14:30:45.123Z
-        timestamp = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-        context_json = json.dumps(context) if context else None
+        """Speichert eine Nachricht und gibt die ID zurück.
+
+        prepared: Ergebnis von prepare() für dieselben Daten (optional).
+        ttl: Lebensdauer in Sekunden, danach räumt die Retention sie ab.
+        client_id: Vom Sender vergebene ID für idempotente Wiederholungen.
+
+        Raises:
+            DuplicateMessageError: client_id wurde für diesen Empfänger schon gespeichert
+        """
+        if prepared is None:
+            prepared = await self.prepare(content, context)
+
+        ts_ms = time.time_ns() // 1_000_000
+        msg_id = _new_message_id(ts_ms)
+        timestamp = _utc_timestamp(_EPOCH + timedelta(milliseconds=ts_ms))
+        context_json = json.dumps(prepared["context"]) if prepared["context"] else None
+        expires_at = _utc_timestamp(datetime.utcnow() + timedelta(seconds=ttl)) if ttl else None
+
+        try:
+            cursor = await self._db.execute(
+                """
+                INSERT INTO messages (id, from_peer, to_peer, content, context, timestamp, ts_ms,
+                                      content_ref, context_ref, expires_at, conversation, client_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (msg_id, from_peer, to_peer, prepared["content"], context_json, timestamp, ts_ms,
+                 prepared.get("content_ref"), prepared.get("context_ref"), expires_at,
+                 conversation_key(from_peer, to_peer), client_id)
+            )
+        except sqlite3.IntegrityError:
+            cursor = await self._db.execute(
+                "SELECT id FROM messages WHERE from_peer = ? AND client_id = ? AND to_peer = ?",
+                (from_peer, client_id, to_peer)
+            )
+            row = await cursor.fetchone()
+            if not row:
+                raise
+            raise DuplicateMessageError(row[0])
+        # Volltext- und Dateiindex in derselben Transaktion pflegen
+        await self._index_message(cursor.lastrowid, content, context)
+        await self._db.commit()
+        self._unread_counts.add(to_peer, from_peer)
+        return msg_id
+
+    async def _index_message(self, seq: int, content: str, context: Optional[dict]) -> None:
+        """Trägt eine Nachricht in Volltext- und Dateiindex ein (ohne Commit).
 
+        content und context sind die vollen Inhalte - dieselben Werte, die
+        messages_fts_source liefert, sonst ließe sich der Eintrag nicht
+        wieder löschen.
+        """
         await self._db.execute(
-            """
-            INSERT INTO messages (id, from_peer, to_peer, content, context, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (msg_id, from_peer, to_peer, content, context_json, timestamp)
+            "INSERT INTO messages_fts (rowid, content, file) VALUES (?, ?, ?)",
+            (seq, content, (context or {}).get("file"))
+        )
+        reference = file_reference(context)
+        if reference:
+            await self._db.execute(
+                "INSERT OR IGNORE INTO message_files (seq, file, line_start, line_end) VALUES (?, ?, ?, ?)",
+                (seq, *reference)
+            )
+
+    async def dump_rows(self, after: int = 0, limit: int = 1000) -> list[dict]:
+        """Rohzeilen mit rowid > after samt ausgelagerten Inhalten.
+
+        Gegenstück zu load_rows, z.B. für den Umzug in Shards. Funktioniert
+        mit jeder Schema-Version.
+        """
+        cursor = await self._db.execute(
+            f"SELECT rowid, {', '.join(_DUMP_COLUMNS)} FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (after, limit)
         )
+        rows = []
+        for values in await cursor.fetchall():
+            row = dict(zip(("rowid", *_DUMP_COLUMNS), values))
+            row["blobs"] = {
+                ref: await self.get_blob(ref) for ref in (row["content_ref"], row["context_ref"]) if ref
+            }
+            rows.append(row)
+        return rows
+
+    async def load_rows(self, rows: list[dict]) -> int:
+        """Übernimmt Zeilen aus dump_rows mit ID, Zeitstempel und Zustellstatus.
+
+        Bereits vorhandene IDs werden übersprungen, ein abgebrochener Umzug
+        lässt sich also wiederholen.
+
+        Returns:
+            Anzahl neu übernommener Nachrichten
+        """
+        loaded = 0
+        for row in rows:
+            for data in row["blobs"].values():
+                if data is not None:
+                    await self._put_blob(data)
+            cursor = await self._db.execute(
+                f"""
+                INSERT OR IGNORE INTO messages (id, from_peer, to_peer, content, context, timestamp, ts_ms,
+                                                delivered, content_ref, context_ref, expires_at, client_id,
+                                                conversation)
+                VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, {iso_to_ms_sql('?')}, 0), ?, ?, ?, ?, ?, ?)
+                """,
+                (row["id"], row["from_peer"], row["to_peer"], row["content"], row["context"],
+                 row["timestamp"], row["ts_ms"], row["timestamp"], row["delivered"] or 0,
+                 row["content_ref"], row["context_ref"], row["expires_at"], row["client_id"],
+                 conversation_key(row["from_peer"], row["to_peer"]))
+            )
+            if not cursor.rowcount:
+                continue
+            # Indizes brauchen den vollen Inhalt, nicht die Vorschau
+            content = row["blobs"].get(row["content_ref"]) or row["content"]
+            context = row["blobs"].get(row["context_ref"]) or row["context"]
+            await self._index_message(cursor.lastrowid, content, json.loads(context) if context else None)
+            if not row["delivered"]:
+                self._unread_counts.add(row["to_peer"], row["from_peer"])
+            loaded += 1
         await self._db.commit()
-        return msg_id
+        return loaded
 
     async def get_unread(self, peer: str) -> list[dict]:
         """Holt alle ungelesenen Nachrichten für einen Peer."""
         cursor = await self._db.execute(
-            """
-            SELECT id, from_peer, to_peer, content, context, timestamp
+            f"""
+            SELECT {_MESSAGE_COLUMNS}
             FROM messages
             WHERE (to_peer = ? OR to_peer = '*') AND delivered = 0
-            ORDER BY timestamp ASC
+            ORDER BY rowid ASC
             """,
             (peer,)
         )
         rows = await cursor.fetchall()
+        return [_row_to_message(row) for row in rows]
 
-        messages = []
-        for row in rows:
-            messages.append({
-                "id": row[0],
-                "from": row[1],
-                "to": row[2],
-                "content": row[3],
-                "context": json.loads(row[4]) if row[4] else None,
-                "timestamp": row[5]
-            })
+    async def get_unread_page(
+        self,
+        peer: str,
+        after: int = 0,
+        limit: int = 100,
+        max_bytes: int = 256 * 1024
+    ) -> tuple[list[dict], int, bool]:
+        """Holt eine Seite ungelesener Nachrichten ab einem Cursor.
+
+        Der Cursor ist die rowid der letzten Nachricht der vorigen Seite.
+        Eine Seite endet nach limit Nachrichten oder sobald max_bytes
+        Inhalt erreicht sind (mindestens eine Nachricht pro Seite).
+
+        Returns:
+            (Nachrichten, neuer Cursor, weitere Seiten vorhanden)
+        """
+        cursor = await self._db.execute(
+            f"""
+            SELECT rowid, {_MESSAGE_COLUMNS}
+            FROM messages
+            WHERE (to_peer = ? OR to_peer = '*') AND delivered = 0 AND rowid > ?
+            ORDER BY rowid ASC
+            LIMIT ?
+            """,
+            (peer, after, limit + 1)
+        )
+        rows = await cursor.fetchall()
 
-        return messages
+        messages: list[dict] = []
+        size = 0
+        last = after
+        for row in rows[:limit]:
+            message = _row_to_message(row[1:])
+            size += len(message["content"]) + len(row[5] or "")
+            if messages and size > max_bytes:
+                break
+            messages.append(message)
+            last = row[0]
+
+        return messages, last, len(messages) < len(rows)
+
+    async def mark_delivered_through(self, peer: str, cursor: int) -> None:
+        """Markiert alle ungelesenen Nachrichten eines Peers bis einschließlich cursor."""
+        rows = await self._db.execute_fetchall(
+            """
+            UPDATE messages SET delivered = 1
+            WHERE (to_peer = ? OR to_peer = '*') AND delivered = 0 AND rowid <= ?
+            RETURNING to_peer, from_peer
+            """,
+            (peer, cursor)
+        )
+        await self._count_delivered(rows)
 
     async def mark_delivered(self, message_ids: list[str]) -> None:
         """Markiert Nachrichten als zugestellt."""
         if not message_ids:
             return
         placeholders = ",".join("?" * len(message_ids))
-        await self._db.execute(
-            f"UPDATE messages SET delivered = 1 WHERE id IN ({placeholders})",
+        rows = await self._db.execute_fetchall(
+            f"UPDATE messages SET delivered = 1 WHERE id IN ({placeholders}) AND delivered = 0 RETURNING to_peer, from_peer",
             message_ids
         )
+        await self._count_delivered(rows)
+
+    async def _count_delivered(self, rows) -> None:
+        """Zählt die per RETURNING gemeldeten Zeilen herunter und schließt ab.
+
+        RETURNING-Anweisungen werden mit execute_fetchall in einem Schritt
+        ausgeführt - ein halb gelesener Cursor würde fremde Commits blockieren.
+        """
+        for to_peer, from_peer in rows:
+            self._unread_counts.remove(to_peer, from_peer)
         await self._db.commit()
 
+    async def _load_unread_counts(self, peer: Optional[str] = None) -> None:
+        """Liest die Ungelesen-Zähler aus der Datenbank (alle oder peer samt Broadcasts)."""
+        if peer is None:
+            self._unread_counts.clear()
+            cursor = await self._db.execute(
+                "SELECT to_peer, from_peer, COUNT(*) FROM messages WHERE delivered = 0 GROUP BY to_peer, from_peer"
+            )
+            recipients = None
+        else:
+            cursor = await self._db.execute(
+                """
+                SELECT to_peer, from_peer, COUNT(*) FROM messages
+                WHERE to_peer IN (?, '*') AND delivered = 0
+                GROUP BY to_peer, from_peer
+                """,
+                (peer,)
+            )
+            recipients = {peer: {}, "*": {}}
+        rows = await cursor.fetchall()
+        if recipients is None:
+            for to_peer, from_peer, n in rows:
+                self._unread_counts.add(to_peer, from_peer, n)
+            return
+        for to_peer, from_peer, n in rows:
+            recipients[to_peer][from_peer] = n
+        for to_peer, senders in recipients.items():
+            self._unread_counts.replace(to_peer, senders)
+
+    async def unread_counts(self, peer: str, refresh: bool = False) -> dict[str, int]:
+        """Ungelesene Nachrichten für peer je Absender, ohne die Tabelle zu lesen.
+
+        Die Zähler werden bei connect() einmal gefüllt und danach bei
+        store/mark_delivered/delete_messages mitgeführt. refresh liest
+        die Zeilen des Peers über den to_peer-Index neu (Multi-Worker).
+        """
+        if refresh:
+            await self._load_unread_counts(peer)
+        return self._unread_counts.for_peer(peer)
+
     async def get_history(
         self,
         peer1: str,
@@ -109,27 +511,387 @@ class MessageStore:
     ) -> list[dict]:
         """Holt den Chatverlauf zwischen zwei Peers."""
         cursor = await self._db.execute(
-            """
-            SELECT id, from_peer, to_peer, content, context, timestamp
+            f"""
+            SELECT {_MESSAGE_COLUMNS}
             FROM messages
             WHERE (from_peer = ? AND to_peer = ?)
                OR (from_peer = ? AND to_peer = ?)
-            ORDER BY timestamp DESC
+            ORDER BY rowid DESC
             LIMIT ?
             """,
             (peer1, peer2, peer2, peer1, limit)
         )
         rows = await cursor.fetchall()
+        return [_row_to_message(row) for row in reversed(rows)]
+
+    async def get_recent_page(
+        self,
+        before: Optional[int] = None,
+        limit: int = 100
+    ) -> tuple[list[dict], Optional[int], bool]:
+        """Blättert rückwärts durch alle Nachrichten (Scrollback für Observer).
+
+        Der Cursor ist die rowid der ältesten Nachricht der vorigen Seite;
+        None beginnt bei der neuesten.
+
+        Returns:
+            (Nachrichten alt -> neu, Cursor für die nächste ältere Seite,
+             ältere Nachrichten vorhanden)
+        """
+        cursor = await self._db.execute(
+            f"""
+            SELECT rowid, {_MESSAGE_COLUMNS}
+            FROM messages
+            WHERE rowid < ?
+            ORDER BY rowid DESC
+            LIMIT ?
+            """,
+            (before if before is not None else 2**63 - 1, limit + 1)
+        )
+        rows = await cursor.fetchall()
+        page = rows[:limit]
+        oldest = page[-1][0] if page else before
+        return [_row_to_message(row[1:]) for row in reversed(page)], oldest, len(rows) > limit
+
+    async def search(
+        self,
+        peer: str,
+        query: str,
+        other_peer: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        file: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+        with_rank: bool = False
+    ) -> tuple[list[dict], bool]:
+        """Volltextsuche über alle Nachrichten, an denen peer beteiligt ist.
+
+        Args:
+            peer: Suchender Peer (sieht eigene, an ihn gerichtete und Broadcasts)
+            query: FTS5-Suchausdruck; bei Syntaxfehlern wird wörtlich gesucht
+            other_peer: Nur Nachrichten mit diesem Gesprächspartner
+            since/until: ISO-Zeitstempel (inklusiv/exklusiv)
+            file: Nur Nachrichten mit diesem context.file
+            with_rank: bm25-Wert als "rank" mitliefern (kleiner = relevanter)
+
+        Returns:
+            (Treffer nach Relevanz, weitere Treffer vorhanden)
+        """
+        conditions = ["messages_fts MATCH ?", "(m.from_peer = ? OR m.to_peer = ? OR m.to_peer = '*')"]
+        params: list = [query, peer, peer]
+        if other_peer:
+            conditions.append("(m.from_peer = ? OR m.to_peer = ?)")
+            params += [other_peer, other_peer]
+        if since:
+            conditions.append(self._time_condition("m.", ">="))
+            params.append(since)
+        if until:
+            conditions.append(self._time_condition("m.", "<"))
+            params.append(until)
+        if file:
+            conditions.append("messages_fts.file = ?")
+            params.append(file)
+
+        sql = f"""
+            SELECT m.id, m.from_peer, m.to_peer, m.timestamp, messages_fts.file,
+                   snippet(messages_fts, 0, '»', '«', '…', 16), bm25(messages_fts)
+            FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+            WHERE {" AND ".join(conditions)}
+            ORDER BY bm25(messages_fts)
+            LIMIT ? OFFSET ?
+        """
+        params += [limit + 1, offset]
+
+        try:
+            cursor = await self._db.execute(sql, params)
+        except sqlite3.OperationalError:
+            # Kein gültiger FTS5-Ausdruck - Begriffe einzeln quoten
+            params[0] = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+            cursor = await self._db.execute(sql, params)
+        rows = await cursor.fetchall()
 
-        messages = []
-        for row in reversed(rows):
-            messages.append({
+        results = [
+            {
+                "id": row[0],
+                "from": row[1],
+                "to": row[2],
+                "timestamp": row[3],
+                "file": row[4],
+                "snippet": row[5],
+                **({"rank": row[6]} if with_rank else {})
+            }
+            for row in rows[:limit]
+        ]
+        return results, len(rows) > limit
+
+    async def find_by_file(
+        self,
+        peer: str,
+        file: str,
+        prefix: bool = False,
+        lines: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], bool]:
+        """Nachrichten mit Datei-Kontext über den Index message_files, neueste zuerst.
+
+        Args:
+            peer: Anfragender Peer (sieht eigene, an ihn gerichtete und Broadcasts)
+            file: Dateipfad wie in context.file
+            prefix: file als Pfadpräfix (z.B. "src/") statt exakt
+            lines: Nur Nachrichten, deren Zeilenbereich sich mit diesem
+                   überschneidet ("42-58")
+
+        Returns:
+            (Nachrichten mit "file"/"lines", weitere Treffer vorhanden)
+        """
+        conditions = ["(m.from_peer = ? OR m.to_peer = ? OR m.to_peer = '*')"]
+        params: list = [peer, peer]
+        if prefix:
+            # Bereichsabfrage statt LIKE, damit der Index greift
+            conditions.append("f.file >= ? AND f.file < ?")
+            params += [file, file[:-1] + chr(ord(file[-1]) + 1)]
+        else:
+            conditions.append("f.file = ?")
+            params.append(file)
+        span = parse_line_range(lines) if lines else None
+        if span:
+            conditions.append("f.line_start <= ? AND f.line_end >= ?")
+            params += [span[1], span[0]]
+
+        cursor = await self._db.execute(
+            f"""
+            SELECT {_MESSAGE_COLUMNS}, f.file, f.line_start, f.line_end
+            FROM message_files f JOIN messages m ON m.rowid = f.seq
+            WHERE {" AND ".join(conditions)}
+            ORDER BY f.seq DESC
+            LIMIT ? OFFSET ?
+            """,
+            params + [limit + 1, offset]
+        )
+        rows = await cursor.fetchall()
+        results = []
+        for row in rows[:limit]:
+            message = _row_to_message(row)
+            message["file"] = row[8]
+            if row[9] is not None:
+                message["lines"] = f"{row[9]}-{row[10]}" if row[10] != row[9] else str(row[9])
+            results.append(message)
+        return results, len(rows) > limit
+
+    # --- Retention (siehe retention.py) ---
+
+    async def find_expired(self, now: str, cutoff: Optional[str], limit: int) -> list[int]:
+        """rowids abgelaufener Nachrichten: TTL überschritten oder älter als cutoff."""
+        cursor = await self._db.execute(
+            f"""
+            SELECT rowid FROM messages WHERE expires_at IS NOT NULL AND expires_at < ?
+            UNION
+            SELECT rowid FROM messages WHERE {self._time_condition("", "<")}
+            LIMIT ?
+            """,
+            (now, cutoff or "", limit)
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+    async def find_overflow(self, max_rows: int, after: str, limit: int) -> tuple[list[int], Optional[str]]:
+        """rowids der ältesten Nachrichten von Konversationen über max_rows.
+
+        Zählt pro Aufruf nur die nächsten limit Konversationen nach after
+        (entlang idx_messages_conversation), statt die ganze Tabelle zu
+        gruppieren. Gibt die rowids und den Cursor für den nächsten Aufruf
+        zurück; None, wenn alle Konversationen durchlaufen sind.
+        """
+        cursor = await self._db.execute(
+            """
+            SELECT conversation, COUNT(*) FROM messages WHERE conversation > ?
+            GROUP BY conversation ORDER BY conversation LIMIT ?
+            """,
+            (after, limit)
+        )
+        groups = await cursor.fetchall()
+        if not groups:
+            return [], None
+
+        rowids: list[int] = []
+        for conversation, count in groups:
+            if count <= max_rows:
+                after = conversation
+                continue
+            cursor = await self._db.execute(
+                "SELECT rowid FROM messages WHERE conversation = ? ORDER BY rowid ASC LIMIT ?",
+                (conversation, min(count - max_rows, limit - len(rowids)))
+            )
+            rowids += [row[0] for row in await cursor.fetchall()]
+            if len(rowids) >= limit:
+                # Konversation evtl. noch nicht fertig - beim nächsten Aufruf neu zählen
+                return rowids, after
+            after = conversation
+        return rowids, after
+
+    async def fetch_for_archive(self, rowids: list[int]) -> list[dict]:
+        """Vollständige Nachrichten (inkl. ausgelagerter Inhalte) für das Archiv."""
+        placeholders = ",".join("?" * len(rowids))
+        cursor = await self._db.execute(
+            f"""
+            SELECT m.id, m.from_peer, m.to_peer, COALESCE(cb.data, m.content),
+                   COALESCE(xb.data, m.context), m.timestamp, m.delivered, m.expires_at
+            FROM messages m
+            LEFT JOIN blobs cb ON cb.hash = m.content_ref
+            LEFT JOIN blobs xb ON xb.hash = m.context_ref
+            WHERE m.rowid IN ({placeholders})
+            ORDER BY m.rowid
+            """,
+            rowids
+        )
+        return [
+            {
                 "id": row[0],
                 "from": row[1],
                 "to": row[2],
                 "content": row[3],
                 "context": json.loads(row[4]) if row[4] else None,
-                "timestamp": row[5]
-            })
+                "timestamp": row[5],
+                "delivered": bool(row[6]),
+                "expires_at": row[7]
+            }
+            for row in await cursor.fetchall()
+        ]
+
+    async def delete_messages(self, rowids: list[int]) -> None:
+        """Löscht Nachrichten samt Suchindex und nicht mehr referenzierten Blobs."""
+        placeholders = ",".join("?" * len(rowids))
+        cursor = await self._db.execute(
+            f"""
+            SELECT content_ref FROM messages WHERE rowid IN ({placeholders}) AND content_ref IS NOT NULL
+            UNION
+            SELECT context_ref FROM messages WHERE rowid IN ({placeholders}) AND context_ref IS NOT NULL
+            """,
+            rowids + rowids
+        )
+        refs = [row[0] for row in await cursor.fetchall()]
+
+        # Der Index hat keine eigene Textkopie: Einträge mit den Originalwerten
+        # austragen, solange Nachricht und Blobs noch da sind
+        await self._db.execute(
+            f"""
+            INSERT INTO messages_fts (messages_fts, rowid, content, file)
+            SELECT 'delete', seq, content, file FROM messages_fts_source WHERE seq IN ({placeholders})
+            """,
+            rowids
+        )
+        deleted = await self._db.execute_fetchall(
+            f"DELETE FROM messages WHERE rowid IN ({placeholders}) RETURNING to_peer, from_peer, delivered",
+            rowids
+        )
+        for to_peer, from_peer, delivered in deleted:
+            if not delivered:
+                self._unread_counts.remove(to_peer, from_peer)
+        await self._db.execute(f"DELETE FROM message_files WHERE seq IN ({placeholders})", rowids)
+        for ref in refs:
+            await self._db.execute(
+                """
+                DELETE FROM blobs WHERE hash = ?
+                  AND NOT EXISTS (SELECT 1 FROM messages WHERE content_ref = ?)
+                  AND NOT EXISTS (SELECT 1 FROM messages WHERE context_ref = ?)
+                """,
+                (ref, ref, ref)
+            )
+        await self._db.commit()
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Gibt bis zu pages freie Seiten zurück und liefert die verbleibenden."""
+        if not self._incremental_vacuum:
+            return 0
+        cursor = await self._db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        await cursor.fetchall()
+        cursor = await self._db.execute("PRAGMA freelist_count")
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+# Konversationsschlüssel in SQL, identisch zu conversation_key()
+_CONVERSATION_SQL = """
+    CASE WHEN to_peer = '*' THEN '*'
+         WHEN from_peer < to_peer THEN from_peer || char(31) || to_peer
+         ELSE to_peer || char(31) || from_peer END
+"""
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _new_message_id(ts_ms: int) -> str:
+    """Zeitlich sortierte UUID (Layout wie UUIDv7): 48 Bit Millisekunden vorn,
+    neue IDs landen damit am Ende des id-Index statt verstreut im B-Baum."""
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (ts_ms & (2**48 - 1)) << 80 | 0x7 << 76 | (rand >> 62 & 0xFFF) << 64 | 0b10 << 62 | rand & (2**62 - 1)
+    return str(uuid.UUID(int=value))
+
+
+def message_timestamp(msg_id: str) -> Optional[str]:
+    """Gespeicherter Zeitstempel einer Nachricht, abgeleitet aus ihrer ID.
+
+    Nur für zeitlich sortierte IDs (_new_message_id); ältere uuid4-IDs
+    ergeben None.
+    """
+    value = uuid.UUID(msg_id)
+    if value.version != 7:
+        return None
+    return _utc_timestamp(_EPOCH + timedelta(milliseconds=value.int >> 80))
+
+
+def split_blobs(content: str, context: Optional[dict], threshold: int) -> tuple[dict, list[str]]:
+    """Teilt Inhalt und Kontext in Frame-Felder und auszulagernde Blobs.
+
+    Returns:
+        (Felder für Speicherung und Versand, Blob-Inhalte für _put_blob)
+    """
+    fields: dict = {"content": content, "context": context}
+    blobs: list[str] = []
+
+    if len(content.encode()) > threshold:
+        fields["content_ref"] = _blob_digest(content)
+        fields["content_size"] = len(content)
+        fields["content"] = content[:PREVIEW_CHARS]
+        blobs.append(content)
+
+    if context:
+        context_json = json.dumps(context)
+        if len(context_json.encode()) > threshold:
+            fields["context_ref"] = _blob_digest(context_json)
+            fields["context"] = None
+            blobs.append(context_json)
+
+    return fields, blobs
+
+
+def _blob_digest(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _utc_timestamp(dt: Optional[datetime] = None) -> str:
+    """ISO-Format mit Millisekunden: 2024-01-03T14:30:45.123Z"""
+    return (dt or datetime.utcnow()).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _row_to_message(row) -> dict:
+    """Wandelt eine Zeile (_MESSAGE_COLUMNS) in ein Nachrichten-Dict um.
 
-        return messages
+    Ausgelagerte Inhalte erscheinen nur als Referenz (content_ref/context_ref),
+    content enthält dann die Vorschau.
+    """
+    message = {
+        "id": row[0],
+        "from": row[1],
+        "to": row[2],
+        "content": row[3],
+        "context": json.loads(row[4]) if row[4] else None,
+        "timestamp": row[5]
+    }
+    if row[6]:
+        message["content_ref"] = row[6]
+    if row[7]:
+        message["context_ref"] = row[7]
+    return message
@@ -0,0 +1,22 @@
+"""Einfache Zähler für Betriebsmetriken des Bridge Servers."""
+
+from collections import Counter
+
+
+class Metrics:
+    """Prozessweite Zähler, abrufbar über die "stats"-Nachricht."""
+
+    def __init__(self):
+        self._counters: Counter[str] = Counter()
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        """Erhöht einen Zähler."""
+        self._counters[name] += amount
+
+    def get(self, name: str) -> int:
+        """Aktueller Wert eines Zählers."""
+        return self._counters[name]
+
+    def snapshot(self) -> dict[str, int]:
+        """Alle Zähler als Dict."""
+        return dict(self._counters)
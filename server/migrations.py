@@ -0,0 +1,358 @@
+"""Schema-Versionen und Online-Migrationen für messages.db.
+
+Version 1: ursprüngliches Schema - id TEXT PRIMARY KEY (UUID4), Zeitstempel
+           als ISO-Text, Reihenfolge über die implizite rowid
+Version 2: seq INTEGER PRIMARY KEY (Alias der rowid, auch über VACUUM
+           stabil) und ts_ms (Epoch-Millisekunden) für Zeitbereiche
+Version 3: message_files - context.file und Zeilenbereich jeder Nachricht
+           als indizierte Seitentabelle; Bestandsdaten werden nachgetragen
+Version 4: seq mit AUTOINCREMENT - ohne vergibt SQLite die höchste seq neu,
+           sobald deren Zeile gelöscht ist (TTL, Retention), und Cursor von
+           Export, unread_ack und Scrollback überspringen die neue Zeile
+
+Neue Datenbanken werden direkt in der neuesten Version angelegt. Bestehende
+werden im laufenden Betrieb migriert, ohne den Server anzuhalten:
+
+1. Zieltabelle (messages_v2 bzw. messages_v4) samt Indizes anlegen;
+   Trigger auf messages spiegeln ab jetzt jede Änderung dorthin
+2. Bestandszeilen in kleinen Batches in rowid-Reihenfolge kopieren. Der
+   Fortschritt steht in schema_version.cursor, ein Neustart setzt fort
+3. Umschalten in einer Transaktion: Trigger und alte Tabelle löschen,
+   die Zieltabelle in messages umbenennen
+
+Die rowid wird als seq übernommen, damit der Volltextindex und die
+unread-Cursor der Clients gültig bleiben.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Optional
+
+import aiosqlite
+
+from .storage import file_reference
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 4
+
+
+def iso_to_ms_sql(expr: str) -> str:
+    """SQL-Ausdruck: ISO-Zeitstempel -> Epoch-Millisekunden (NULL bei ungültigem Text)."""
+    return f"CAST(ROUND((julianday({expr}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+# Schema Version 4; {table} ist messages bzw. die Zieltabelle während der Migration
+_MESSAGES_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL,
+        from_peer TEXT NOT NULL,
+        to_peer TEXT NOT NULL,
+        content TEXT NOT NULL,
+        context TEXT,
+        timestamp TEXT NOT NULL,
+        ts_ms INTEGER NOT NULL,
+        delivered INTEGER DEFAULT 0,
+        content_ref TEXT,
+        context_ref TEXT,
+        expires_at TEXT,
+        client_id TEXT,
+        conversation TEXT
+    )
+"""
+
+# Indexnamen unterscheiden sich von Version 1, damit sie schon während der
+# Migration neben den alten Indizes bestehen können
+_INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_id ON {table}(id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_to_peer ON {table}(to_peer, delivered)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_id"
+    " ON {table}(from_peer, client_id, to_peer) WHERE client_id IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON {table}(conversation)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_expires_at ON {table}(expires_at) WHERE expires_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS idx_messages_ts_ms ON {table}(ts_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_content_ref ON {table}(content_ref) WHERE content_ref IS NOT NULL",
+]
+
+# Seit Version 3; seq ist die rowid der Nachricht. Wird bei jedem Start
+# angelegt, damit store() schon vor dem Nachtragen neue Zeilen einträgt.
+_FILES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS message_files (
+        seq INTEGER PRIMARY KEY,
+        file TEXT NOT NULL,
+        line_start INTEGER,
+        line_end INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_message_files_file ON message_files(file, seq)",
+]
+
+# Textquelle des Volltextindex (FTS5 external content): der Index speichert
+# keinen Text, snippet() und Spaltenfilter lesen den vollen Inhalt hier -
+# auch aus dem Blob-Store, der große Inhalte nur einmal pro Hash hält
+FTS_SOURCE_SQL = """
+    CREATE VIEW IF NOT EXISTS messages_fts_source AS
+    SELECT m.rowid AS seq,
+           COALESCE(b.data, m.content) AS content,
+           json_extract(COALESCE(bc.data, m.context), '$.file') AS file
+    FROM messages m
+    LEFT JOIN blobs b ON b.hash = m.content_ref
+    LEFT JOIN blobs bc ON bc.hash = m.context_ref
+"""
+
+# Spalten, die Version 1 und 2 gemeinsam haben
+_COLUMNS = [
+    "id", "from_peer", "to_peer", "content", "context", "timestamp", "delivered",
+    "content_ref", "context_ref", "expires_at", "client_id", "conversation"
+]
+
+
+async def table_exists(db: aiosqlite.Connection, name: str) -> bool:
+    cursor = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return await cursor.fetchone() is not None
+
+
+async def current_version(db: aiosqlite.Connection) -> int:
+    """Höchste vollständig angewendete Schema-Version (0 = noch nicht erfasst)."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT,
+            cursor INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version WHERE applied_at IS NOT NULL")
+    row = await cursor.fetchone()
+    return row[0] or 0
+
+
+async def mark_applied(db: aiosqlite.Connection, version: int) -> None:
+    await db.execute(
+        """
+        INSERT INTO schema_version (version, applied_at) VALUES (?, ?)
+        ON CONFLICT(version) DO UPDATE SET applied_at = excluded.applied_at
+        """,
+        (version, _now())
+    )
+
+
+async def create_file_index(db: aiosqlite.Connection) -> None:
+    for sql in _FILES_SQL:
+        await db.execute(sql)
+
+
+async def create_schema(db: aiosqlite.Connection) -> None:
+    """Legt messages für eine neue Datenbank direkt in der neuesten Version an."""
+    await db.execute(_MESSAGES_SQL.format(table="messages"))
+    for sql in _INDEXES:
+        await db.execute(sql.format(table="messages"))
+    await create_file_index(db)
+    for version in range(1, SCHEMA_VERSION + 1):
+        await mark_applied(db, version)
+
+
+class MessagesV2:
+    """Version 1 -> 2: seq als INTEGER PRIMARY KEY und ts_ms."""
+
+    version = 2
+    table = "messages_v2"
+
+    _columns = ", ".join(["seq", *_COLUMNS, "ts_ms"])
+
+    @property
+    def _copy(self) -> str:
+        return (
+            f"INSERT OR IGNORE INTO {self.table} ({self._columns}) "
+            f"SELECT rowid, {', '.join(_COLUMNS)}, COALESCE(ts_ms, {iso_to_ms_sql('timestamp')}) FROM messages"
+        )
+
+    async def start(self, db: aiosqlite.Connection) -> None:
+        """Zieltabelle und Trigger anlegen (idempotent, auch nach Abbruch)."""
+        await db.execute(_MESSAGES_SQL.format(table=self.table))
+        for sql in _INDEXES:
+            await db.execute(sql.format(table=self.table))
+
+        new_values = ", ".join(f"NEW.{c}" for c in _COLUMNS)
+        new_ts = f"COALESCE(NEW.ts_ms, {iso_to_ms_sql('NEW.timestamp')})"
+        assignments = ", ".join(f"{c} = NEW.{c}" for c in _COLUMNS)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_insert AFTER INSERT ON messages BEGIN
+                INSERT OR REPLACE INTO {self.table} ({self._columns}) VALUES (NEW.rowid, {new_values}, {new_ts});
+            END
+        """)
+        # Noch nicht kopierte Zeilen treffen hier nichts - der Batch übernimmt
+        # sie später im aktuellen Zustand
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_update AFTER UPDATE ON messages BEGIN
+                UPDATE {self.table} SET {assignments}, ts_ms = {new_ts} WHERE seq = OLD.rowid;
+            END
+        """)
+        await db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {self.table}_delete AFTER DELETE ON messages BEGIN
+                DELETE FROM {self.table} WHERE seq = OLD.rowid;
+            END
+        """)
+
+    async def step(self, db: aiosqlite.Connection, after: int, batch_size: int) -> Optional[int]:
+        """Kopiert die nächsten batch_size Zeilen; None wenn alles kopiert ist."""
+        cursor = await db.execute(
+            "SELECT MAX(rowid) FROM (SELECT rowid FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (after, batch_size)
+        )
+        row = await cursor.fetchone()
+        if row[0] is None:
+            return None
+        await db.execute(f"{self._copy} WHERE rowid > ? AND rowid <= ?", (after, row[0]))
+        return row[0]
+
+    async def finish(self, db: aiosqlite.Connection, after: int) -> None:
+        """Schaltet um. Läuft als ein Skript im Datenbank-Thread, damit keine
+        andere Anfrage zwischen DROP und RENAME auf die Tabelle zugreift.
+        Die View des Volltextindex verweist auf messages und wird dabei neu
+        angelegt (RENAME prüft alle Views)."""
+        try:
+            await db.executescript(f"""
+                BEGIN IMMEDIATE;
+                {self._copy} WHERE rowid > {int(after)};
+                DROP TRIGGER {self.table}_insert;
+                DROP TRIGGER {self.table}_update;
+                DROP TRIGGER {self.table}_delete;
+                DROP VIEW IF EXISTS messages_fts_source;
+                DROP TABLE messages;
+                ALTER TABLE {self.table} RENAME TO messages;
+                {FTS_SOURCE_SQL};
+                UPDATE schema_version SET applied_at = '{_now()}' WHERE version = {self.version};
+                COMMIT;
+            """)
+        except Exception:
+            await db.rollback()
+            raise
+
+
+class MessageFiles:
+    """Version 2 -> 3: Dateiindex für Bestandsnachrichten nachtragen.
+
+    Neue Nachrichten trägt store() selbst ein; INSERT OR IGNORE macht das
+    Nachtragen dazu idempotent. Ausgelagerte Kontexte kommen aus blobs.
+    """
+
+    version = 3
+
+    async def start(self, db: aiosqlite.Connection) -> None:
+        await create_file_index(db)
+
+    async def step(self, db: aiosqlite.Connection, after: int, batch_size: int) -> Optional[int]:
+        cursor = await db.execute(
+            """
+            SELECT m.rowid, COALESCE(m.context, b.data)
+            FROM messages m LEFT JOIN blobs b ON b.hash = m.context_ref
+            WHERE m.rowid > ? ORDER BY m.rowid LIMIT ?
+            """,
+            (after, batch_size)
+        )
+        rows = await cursor.fetchall()
+        if not rows:
+            return None
+        entries = []
+        for rowid, context in rows:
+            try:
+                reference = file_reference(json.loads(context)) if context else None
+            except ValueError:
+                reference = None
+            if reference:
+                entries.append((rowid, *reference))
+        await db.executemany(
+            "INSERT OR IGNORE INTO message_files (seq, file, line_start, line_end) VALUES (?, ?, ?, ?)",
+            entries
+        )
+        return rows[-1][0]
+
+    async def finish(self, db: aiosqlite.Connection, after: int) -> None:
+        await mark_applied(db, self.version)
+        await db.commit()
+
+
+class MessagesAutoincrement(MessagesV2):
+    """Version 3 -> 4: messages mit seq AUTOINCREMENT neu aufbauen.
+
+    Gleiches Verfahren wie Version 2, die seq bleiben erhalten (Volltextindex,
+    message_files und Client-Cursor gelten weiter). Datenbanken, die erst
+    mit dieser Version auf Version 2 migriert wurden, haben AUTOINCREMENT
+    bereits - dann ist nichts zu kopieren.
+    """
+
+    version = 4
+    table = "messages_v4"
+
+    async def start(self, db: aiosqlite.Connection) -> None:
+        if not await has_autoincrement(db):
+            await super().start(db)
+
+    async def step(self, db: aiosqlite.Connection, after: int, batch_size: int) -> Optional[int]:
+        if await has_autoincrement(db):
+            return None
+        return await super().step(db, after, batch_size)
+
+    async def finish(self, db: aiosqlite.Connection, after: int) -> None:
+        if await has_autoincrement(db):
+            await mark_applied(db, self.version)
+            await db.commit()
+            return
+        await super().finish(db, after)
+
+
+async def has_autoincrement(db: aiosqlite.Connection) -> bool:
+    """Ob messages schon mit seq AUTOINCREMENT angelegt ist."""
+    cursor = await db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'")
+    row = await cursor.fetchone()
+    return bool(row and "AUTOINCREMENT" in row[0].upper())
+
+
+MIGRATIONS = [MessagesV2(), MessageFiles(), MessagesAutoincrement()]
+
+
+async def migrate(db: aiosqlite.Connection, batch_size: int = 1000, pause: float = 0.05) -> int:
+    """Führt ausstehende Migrationen aus und gibt die erreichte Version zurück.
+
+    Zwischen zwei Batches wird die Event-Loop freigegeben (pause Sekunden),
+    Nachrichten werden währenddessen normal gespeichert und zugestellt.
+    """
+    for migration in MIGRATIONS:
+        if await current_version(db) >= migration.version:
+            continue
+
+        await db.execute(
+            "INSERT OR IGNORE INTO schema_version (version, cursor) VALUES (?, 0)",
+            (migration.version,)
+        )
+        await migration.start(db)
+        await db.commit()
+        cursor = await db.execute("SELECT cursor FROM schema_version WHERE version = ?", (migration.version,))
+        position = (await cursor.fetchone())[0]
+        logger.info(f"Migration auf Schema-Version {migration.version} gestartet (ab rowid {position})")
+
+        batches = 0
+        while (position_next := await migration.step(db, position, batch_size)) is not None:
+            position = position_next
+            await db.execute(
+                "UPDATE schema_version SET cursor = ? WHERE version = ?",
+                (position, migration.version)
+            )
+            await db.commit()
+            batches += 1
+            if batches % 100 == 0:
+                logger.info(f"Migration auf Schema-Version {migration.version}: bis rowid {position} kopiert")
+            await asyncio.sleep(pause)
+
+        await migration.finish(db, position)
+        logger.info(f"Migration auf Schema-Version {migration.version} abgeschlossen")
+
+    return await current_version(db)
+
+
+def _now() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
@@ -0,0 +1,124 @@
+"""Ausgangswarteschlange pro Verbindung mit Prioritätsspuren.
+
+Spuren:
+- CONTROL: pong, registered, Presence, sent, Fehler - immer zuerst
+- INTERACTIVE: direkte Nachrichten, Antworten auf Anfragen
+- BULK: Broadcasts, große Inhalte (Blobs, Kontext), unread-Seiten
+
+Zwischen INTERACTIVE und BULK wird gewichtet abgewechselt (weighted round
+robin), damit kurze Nachrichten nicht hinter großen Kontext-Shares warten,
+Bulk aber auch nicht verhungert.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+CONTROL = 0
+INTERACTIVE = 1
+BULK = 2
+
+# Frame als fertiger JSON-String oder als Funktion, die ihn erst beim Senden
+# erzeugt (z.B. für die seq, die der Reihenfolge auf der Leitung folgen muss)
+Frame = Union[str, Callable[[], str]]
+
+
+class QueueFullError(ConnectionError):
+    """Die Spur ist voll und leert sich nicht rechtzeitig (langsamer Empfänger)."""
+
+
+class Outbound:
+    """Sendet die Frames einer Verbindung nach Priorität über einen Writer-Task."""
+
+    def __init__(
+        self, websocket: Any, weights: tuple[int, int] = (4, 1),
+        max_pending: int = 1000, send_timeout: float = 2.0
+    ):
+        self.websocket = websocket
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.closed = False
+        self._lanes: tuple[deque, deque, deque] = (deque(), deque(), deque())
+        self._weights = {INTERACTIVE: weights[0], BULK: weights[1]}
+        self._credits = dict(self._weights)
+        self._ready = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def send(
+        self, frame: Frame, lane: int = CONTROL,
+        on_sent: Optional[Callable[[], Awaitable[None]]] = None
+    ) -> None:
+        """Reiht einen Frame ein.
+
+        Ist die Spur voll (langsamer Empfänger), wird höchstens send_timeout
+        Sekunden gewartet - außer bei CONTROL. Danach wird der Frame
+        verworfen, damit ein einzelner Empfänger nicht den Absender und den
+        restlichen Fan-out blockiert. on_sent wird nach erfolgreichem Senden
+        aufgerufen.
+
+        Raises:
+            QueueFullError: Die Spur hat sich nicht rechtzeitig geleert.
+            ConnectionError: Die Verbindung ist geschlossen.
+        """
+        queue = self._lanes[lane]
+        deadline = asyncio.get_running_loop().time() + self.send_timeout
+        while not self.closed and lane != CONTROL and len(queue) >= self.max_pending:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                raise QueueFullError("Ausgangswarteschlange voll")
+            self._drained.clear()
+            try:
+                await asyncio.wait_for(self._drained.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        if self.closed:
+            raise ConnectionError("Verbindung geschlossen")
+        queue.append((frame, on_sent))
+        self._ready.set()
+
+    def close(self) -> None:
+        """Beendet den Writer und verwirft nicht gesendete Frames."""
+        self.closed = True
+        self._task.cancel()
+        for queue in self._lanes:
+            queue.clear()
+        self._ready.set()
+        self._drained.set()
+
+    def _next(self) -> Optional[tuple]:
+        if self._lanes[CONTROL]:
+            return self._lanes[CONTROL].popleft()
+        for _ in range(2):
+            for lane in (INTERACTIVE, BULK):
+                if self._lanes[lane] and self._credits[lane] > 0:
+                    self._credits[lane] -= 1
+                    return self._lanes[lane].popleft()
+            # Runde verbraucht (oder nur noch eine Spur belegt) - Guthaben neu
+            self._credits = dict(self._weights)
+        return None
+
+    async def _run(self) -> None:
+        while not self.closed:
+            item = self._next()
+            if item is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            self._drained.set()
+
+            frame, on_sent = item
+            try:
+                await self.websocket.send(frame() if callable(frame) else frame)
+            except Exception as e:
+                logger.debug(f"Senden fehlgeschlagen, Ausgang geschlossen: {e}")
+                self.close()
+                return
+            if on_sent:
+                try:
+                    await on_sent()
+                except Exception as e:
+                    logger.error(f"Nachbearbeitung nach dem Senden fehlgeschlagen: {e}")
@@ -1,11 +1,45 @@
 """Peer Registry für AI-Connect - verwaltet online Peers."""
 
 import asyncio
+import re
+import uuid
+from collections import deque
 from datetime import datetime
 from typing import Optional, Callable, Any
 from dataclasses import dataclass, field
 
 
+# "Maschine (Projekt)" - Projekt darf selbst Klammern enthalten
+_ADDRESS_RE = re.compile(r"^(?P<machine>[^()]+?) \((?P<project>.+)\)$")
+
+
+def _parse_address(address: str) -> Optional[tuple[str, str]]:
+    """Zerlegt "Maschine (Projekt)" in (Maschine, Projekt)."""
+    match = _ADDRESS_RE.match(address)
+    if not match:
+        return None
+    return match.group("machine"), match.group("project")
+
+
+def _machine_key(name: str) -> str:
+    """Maschinenname ohne PID-Suffix: "Aragon#12345" -> "Aragon"."""
+    return name.split("#", 1)[0]
+
+
+def _public(peer: "Peer") -> dict:
+    """Für Clients sichtbare Felder eines Peers."""
+    return {
+        "name": peer.name,
+        "ip": peer.ip,
+        "connected_at": peer.connected_at
+    }
+
+
+def _is_observer(name: str) -> bool:
+    """Observer heißen "_name_" (z.B. der Chat Viewer)."""
+    return name.startswith("_") and name.endswith("_")
+
+
 @dataclass
 class Peer:
     """Repräsentiert einen verbundenen Peer."""
@@ -13,19 +47,47 @@ class Peer:
     ip: str
     connected_at: str
     project: Optional[str] = None
+    machine: Optional[str] = None
     websocket: Any = None
     last_ping: datetime = field(default_factory=datetime.utcnow)
+    # Zustellbestätigungen: Client quittiert kumulativ per "ack" bis seq
+    acks: bool = False
+    send_seq: int = 0
+    unacked: dict[int, str] = field(default_factory=dict)  # seq -> Nachrichten-ID
+    # Entfernte Peers (anderer Worker/Bridge) haben keinen websocket, sondern
+    # eine Route mit forward(peer_name, frame)
+    link: Any = None
+
+    def describe(self) -> dict:
+        """Beschreibung für andere Instanzen (Worker/Bridges)."""
+        return {
+            "name": self.name,
+            "ip": self.ip,
+            "project": self.project,
+            "machine": self.machine,
+            "connected_at": self.connected_at
+        }
 
 
 class PeerRegistry:
     """Verwaltet alle verbundenen Peers."""
 
-    def __init__(self, timeout_seconds: int = 300):  # 5 Minuten Timeout
+    def __init__(self, timeout_seconds: int = 300, changelog_size: int = 1000):  # 5 Minuten Timeout
         self._peers: dict[str, Peer] = {}
+        # Indizes für Adressierung per Muster: "mini (*)" / "* (AI-Connect)"
+        self._by_machine: dict[str, set[str]] = {}
+        self._by_project: dict[str, set[str]] = {}
         self._timeout = timeout_seconds
         self._on_join: Optional[Callable] = None
         self._on_leave: Optional[Callable] = None
 
+        # Versioniertes Verzeichnis: jede Änderung erhöht die Version, das
+        # Änderungsprotokoll erlaubt Deltas "seit Version V". Die Epoche
+        # ändert sich bei jedem Serverstart (Versionen beginnen neu).
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._changelog: deque[tuple[int, str, Optional[dict]]] = deque(maxlen=changelog_size)
+
     def on_join(self, callback: Callable) -> None:
         """Registriert Callback für Peer-Beitritt."""
         self._on_join = callback
@@ -59,13 +121,13 @@ class PeerRegistry:
             full_name = name
 
         # Observer-Namen direkt durchlassen
-        if name.startswith("_") and name.endswith("_"):
+        if _is_observer(name):
             full_name = name
 
         # Duplikat-Check: Alte Verbindung ersetzen wenn Name bereits existiert
         if full_name in self._peers:
-            existing = self._peers[full_name]
-            del self._peers[full_name]
+            existing = self._peers.pop(full_name)
+            self._unindex(existing)
             if existing.websocket:
                 try:
                     await existing.websocket.close()
@@ -77,18 +139,92 @@ class PeerRegistry:
             ip=ip,
             connected_at=datetime.utcnow().isoformat() + "Z",
             project=project,
+            machine=name,
             websocket=websocket
         )
         self._peers[full_name] = peer
+        self._index(peer)
+        self._record(peer.name, peer)
+
+        if self._on_join:
+            await self._on_join(peer)
+
+        return peer
+
+    async def register_remote(
+        self,
+        name: str,
+        ip: str,
+        link: Any,
+        project: Optional[str] = None,
+        machine: Optional[str] = None,
+        connected_at: Optional[str] = None,
+        replace_local: bool = True
+    ) -> Optional[Peer]:
+        """Registriert einen Peer, der über eine andere Instanz erreichbar ist.
+
+        name ist bereits der vollständige Name. Eine lokale Verbindung mit
+        gleichem Namen wird geschlossen - der Peer hat sich woanders neu
+        verbunden. Mit replace_local=False gewinnt stattdessen der lokale
+        Peer und es wird None zurückgegeben.
+        """
+        existing = self._peers.get(name)
+        if existing and existing.link is None and not replace_local:
+            return None
+
+        if name in self._peers:
+            existing = self._peers.pop(name)
+            self._unindex(existing)
+            if existing.websocket:
+                try:
+                    await existing.websocket.close()
+                except Exception:
+                    pass
+
+        peer = Peer(
+            name=name,
+            ip=ip,
+            connected_at=connected_at or datetime.utcnow().isoformat() + "Z",
+            project=project,
+            machine=machine or name,
+            link=link
+        )
+        self._peers[name] = peer
+        self._index(peer)
+        self._record(peer.name, peer)
 
         if self._on_join:
             await self._on_join(peer)
 
         return peer
 
+    async def unregister_remote(self, name: str, link: Any) -> None:
+        """Entfernt einen entfernten Peer, sofern er noch über link läuft."""
+        peer = self._peers.get(name)
+        if peer and peer.link is link:
+            await self.unregister(name)
+
+    async def remove_link(self, link: Any) -> list[str]:
+        """Entfernt alle Peers, die über link erreichbar waren."""
+        names = [p.name for p in self.peers_via(link)]
+        for name in names:
+            await self.unregister(name)
+        return names
+
+    def peers_via(self, link: Any) -> list[Peer]:
+        """Alle Peers, die über link erreichbar sind."""
+        return [p for p in self._peers.values() if p.link is link]
+
+    def local_peers(self) -> list[Peer]:
+        """Alle direkt mit dieser Instanz verbundenen Peers."""
+        return [p for p in self._peers.values() if p.link is None]
+
     async def unregister(self, name: str) -> None:
         """Entfernt einen Peer."""
         peer = self._peers.pop(name, None)
+        if peer:
+            self._unindex(peer)
+            self._record(peer.name, None)
         if peer and self._on_leave:
             await self._on_leave(peer)
 
@@ -103,27 +239,102 @@ class PeerRegistry:
         if name in self._peers:
             return self._peers[name]
 
-        # Dann partiellen Match: Name beginnt mit dem Suchbegriff
-        matches = [p for p in self._peers.values() if p.name.startswith(name + " (")]
+        # Dann partiellen Match über den Maschinen-Index
+        candidates = self._by_machine.get(_machine_key(name), set())
+        matches = [n for n in candidates if n.startswith(name + " (")]
         if len(matches) == 1:
-            return matches[0]
+            return self._peers.get(matches[0])
 
         # Kein oder mehrdeutiger Match
         return None
 
+    @staticmethod
+    def is_pattern(address: str) -> bool:
+        """Prüft ob eine Adresse ein Muster wie "mini (*)" oder "* (Projekt)" ist.
+
+        Der reine Broadcast "*" zählt nicht als Muster.
+        """
+        return address != "*" and _parse_address(address) is not None and "*" in address
+
+    def resolve(self, address: str) -> list[Peer]:
+        """Löst eine Adresse in alle passenden Peers auf.
+
+        Unterstützt:
+        - "mini (*)": alle Projekte auf Maschine "mini"
+        - "* (AI-Connect)": alle Maschinen mit Projekt "AI-Connect"
+        - "* (*)": alle Peers mit Projekt
+        - Sonst wie get(): exakter oder eindeutiger partieller Match
+
+        Die Auflösung läuft über die Indizes, nicht über alle Peers.
+        """
+        parsed = _parse_address(address)
+        if parsed is None or "*" not in address:
+            peer = self.get(address)
+            return [peer] if peer else []
+
+        machine, project = parsed
+        if machine != "*" and project != "*":
+            names = self._by_machine.get(_machine_key(machine), set()) & self._by_project.get(project, set())
+        elif machine != "*":
+            names = self._by_machine.get(_machine_key(machine), set())
+        elif project != "*":
+            names = self._by_project.get(project, set())
+        else:
+            names = set().union(*self._by_project.values())
+
+        return [self._peers[n] for n in sorted(names) if n in self._peers]
+
+    def _index(self, peer: Peer) -> None:
+        """Trägt einen Peer in die Maschinen-/Projekt-Indizes ein."""
+        if _is_observer(peer.name):
+            return
+        self._by_machine.setdefault(_machine_key(peer.machine or peer.name), set()).add(peer.name)
+        if peer.project:
+            self._by_project.setdefault(peer.project, set()).add(peer.name)
+
+    def _unindex(self, peer: Peer) -> None:
+        """Entfernt einen Peer aus den Indizes."""
+        machine = _machine_key(peer.machine or peer.name)
+        for index, key in ((self._by_machine, machine), (self._by_project, peer.project)):
+            names = index.get(key)
+            if names is None:
+                continue
+            names.discard(peer.name)
+            if not names:
+                del index[key]
+
     def get_all(self) -> list[dict]:
         """Gibt alle Peers als Liste zurück.
 
         Der Name enthält bereits das Projekt: "Aragon (AIfred-Intelligence)"
         """
-        return [
-            {
-                "name": p.name,
-                "ip": p.ip,
-                "connected_at": p.connected_at
-            }
-            for p in self._peers.values()
-        ]
+        return [_public(p) for p in self._peers.values()]
+
+    def _record(self, name: str, peer: Optional[Peer]) -> None:
+        """Protokolliert eine Verzeichnisänderung (peer=None: Peer weg)."""
+        self.version += 1
+        self._changelog.append((self.version, name, _public(peer) if peer else None))
+
+    def changes_since(self, version: int) -> Optional[tuple[list[dict], list[str]]]:
+        """Kompaktes Delta seit version: (beigetreten, gegangen).
+
+        Mehrere Änderungen eines Peers werden zum Endzustand zusammengefasst.
+        Returns None, wenn das Protokoll nicht weit genug zurückreicht -
+        dann braucht der Client das volle Verzeichnis.
+        """
+        if version > self.version:
+            return None
+        oldest = self._changelog[0][0] if self._changelog else self.version + 1
+        if version < oldest - 1:
+            return None
+
+        latest: dict[str, Optional[dict]] = {}
+        for change_version, name, info in self._changelog:
+            if change_version > version:
+                latest[name] = info
+        joined = [info for info in latest.values() if info is not None]
+        left = [name for name, info in latest.items() if info is None]
+        return joined, left
 
     def update_ping(self, name: str) -> None:
         """Aktualisiert den letzten Ping eines Peers."""
@@ -136,6 +347,8 @@ class PeerRegistry:
         stale = []
 
         for name, peer in list(self._peers.items()):
+            if peer.link is not None:
+                continue  # Heartbeat prüft die Instanz, an der der Peer hängt
             delta = (now - peer.last_ping).total_seconds()
             if delta > self._timeout:
                 stale.append(name)
@@ -0,0 +1,115 @@
+"""Token Buckets für Ratenbegrenzung und Zulassungskontrolle."""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Klassischer Token Bucket: rate Tokens pro Sekunde, höchstens burst."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"Rate muss größer als 0 sein: {rate}")
+        if burst is not None and burst <= 0:
+            raise ValueError(f"Burst muss größer als 0 sein: {burst}")
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, amount: float = 1.0) -> bool:
+        """Entnimmt amount Tokens, falls vorhanden."""
+        self._refill()
+        if self._tokens >= amount:
+            self._tokens -= amount
+            return True
+        return False
+
+    def retry_after(self, amount: float = 1.0) -> float:
+        """Sekunden, bis amount Tokens verfügbar sind."""
+        self._refill()
+        return max(0.0, (amount - self._tokens) / self.rate)
+
+
+class AdmissionControl:
+    """Begrenzt die Registrierungsrate, z.B. wenn nach einem Neustart alle
+    Clients gleichzeitig zurückkommen.
+
+    Abgewiesene Clients bekommen aufeinanderfolgende Zeitfenster im Abstand
+    1/rate zugeteilt, statt alle mit derselben Wartezeit zurückzukehren.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self._next_slot = 0.0
+
+    def admit(self) -> Optional[float]:
+        """None, wenn zugelassen - sonst die Wartezeit in Sekunden."""
+        if self.bucket.try_take():
+            return None
+        now = time.monotonic()
+        self._next_slot = max(now + self.bucket.retry_after(), self._next_slot) + 1 / self.bucket.rate
+        return self._next_slot - now
+
+
+class PeerLimits:
+    """Limits eines Peers: Nachrichten, Bytes und Broadcasts pro Sekunde."""
+
+    def __init__(self, config: dict):
+        self.messages = TokenBucket(config.get("messages_per_second", 20), config.get("messages_burst", 50))
+        self.bytes = TokenBucket(config.get("bytes_per_second", 1_000_000), config.get("bytes_burst", 4_000_000))
+        self.broadcasts = TokenBucket(config.get("broadcasts_per_second", 2), config.get("broadcasts_burst", 10))
+
+    def check(self, size: int, broadcast: bool) -> Optional[tuple[str, float]]:
+        """Bucht eine Nachricht ab.
+
+        Returns:
+            None, wenn erlaubt - sonst (überschrittenes Limit, Wartezeit in s).
+            Abgelehnte Nachrichten verbrauchen keine Tokens.
+        """
+        needed = [("messages", self.messages, 1), ("bytes", self.bytes, min(size, self.bytes.burst))]
+        if broadcast:
+            needed.append(("broadcasts", self.broadcasts, 1))
+
+        waits = [(bucket.retry_after(amount), name) for name, bucket, amount in needed]
+        wait, name = max(waits)
+        if wait > 0:
+            return name, wait
+        for _, bucket, amount in needed:
+            bucket.try_take(amount)
+        return None
+
+
+class PeerLimitTable:
+    """PeerLimits je registriertem Peer-Namen.
+
+    Die Buckets überleben einen Reconnect, sonst ließe sich das Limit durch
+    Neuverbinden zurücksetzen. Einträge verfallen expiry Sekunden nach der
+    letzten Nachricht.
+    """
+
+    def __init__(self, config: dict, expiry: float = 600):
+        self.config = config
+        self.expiry = expiry
+        self._limits: OrderedDict[str, tuple[float, PeerLimits]] = OrderedDict()
+        PeerLimits(config)  # Konfiguration schon beim Start prüfen
+
+    def get(self, name: str) -> PeerLimits:
+        """Limits für name (neu angelegt, falls unbekannt oder verfallen)."""
+        now = time.monotonic()
+        while self._limits:
+            oldest, (used, _) = next(iter(self._limits.items()))
+            if now - used < self.expiry:
+                break
+            del self._limits[oldest]
+
+        entry = self._limits.pop(name, None)
+        limits = entry[1] if entry else PeerLimits(self.config)
+        self._limits[name] = (now, limits)
+        return limits
@@ -0,0 +1,104 @@
+"""Retention für den Message Store - TTL, Maximalalter und Archivierung."""
+
+import asyncio
+import gzip
+import json
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+from .message_store import _utc_timestamp
+from .storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionEngine:
+    """Räumt messages.db im Hintergrund in kleinen Schritten auf.
+
+    Entfernt werden Nachrichten, deren TTL abgelaufen ist, die älter als
+    max_age_days sind oder die über max_rows_per_conversation hinausgehen.
+    Vor dem Löschen landen sie in komprimierten Tagesdateien:
+        <archive_dir>/YYYY-MM/messages-YYYY-MM-DD.ndjson.gz
+
+    Jeder Schritt bearbeitet höchstens batch_size Zeilen bzw. vacuum_pages
+    Seiten und gibt danach die Event-Loop frei, damit das Routing nie
+    länger auf die Datenbank warten muss. Bei geteilten Stores (Shards)
+    werden die Teile nacheinander bearbeitet.
+    """
+
+    def __init__(self, store: StorageBackend, config: dict, on_removed: Optional[Callable[[], None]] = None):
+        self.store = store
+        # Wird nach jedem gelöschten Batch aufgerufen (z.B. Caches verwerfen)
+        self.on_removed = on_removed
+        self.interval = config.get("interval", 300)
+        self.max_age_days = config.get("max_age_days")
+        self.max_rows = config.get("max_rows_per_conversation")
+        self.archive_dir = Path(config.get("archive_dir", "~/.config/ai-connect/archive")).expanduser()
+        self.batch_size = config.get("batch_size", 200)
+        self.vacuum_pages = config.get("vacuum_pages", 64)
+        self.pause = config.get("pause_seconds", 0.05)
+
+    async def run_forever(self) -> None:
+        """Führt die Retention periodisch aus."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await self.run_once()
+                if removed:
+                    logger.info(f"Retention: {removed} Nachrichten archiviert und entfernt")
+            except Exception as e:
+                logger.error(f"Retention fehlgeschlagen: {e}")
+
+    async def run_once(self) -> int:
+        """Ein vollständiger Durchlauf; gibt die Anzahl entfernter Nachrichten zurück."""
+        now = datetime.utcnow()
+        cutoff = _utc_timestamp(now - timedelta(days=self.max_age_days)) if self.max_age_days else None
+        removed = 0
+
+        for store in self.store.parts():
+            while True:
+                rowids = await store.find_expired(_utc_timestamp(now), cutoff, self.batch_size)
+                if not rowids:
+                    break
+                removed += await self._archive_and_delete(store, rowids)
+
+            if self.max_rows:
+                after: Optional[str] = ""
+                while after is not None:
+                    rowids, after = await store.find_overflow(self.max_rows, after, self.batch_size)
+                    if rowids:
+                        removed += await self._archive_and_delete(store, rowids)
+                    else:
+                        await asyncio.sleep(self.pause)
+
+            # Freie Seiten schrittweise an das Dateisystem zurückgeben
+            while await store.incremental_vacuum(self.vacuum_pages) > 0:
+                await asyncio.sleep(self.pause)
+
+        return removed
+
+    async def _archive_and_delete(self, store: StorageBackend, rowids: list[int]) -> int:
+        """Archiviert einen Batch und löscht ihn anschließend."""
+        messages = await store.fetch_for_archive(rowids)
+        await asyncio.to_thread(self._write_archive, messages)
+        await store.delete_messages(rowids)
+        if self.on_removed:
+            self.on_removed()
+        await asyncio.sleep(self.pause)
+        return len(rowids)
+
+    def _write_archive(self, messages: list[dict]) -> None:
+        """Hängt Nachrichten an die Archivdatei ihres Tages an."""
+        by_day: dict[str, list[dict]] = {}
+        for msg in messages:
+            by_day.setdefault(msg["timestamp"][:10], []).append(msg)
+
+        for day, day_messages in by_day.items():
+            path = self.archive_dir / day[:7] / f"messages-{day}.ndjson.gz"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Jeder Batch wird ein eigenes gzip-Member; zcat liest alle am Stück
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                for msg in day_messages:
+                    f.write(json.dumps(msg, ensure_ascii=False) + "\n")
@@ -0,0 +1,280 @@
+"""Auf mehrere SQLite-Dateien verteilter Message Store (storage.shards > 1).
+
+Jede Nachricht liegt in genau einem Shard, bestimmt über shard_by:
+- conversation: Konversationsschlüssel - ein Verlauf liegt vollständig in
+  einem Shard, unread eines Peers fragt alle Shards ab
+- recipient: Empfänger - unread fragt nur den Shard des Peers (plus den
+  der Broadcasts), ein Verlauf liegt in den Shards beider Peers
+
+Jeder Shard ist ein eigener MessageStore mit eigener Verbindung und
+eigenem Writer-Thread. Schreibzugriffe auf verschiedene Shards warten
+nicht mehr auf dieselbe Datenbanksperre.
+
+    messages.db -> messages.shard0.db, messages.shard1.db, ...
+
+Die Aufteilung steht in messages.shards.json. Eine spätere Änderung von
+Anzahl oder Schlüssel wird beim Start abgelehnt, weil bestehende
+Nachrichten sonst im falschen Shard gesucht würden.
+
+Liegt beim Start noch eine messages.db ohne Shards vor, werden ihre
+Nachrichten samt Zustellstatus in die Shards übernommen und die Datei in
+messages.db.imported umbenannt.
+
+Große Inhalte landen im Blob-Store des Shards, der die Nachricht hält.
+Scrollback für Observer gibt es nur mit einer einzelnen Datenbank.
+"""
+
+import asyncio
+import json
+import logging
+import zlib
+from heapq import merge
+from pathlib import Path
+from typing import Optional
+
+from .message_store import MessageStore, split_blobs
+from .storage import StorageBackend, conversation_key, shard_layout_path, shard_path
+
+logger = logging.getLogger(__name__)
+
+# Obere Bits des unread-Cursors: Shard, untere Bits: rowid im Shard
+_SHARD_SHIFT = 40
+_ROWID_MASK = (1 << _SHARD_SHIFT) - 1
+
+
+def _sort_key(message: dict) -> tuple[str, str]:
+    # IDs sind zeitlich sortiert - Tiebreak innerhalb derselben Millisekunde
+    return message["timestamp"], message["id"]
+
+
+class ShardedMessageStore(StorageBackend):
+    """Verteilt Nachrichten per Hash auf mehrere MessageStores."""
+
+    supports_retention = True
+    supports_paging = True
+    supports_search = True
+    supports_blobs = True
+    supports_file_index = True
+    supports_unread_counts = True
+
+    def __init__(
+        self,
+        db_path: str = "~/.config/ai-connect/messages.db",
+        shards: int = 4,
+        shard_by: str = "conversation",
+        blob_threshold: int = 8192,
+        migration_batch_size: int = 1000,
+        migration_pause: float = 0.05
+    ):
+        if shard_by not in ("conversation", "recipient"):
+            raise ValueError(f"Unbekannter Shard-Schlüssel: {shard_by}")
+        self.legacy_path = Path(db_path).expanduser()
+        self.layout_path = shard_layout_path(db_path)
+        self.shard_by = shard_by
+        self.blob_threshold = blob_threshold
+        self.migration_batch_size = migration_batch_size
+        self.shards = [
+            MessageStore(
+                str(shard_path(db_path, i)),
+                blob_threshold=blob_threshold,
+                migration_batch_size=migration_batch_size,
+                migration_pause=migration_pause
+            )
+            for i in range(shards)
+        ]
+
+    def parts(self) -> list[StorageBackend]:
+        return list(self.shards)
+
+    async def connect(self) -> None:
+        layout = {"shards": len(self.shards), "shard_by": self.shard_by}
+        if self.layout_path.exists():
+            existing = json.loads(self.layout_path.read_text())
+            if existing != layout:
+                raise ValueError(
+                    f"Shard-Aufteilung {existing} passt nicht zur Konfiguration {layout} ({self.layout_path})"
+                )
+        else:
+            self.layout_path.parent.mkdir(parents=True, exist_ok=True)
+            self.layout_path.write_text(json.dumps(layout))
+        await asyncio.gather(*(shard.connect() for shard in self.shards))
+        if self.legacy_path.exists():
+            await self._import_legacy()
+
+    async def _import_legacy(self) -> None:
+        """Übernimmt die Nachrichten einer messages.db ohne Shards.
+
+        Bricht der Umzug ab, setzt der nächste Start fort - bereits
+        übernommene IDs werden übersprungen. Erst danach wird die Datei
+        umbenannt.
+        """
+        legacy = MessageStore(str(self.legacy_path))
+        await legacy.connect()
+        imported = 0
+        try:
+            after = 0
+            while rows := await legacy.dump_rows(after, self.migration_batch_size):
+                groups: dict[MessageStore, list[dict]] = {}
+                for row in rows:
+                    groups.setdefault(self._shard_for(row["from_peer"], row["to_peer"]), []).append(row)
+                counts = await asyncio.gather(*(shard.load_rows(group) for shard, group in groups.items()))
+                imported += sum(counts)
+                after = rows[-1]["rowid"]
+        finally:
+            await legacy.close()
+
+        for suffix in ("", "-wal", "-shm"):
+            path = self.legacy_path.with_name(self.legacy_path.name + suffix)
+            if path.exists():
+                path.rename(path.with_name(self.legacy_path.name + ".imported" + suffix))
+        logger.info(f"{imported} Nachrichten aus {self.legacy_path} in {len(self.shards)} Shards übernommen")
+
+    async def close(self) -> None:
+        await asyncio.gather(*(shard.close() for shard in self.shards))
+
+    async def migrate(self) -> int:
+        versions = await asyncio.gather(*(shard.migrate() for shard in self.shards))
+        return min(versions)
+
+    # --- Zuordnung ---
+
+    def _index(self, key: str) -> int:
+        # crc32 statt hash(): muss über Prozesse und Neustarts stabil sein
+        return zlib.crc32(key.encode()) % len(self.shards)
+
+    def _shard_for(self, from_peer: str, to_peer: str) -> MessageStore:
+        key = conversation_key(from_peer, to_peer) if self.shard_by == "conversation" else to_peer
+        return self.shards[self._index(key)]
+
+    def _unread_shards(self, peer: str) -> list[int]:
+        """Shards, in denen ungelesene Nachrichten für peer liegen können."""
+        if self.shard_by == "recipient":
+            return sorted({self._index(peer), self._index("*")})
+        return list(range(len(self.shards)))
+
+    # --- Schreiben ---
+
+    async def prepare(self, content: str, context: Optional[dict] = None) -> dict:
+        """Frame-Felder wie MessageStore.prepare - die Blobs schreibt erst
+        store() in den Shard der jeweiligen Nachricht."""
+        fields, _ = split_blobs(content, context, self.blob_threshold)
+        return fields
+
+    async def store(
+        self,
+        from_peer: str,
+        to_peer: str,
+        content: str,
+        context: Optional[dict] = None,
+        prepared: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        client_id: Optional[str] = None
+    ) -> str:
+        # prepared bewusst nicht weitergeben: der Shard legt seine Blobs selbst an
+        shard = self._shard_for(from_peer, to_peer)
+        return await shard.store(from_peer, to_peer, content, context, None, ttl, client_id)
+
+    async def mark_delivered(self, message_ids: list[str]) -> None:
+        # Die ID verrät den Shard nicht; ein UPDATE ohne Treffer ist billig
+        if message_ids:
+            await asyncio.gather(*(shard.mark_delivered(message_ids) for shard in self.shards))
+
+    # --- Lesen ---
+
+    async def get_unread(self, peer: str) -> list[dict]:
+        pages = await asyncio.gather(*(self.shards[i].get_unread(peer) for i in self._unread_shards(peer)))
+        return list(merge(*pages, key=_sort_key))
+
+    async def get_unread_page(
+        self, peer: str, after: int = 0, limit: int = 100, max_bytes: int = 256 * 1024
+    ) -> tuple[list[dict], int, bool]:
+        """Seitenweise Zustellung, Shard für Shard.
+
+        Eine Seite stammt immer aus genau einem Shard; der Cursor enthält
+        Shard und rowid. Die Reihenfolge innerhalb einer Konversation
+        (bzw. eines Empfängers) bleibt damit erhalten.
+        """
+        start, rowid = after >> _SHARD_SHIFT, after & _ROWID_MASK
+        candidates = [i for i in self._unread_shards(peer) if i >= start]
+        for position, index in enumerate(candidates):
+            messages, cursor, more = await self.shards[index].get_unread_page(
+                peer, after=rowid if index == start else 0, limit=limit, max_bytes=max_bytes
+            )
+            if not messages:
+                continue
+            if not more:
+                for later in candidates[position + 1:]:
+                    if (await self.shards[later].get_unread_page(peer, limit=1))[0]:
+                        more = True
+                        break
+            return messages, index << _SHARD_SHIFT | cursor, more
+        return [], after, False
+
+    async def mark_delivered_through(self, peer: str, cursor: int) -> None:
+        # Frühere Shards wurden mit ihren eigenen Seiten bestätigt
+        await self.shards[cursor >> _SHARD_SHIFT].mark_delivered_through(peer, cursor & _ROWID_MASK)
+
+    async def unread_counts(self, peer: str, refresh: bool = False) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for index in self._unread_shards(peer):
+            for sender, n in (await self.shards[index].unread_counts(peer, refresh)).items():
+                counts[sender] = counts.get(sender, 0) + n
+        return counts
+
+    async def get_history(self, peer1: str, peer2: str, limit: int = 50) -> list[dict]:
+        indexes = {self._index(conversation_key(peer1, peer2))} if self.shard_by == "conversation" \
+            else {self._index(peer1), self._index(peer2)}
+        pages = await asyncio.gather(*(self.shards[i].get_history(peer1, peer2, limit) for i in indexes))
+        history = list(merge(*pages, key=_sort_key))
+        return history[-limit:]
+
+    async def search(
+        self,
+        peer: str,
+        query: str,
+        other_peer: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        file: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], bool]:
+        """Volltextsuche über alle Shards, zusammengeführt nach bm25-Rang."""
+        pages = await asyncio.gather(*(
+            shard.search(
+                peer, query, other_peer=other_peer, since=since, until=until, file=file,
+                limit=offset + limit, offset=0, with_rank=True
+            )
+            for shard in self.shards
+        ))
+        results = sorted((r for page, _ in pages for r in page), key=lambda r: r["rank"])
+        has_more = len(results) > offset + limit or any(more for _, more in pages)
+        page = results[offset:offset + limit]
+        for result in page:
+            del result["rank"]
+        return page, has_more
+
+    async def find_by_file(
+        self,
+        peer: str,
+        file: str,
+        prefix: bool = False,
+        lines: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], bool]:
+        """Dateiindex aller Shards, zusammengeführt nach Zeit (neueste zuerst)."""
+        pages = await asyncio.gather(*(
+            shard.find_by_file(peer, file, prefix=prefix, lines=lines, limit=offset + limit, offset=0)
+            for shard in self.shards
+        ))
+        results = sorted((r for page, _ in pages for r in page), key=_sort_key, reverse=True)
+        has_more = len(results) > offset + limit or any(more for _, more in pages)
+        return results[offset:offset + limit], has_more
+
+    async def get_blob(self, digest: str) -> Optional[str]:
+        for shard in self.shards:
+            data = await shard.get_blob(digest)
+            if data is not None:
+                return data
+        return None
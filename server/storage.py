@@ -0,0 +1,257 @@
+"""Schnittstelle für Speicher-Backends des Bridge Servers.
+
+Backends (storage.backend in config.yaml):
+- sqlite: MessageStore (message_store.py) - Standard, unterstützt alles;
+  mit storage.shards > 1 ShardedMessageStore (sharded_store.py)
+- log: LogStore (log_store.py) - Append-only Log mit In-Memory-Indizes
+  für hohe Schreiblast, ohne Volltextsuche und Blob-Store
+
+Pflicht sind connect, close, store, get_unread, mark_delivered und
+get_history (abstrakt - ein Backend ohne sie lässt sich nicht
+instanziieren). Alles andere ist optional: ein Backend meldet über die
+supports_*-Flags, was es kann, und der Server antwortet bei fehlender Funktion mit dem Fehler
+"not_supported", ohne die Methode aufzurufen.
+"""
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+
+class DuplicateMessageError(Exception):
+    """Nachricht mit dieser Client-ID wurde bereits gespeichert."""
+
+    def __init__(self, message_id: str):
+        super().__init__(message_id)
+        self.message_id = message_id
+
+
+class StorageBackend(ABC):
+    """Basisklasse aller Speicher-Backends."""
+
+    # Backend räumt mit der RetentionEngine auf (find_expired, delete_messages, ...)
+    supports_retention = False
+    # Optionale Funktionen - nur aufrufen, wenn das Flag gesetzt ist
+    supports_paging = False          # get_unread_page, mark_delivered_through
+    supports_scrollback = False      # get_recent_page
+    supports_search = False          # search
+    supports_blobs = False           # get_blob
+    supports_file_index = False      # find_by_file
+    supports_unread_counts = False   # unread_counts
+
+    @abstractmethod
+    async def connect(self) -> None:
+        """Öffnet den Store (Dateien anlegen, Indizes und Zähler laden)."""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Schließt den Store."""
+
+    def parts(self) -> list["StorageBackend"]:
+        """Einzelne Stores, aus denen das Backend besteht (für die Retention)."""
+        return [self]
+
+    async def migrate(self) -> int:
+        """Hebt die Daten auf das aktuelle Format (Standard: nichts zu tun)."""
+        return 0
+
+    async def prepare(self, content: str, context: Optional[dict] = None) -> dict:
+        """Felder für Speicherung und Versand (Standard: unverändert, ohne Blobs)."""
+        return {"content": content, "context": context}
+
+    @abstractmethod
+    async def store(
+        self,
+        from_peer: str,
+        to_peer: str,
+        content: str,
+        context: Optional[dict] = None,
+        prepared: Optional[dict] = None,
+        ttl: Optional[int] = None,
+        client_id: Optional[str] = None
+    ) -> str:
+        """Speichert eine Nachricht und gibt die ID zurück.
+
+        Raises:
+            DuplicateMessageError: client_id wurde für diesen Empfänger schon gespeichert
+        """
+
+    @abstractmethod
+    async def get_unread(self, peer: str) -> list[dict]:
+        """Alle ungelesenen Nachrichten für einen Peer (inkl. Broadcasts)."""
+
+    @abstractmethod
+    async def mark_delivered(self, message_ids: list[str]) -> None:
+        """Markiert Nachrichten (IDs) als zugestellt."""
+
+    @abstractmethod
+    async def get_history(self, peer1: str, peer2: str, limit: int = 50) -> list[dict]:
+        """Die letzten limit Nachrichten zwischen zwei Peers, alt -> neu."""
+
+    # --- Optional (siehe supports_*) ---
+
+    async def get_unread_page(
+        self, peer: str, after: int = 0, limit: int = 100, max_bytes: int = 256 * 1024
+    ) -> tuple[list[dict], int, bool]:
+        raise NotImplementedError("Seitenweise Zustellung wird von diesem Backend nicht unterstützt")
+
+    async def mark_delivered_through(self, peer: str, cursor: int) -> None:
+        raise NotImplementedError("Seitenweise Zustellung wird von diesem Backend nicht unterstützt")
+
+    async def get_recent_page(
+        self, before: Optional[int] = None, limit: int = 100
+    ) -> tuple[list[dict], Optional[int], bool]:
+        raise NotImplementedError("Scrollback wird von diesem Backend nicht unterstützt")
+
+    async def search(
+        self,
+        peer: str,
+        query: str,
+        other_peer: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        file: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], bool]:
+        raise NotImplementedError("Volltextsuche wird von diesem Backend nicht unterstützt")
+
+    async def get_blob(self, digest: str) -> Optional[str]:
+        raise NotImplementedError("Blob-Store wird von diesem Backend nicht unterstützt")
+
+    async def find_by_file(
+        self,
+        peer: str,
+        file: str,
+        prefix: bool = False,
+        lines: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], bool]:
+        raise NotImplementedError("Suche nach Datei-Kontext wird von diesem Backend nicht unterstützt")
+
+    async def unread_counts(self, peer: str, refresh: bool = False) -> dict[str, int]:
+        """Ungelesene Nachrichten für peer je Absender (inkl. Broadcasts).
+
+        refresh: Zähler vorher aus den Daten neu lesen - nötig, wenn andere
+        Prozesse in denselben Store schreiben.
+        """
+        raise NotImplementedError("Ungelesen-Zähler werden von diesem Backend nicht unterstützt")
+
+
+class UnreadCounters:
+    """Ungelesene Nachrichten je Empfänger und Absender, inkrementell gepflegt.
+
+    Die Backends zählen beim Speichern hoch und beim Zustellen bzw.
+    Löschen wieder herunter. Eine Abfrage kostet damit nur zwei
+    Dictionary-Zugriffe statt eines Scans über die Nachrichten.
+    """
+
+    def __init__(self):
+        self._counts: dict[str, dict[str, int]] = {}  # Empfänger -> Absender -> Anzahl
+
+    def add(self, to_peer: str, from_peer: str, n: int = 1) -> None:
+        senders = self._counts.setdefault(to_peer, {})
+        count = senders.get(from_peer, 0) + n
+        if count > 0:
+            senders[from_peer] = count
+        else:
+            senders.pop(from_peer, None)
+            if not senders:
+                del self._counts[to_peer]
+
+    def remove(self, to_peer: str, from_peer: str, n: int = 1) -> None:
+        self.add(to_peer, from_peer, -n)
+
+    def replace(self, to_peer: str, senders: dict[str, int]) -> None:
+        """Übernimmt neu gezählte Werte für einen Empfänger."""
+        self._counts.pop(to_peer, None)
+        for from_peer, n in senders.items():
+            self.add(to_peer, from_peer, n)
+
+    def clear(self) -> None:
+        self._counts.clear()
+
+    def for_peer(self, peer: str) -> dict[str, int]:
+        """Zähler für peer, Broadcasts eingerechnet (wie get_unread)."""
+        counts = dict(self._counts.get(peer, {}))
+        if peer != "*":
+            for from_peer, n in self._counts.get("*", {}).items():
+                counts[from_peer] = counts.get(from_peer, 0) + n
+        return counts
+
+
+def conversation_key(peer1: str, peer2: str) -> str:
+    """Richtungsunabhängiger Schlüssel einer Konversation; Broadcasts teilen sich "*"."""
+    if peer2 == "*":
+        return "*"
+    return "\x1f".join(sorted((peer1, peer2)))
+
+
+def parse_line_range(lines) -> Optional[tuple[int, int]]:
+    """Parst "42-58" oder "42" in (Start, Ende), 1-basiert und inklusiv."""
+    try:
+        text = str(lines)
+        if "-" in text:
+            start, end = (int(part) for part in text.split("-", 1))
+        else:
+            start = end = int(text)
+    except ValueError:
+        return None
+    if start < 1 or end < start:
+        return None
+    return start, end
+
+
+def file_reference(context) -> Optional[tuple[str, Optional[int], Optional[int]]]:
+    """context.file samt Zeilenbereich als (Datei, Start, Ende) für den Dateiindex."""
+    if not isinstance(context, dict) or not context.get("file") or not isinstance(context["file"], str):
+        return None
+    span = parse_line_range(context["lines"]) if context.get("lines") else None
+    return (context["file"], *(span or (None, None)))
+
+
+def shard_layout_path(db_path: str) -> Path:
+    """Aufteilung der Shards zu db_path: messages.db -> messages.shards.json"""
+    return Path(db_path).expanduser().with_suffix(".shards.json")
+
+
+def shard_path(db_path: str, index: int) -> Path:
+    """Datei eines Shards: messages.db -> messages.shard0.db, messages.shard1.db, ..."""
+    path = Path(db_path).expanduser()
+    return path.with_suffix(f".shard{index}{path.suffix}")
+
+
+def create_store(config: dict) -> StorageBackend:
+    """Erzeugt das konfigurierte Backend aus dem Abschnitt storage."""
+    backend = config.get("backend", "sqlite")
+    if backend == "log":
+        from .log_store import LogStore
+        return LogStore(
+            log_dir=config.get("log_dir", "~/.config/ai-connect/messages.log"),
+            segment_bytes=config.get("segment_bytes", 64 * 1024 * 1024),
+            compact_ratio=config.get("compact_ratio", 0.5),
+            sync=config.get("log_sync", False)
+        )
+    if backend != "sqlite":
+        raise ValueError(f"Unbekanntes Speicher-Backend: {backend}")
+
+    shards = config.get("shards", 1)
+    if shards > 1:
+        from .sharded_store import ShardedMessageStore
+        return ShardedMessageStore(
+            db_path=config.get("db_path", "~/.config/ai-connect/messages.db"),
+            shards=shards,
+            shard_by=config.get("shard_by", "conversation"),
+            blob_threshold=config.get("blob_threshold", 8192),
+            migration_batch_size=config.get("migration_batch_size", 1000),
+            migration_pause=config.get("migration_pause", 0.05)
+        )
+
+    from .message_store import MessageStore
+    return MessageStore(
+        db_path=config.get("db_path", "~/.config/ai-connect/messages.db"),
+        blob_threshold=config.get("blob_threshold", 8192),
+        migration_batch_size=config.get("migration_batch_size", 1000),
+        migration_pause=config.get("migration_pause", 0.05)
+    )
@@ -3,26 +3,119 @@
 import asyncio
 import json
 import logging
-from typing import Optional
+import os
+from typing import Any, Optional
 
 import websockets
 from websockets.server import WebSocketServerProtocol
 
 from .peer_registry import PeerRegistry
-from .message_store import MessageStore
+from .storage import DuplicateMessageError, create_store
+from .message_store import message_timestamp
+from .history_cache import HistoryCache
+from .retention import RetentionEngine
+from .delivery import DeliveryBatcher
+from .dedup import DedupWindow
+from .metrics import Metrics
+from .cluster import BusClient, WorkerLink
+from .federation import Federation
+from .ratelimit import AdmissionControl, PeerLimitTable, PeerLimits
+from .outbound import Outbound, CONTROL, INTERACTIVE, BULK
+from .firehose import Firehose
 
 logger = logging.getLogger(__name__)
 
+# Höchste Lebensdauer einer Nachricht (ttl in Sekunden): ein Jahr
+MAX_TTL = 365 * 24 * 3600
+
 
 class BridgeServer:
     """WebSocket Server der Nachrichten zwischen Peers routet."""
 
-    def __init__(self, host: str = "0.0.0.0", port: int = 9999):
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 9999,
+        config: Optional[dict] = None,
+        worker_id: Optional[int] = None,
+        bus_path: Optional[str] = None
+    ):
         self.host = host
         self.port = port
+        self.config = config or {}
+        # Zusätzlicher Unix Socket für Clients auf demselben Rechner (optional)
+        self.unix_socket: Optional[str] = self.config.get("bridge", {}).get("unix_socket") or None
+        self._unix_server = None
+
+        # Multi-Prozess-Betrieb (siehe cluster.py): Worker teilen sich den Port
+        # und tauschen Presence/Frames über den Bus aus
+        self.worker_id = worker_id
+        self.bus = BusClient(bus_path, worker_id, self._handle_bus) if bus_path else None
+        self._worker_links: dict[int, WorkerLink] = {}
+
+        # Föderation mit anderen Bridges (nur im Einzelprozess-Betrieb)
+        federation_config = self.config.get("federation", {})
+        self.federation: Optional[Federation] = None
+        if federation_config.get("node_id"):
+            if bus_path:
+                logger.warning("Föderation ist mit mehreren Workern nicht verfügbar")
+            elif not federation_config.get("token"):
+                logger.warning("Föderation benötigt ein gemeinsames token, deaktiviert")
+            else:
+                self.federation = Federation(self, federation_config)
+
+        storage_config = self.config.get("storage", {})
+        self.delivery_config = self.config.get("delivery", {})
         self.registry = PeerRegistry()
-        self.store = MessageStore()
+        self.store = create_store(storage_config)
         self._server = None
+        self.metrics = Metrics()
+        self.dedup = DedupWindow(
+            max_entries=self.delivery_config.get("dedup_entries", 10000),
+            window_seconds=self.delivery_config.get("dedup_window", 600)
+        )
+        self.deliveries = DeliveryBatcher(
+            self.store,
+            batch_size=self.delivery_config.get("ack_batch_size", 100),
+            flush_interval=self.delivery_config.get("ack_flush_interval", 0.2)
+        )
+
+        # Zulassungskontrolle gegen Reconnect-Stürme (z.B. nach einem Neustart):
+        # begrenzte Registrierungsrate, Presence wird in dieser Phase gebündelt
+        admission_config = self.config.get("admission", {})
+        self.admission = AdmissionControl(
+            rate=admission_config.get("register_rate", 20),
+            burst=admission_config.get("register_burst", 40)
+        )
+        self.settle_seconds = admission_config.get("settle_seconds", 10)
+        self.presence_interval = admission_config.get("presence_interval", 1.0)
+        self._settle_until = 0.0
+        self._presence_since: Optional[int] = None
+        self._presence_task: Optional[asyncio.Task] = None
+
+        # Limits pro Peer und Verbindungsobergrenzen
+        self.limits_config = self.config.get("limits", {})
+        self.peer_limits = PeerLimitTable(self.limits_config, expiry=self.limits_config.get("bucket_expiry", 600))
+        self.max_connections = self.limits_config.get("max_connections", 1000)
+        self.max_connections_per_ip = self.limits_config.get("max_connections_per_ip", 50)
+        self._connections: dict[str, int] = {}  # IP -> offene Verbindungen
+        self._outbound: dict[Any, Outbound] = {}  # WebSocket -> Ausgangswarteschlange
+
+        # Observer (chat_viewer) bekommen eine Kopie des Verkehrs statt Zustellung
+        self.firehose = Firehose(self.metrics, queue_size=self.config.get("observers", {}).get("queue_size", 1000))
+
+        # Verlaufsenden aktiver Konversationen im Speicher. Mit mehreren
+        # Workern schreiben die anderen an diesem Cache vorbei - dann aus.
+        self.history_cache = HistoryCache(
+            self.metrics,
+            max_bytes=0 if bus_path else storage_config.get("history_cache_bytes", 8 * 1024 * 1024),
+            tail=storage_config.get("history_cache_tail", 50)
+        )
+
+        retention_config = self.config.get("retention", {})
+        # Im Multi-Prozess-Betrieb räumt nur Worker 0 auf
+        retention_enabled = retention_config.get("enabled") and not worker_id and self.store.supports_retention
+        self.retention = RetentionEngine(self.store, retention_config, self.history_cache.clear) if retention_enabled else None
 
         self.registry.on_join(self._broadcast_peer_joined)
         self.registry.on_leave(self._broadcast_peer_left)
@@ -30,27 +123,103 @@ class BridgeServer:
     async def start(self) -> None:
         """Startet den WebSocket Server."""
         await self.store.connect()
+        if self.bus:
+            await self.bus.connect()
+            # Bestehende Peers der anderen Worker anfordern
+            await self.bus.send({"op": "sync_request"})
         self._server = await websockets.serve(
             self._handle_connection,
             self.host,
-            self.port
+            self.port,
+            reuse_port=self.bus is not None
         )
         logger.info(f"Bridge Server gestartet auf ws://{self.host}:{self.port}")
+        # Mehrere Prozesse können nicht auf demselben Socket-Pfad lauschen -
+        # lokale Clients landen dann bei Worker 0, Presence läuft über den Bus
+        if self.unix_socket and not self.worker_id:
+            await self._start_unix_listener()
+        self._settle_until = asyncio.get_running_loop().time() + self.settle_seconds
+
+        if self.federation:
+            await self.federation.start()
 
         # Heartbeat-Cleanup Task starten
         asyncio.create_task(self._heartbeat_loop())
 
+        if self.retention:
+            asyncio.create_task(self.retention.run_forever())
+
+        # Schema-Migration im laufenden Betrieb (Multi-Prozess: nur Worker 0)
+        if not self.worker_id:
+            asyncio.create_task(self._migrate_store())
+
+    async def _start_unix_listener(self) -> None:
+        """Lauscht zusätzlich auf dem Unix Socket - gleiches Protokoll, ohne TCP."""
+        path = os.path.expanduser(self.unix_socket)
+        if os.path.exists(path):
+            # Überbleibsel eines nicht sauber beendeten Servers
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._unix_server = await websockets.unix_serve(self._handle_unix_connection, path)
+        logger.info(f"Bridge Server lauscht zusätzlich auf {path}")
+
+    async def _handle_unix_connection(self, websocket: WebSocketServerProtocol) -> None:
+        await self._handle_connection(websocket, client_ip="local")
+
+    async def _migrate_store(self) -> None:
+        try:
+            await self.store.migrate()
+        except Exception as e:
+            logger.error(f"Schema-Migration fehlgeschlagen (wird beim nächsten Start fortgesetzt): {e}")
+
     async def stop(self) -> None:
         """Stoppt den Server."""
         if self._server:
             self._server.close()
             await self._server.wait_closed()
+        if self._unix_server:
+            self._unix_server.close()
+            await self._unix_server.wait_closed()
+            path = os.path.expanduser(self.unix_socket)
+            if os.path.exists(path):
+                os.unlink(path)
+        if self.bus:
+            await self.bus.close()
+        if self.federation:
+            await self.federation.stop()
+        await self.deliveries.flush()
         await self.store.close()
 
-    async def _handle_connection(self, websocket: WebSocketServerProtocol) -> None:
-        """Verarbeitet eine neue WebSocket-Verbindung."""
+    async def _handle_connection(self, websocket: WebSocketServerProtocol, client_ip: Optional[str] = None) -> None:
+        """Verarbeitet eine neue WebSocket-Verbindung.
+
+        client_ip: Vorgabe für Verbindungen ohne IP-Adresse (Unix Socket: "local")
+        """
         peer_name: Optional[str] = None
-        client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+        observer = None
+        if client_ip is None:
+            client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+
+        if (sum(self._connections.values()) >= self.max_connections
+                or self._connections.get(client_ip, 0) >= self.max_connections_per_ip):
+            self.metrics.incr("connections_rejected")
+            logger.warning(f"Verbindung von {client_ip} abgelehnt: zu viele Verbindungen")
+            await websocket.send(json.dumps({
+                "type": "error",
+                "code": "too_many_connections",
+                "error": "Zu viele Verbindungen"
+            }))
+            await websocket.close(1013, "Zu viele Verbindungen")
+            return
+        self._connections[client_ip] = self._connections.get(client_ip, 0) + 1
+        # Bis zur Registrierung gelten die Limits der Verbindung
+        connection_limits = PeerLimits(self.limits_config)
+        self._outbound[websocket] = Outbound(
+            websocket,
+            weights=tuple(self.delivery_config.get("lane_weights", (4, 1))),
+            max_pending=self.delivery_config.get("outbound_queue", 1000),
+            send_timeout=self.delivery_config.get("outbound_timeout", 2.0)
+        )
 
         try:
             async for raw_message in websocket:
@@ -58,64 +227,197 @@ class BridgeServer:
                     message = json.loads(raw_message)
                     msg_type = message.get("type")
 
+                    if msg_type == "node_hello" and self.federation and not peer_name:
+                        # Verbindung einer anderen Bridge - ab hier Knoten-Protokoll
+                        await self.federation.accept(websocket, message)
+                        return
+
                     if msg_type == "register":
+                        retry_after = self.admission.admit()
+                        if retry_after is not None:
+                            # Zu viele Registrierungen - später wiederkommen
+                            self.metrics.incr("registrations_deferred")
+                            self._settle_until = asyncio.get_running_loop().time() + self.settle_seconds
+                            await websocket.send(json.dumps({
+                                "type": "retry_later",
+                                "retry_after": round(retry_after, 2)
+                            }))
+                            await websocket.close(1013, "Bridge ausgelastet")
+                            return
+
                         requested_name = message.get("name")
+                        if message.get("observer"):
+                            # Observer: nicht in die Registry, nur Firehose
+                            if observer is None:
+                                observer = self.firehose.add(
+                                    lambda frame: self._send(websocket, frame, BULK),
+                                    message.get("filters")
+                                )
+                            await self._send(websocket, {
+                                "type": "registered",
+                                "name": requested_name,
+                                "requested": requested_name,
+                                "observer": True
+                            })
+                            logger.info(f"Observer verbunden: {requested_name} ({client_ip})")
+                            continue
+
                         project = message.get("project")
                         peer = await self.registry.register(requested_name, client_ip, websocket, project)
                         peer_name = peer.name  # Kann von requested_name abweichen!
+                        peer.acks = bool(message.get("acks"))
 
                         # Zugewiesenen Namen an Client senden
-                        await websocket.send(json.dumps({
+                        await self._send(websocket, {
                             "type": "registered",
                             "name": peer_name,
                             "requested": requested_name
-                        }))
+                        })
 
                         if peer_name != requested_name:
                             logger.info(f"Peer registriert: {peer_name} (angefragt: {requested_name}) ({client_ip})")
                         else:
                             logger.info(f"Peer registriert: {peer_name} ({client_ip})")
 
-                        # Ungelesene Nachrichten senden
-                        unread = await self.store.get_unread(peer_name)
-                        if unread:
-                            await websocket.send(json.dumps({
-                                "type": "unread",
-                                "messages": unread
-                            }))
-                            await self.store.mark_delivered([m["id"] for m in unread])
+                        # Ungelesene Nachrichten senden - seitenweise, falls der
+                        # Client Seiten bestätigt, sonst wie bisher am Stück
+                        if message.get("unread_ack") and self.store.supports_paging:
+                            await self._send_unread_page(websocket, peer_name, after=0)
+                        else:
+                            unread = await self.store.get_unread(peer_name)
+                            if unread:
+                                await self._send(websocket, {
+                                    "type": "unread",
+                                    "messages": unread
+                                }, BULK, on_sent=lambda: self.store.mark_delivered([m["id"] for m in unread]))
+
+                    elif msg_type == "unread_ack":
+                        # Seite verarbeitet: bis zum Cursor zustellen, nächste Seite schicken
+                        if not self.store.supports_paging:
+                            await self._not_supported(websocket, message, "Seitenweise Zustellung")
+                        elif peer_name:
+                            cursor = _int_field(message, "cursor", 0, minimum=0)
+                            await self.store.mark_delivered_through(peer_name, cursor)
+                            await self._send_unread_page(websocket, peer_name, after=cursor)
+
+                    elif msg_type == "ack":
+                        # Kumulative Bestätigung: alles bis seq ist beim Client angekommen
+                        peer = self.registry.get(peer_name) if peer_name else None
+                        if peer and peer.websocket is websocket:
+                            seq = _int_field(message, "seq", 0)
+                            acked = [n for n in peer.unacked if n <= seq]
+                            await self.deliveries.add([peer.unacked.pop(n) for n in acked])
+
+                    elif msg_type == "observe":
+                        # Filter eines Observers zur Laufzeit ändern
+                        if observer:
+                            observer.set_filters(message.get("filters"))
+
+                    elif msg_type == "scrollback":
+                        # Verlauf für Observer, seitenweise rückwärts
+                        if not observer:
+                            await self._send_error(websocket, message, "not_observer", "Scrollback nur für Observer")
+                        elif not self.store.supports_scrollback:
+                            await self._not_supported(websocket, message, "Scrollback")
+                        else:
+                            await self._send_scrollback(websocket, message, observer)
 
                     elif msg_type == "ping":
                         if peer_name:
                             self.registry.update_ping(peer_name)
-                        await websocket.send(json.dumps({"type": "pong"}))
+                        await self._send(websocket, {"type": "pong"})
 
                     elif msg_type == "message":
-                        await self._route_message(message, peer_name)
+                        limits = self.peer_limits.get(peer_name) if peer_name else connection_limits
+                        await self._handle_message(websocket, message, peer_name, limits, len(raw_message))
+
+                    elif msg_type == "stats":
+                        await self._send(websocket, {
+                            "type": "stats",
+                            "request_id": message.get("request_id"),
+                            "peers": self.registry.count(),
+                            "metrics": self.metrics.snapshot()
+                        })
 
                     elif msg_type == "list_peers":
                         peers = self.registry.get_all()
-                        await websocket.send(json.dumps({
+                        await self._send(websocket, {
                             "type": "peer_list",
+                            "epoch": self.registry.epoch,
+                            "version": self.registry.version,
                             "peers": peers
-                        }))
+                        })
+
+                    elif msg_type == "peer_sync":
+                        await self._send_peer_delta(websocket, message)
 
                     elif msg_type == "history":
                         other_peer = message.get("peer")
-                        limit = message.get("limit", 50)
-                        history = await self.store.get_history(peer_name, other_peer, limit)
-                        await websocket.send(json.dumps({
+                        limit = _int_field(message, "limit", 50, minimum=0)
+                        history = await self._get_history(peer_name, other_peer, limit)
+                        await self._send(websocket, {
                             "type": "history",
                             "peer": other_peer,
                             "messages": history
-                        }))
+                        }, INTERACTIVE)
+
+                    elif msg_type == "unread_count":
+                        # Nur Zähler statt Nachrichten - "gibt es etwas Neues?"
+                        if not self.store.supports_unread_counts:
+                            await self._not_supported(websocket, message, "Ungelesen-Zähler")
+                            continue
+                        # Bestätigte, noch nicht geschriebene Zustellungen zählen nicht mehr
+                        await self.deliveries.flush()
+                        senders = await self.store.unread_counts(peer_name, refresh=self.bus is not None)
+                        await self._send(websocket, {
+                            "type": "unread_count",
+                            "request_id": message.get("request_id"),
+                            "total": sum(senders.values()),
+                            "senders": senders
+                        }, INTERACTIVE)
+
+                    elif msg_type == "search":
+                        await self._handle_search(websocket, message, peer_name)
+
+                    elif msg_type == "file_history":
+                        await self._handle_file_history(websocket, message, peer_name)
+
+                    elif msg_type in ("context_request", "context_response"):
+                        # Pull-RPC: Anfrage an den Besitzer der Datei, Antwort zurück
+                        # an den Anfragenden. Wird nicht gespeichert.
+                        await self._relay_context(websocket, message, peer_name)
+
+                    elif msg_type == "blob_get":
+                        # Ausgelagerten Inhalt nachladen (lazy fetch)
+                        digest = message.get("ref")
+                        if not self.store.supports_blobs:
+                            await self._not_supported(websocket, message, "Blob-Store")
+                            continue
+                        data = await self.store.get_blob(digest) if digest else None
+                        if data is None:
+                            await self._send_error(websocket, message, "blob_not_found", f"Unbekannte Referenz: {digest}")
+                        else:
+                            await self._send(websocket, {
+                                "type": "blob",
+                                "request_id": message.get("request_id"),
+                                "ref": digest,
+                                "data": data
+                            }, BULK)
 
                 except json.JSONDecodeError:
                     logger.warning(f"Ungültige JSON-Nachricht von {client_ip}")
+                except InvalidRequestError as e:
+                    await self._send_error(websocket, message, "invalid_request", str(e))
 
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"Verbindung geschlossen: {peer_name or client_ip}")
         finally:
+            if observer:
+                self.firehose.remove(observer)
+            self._outbound.pop(websocket).close()
+            self._connections[client_ip] -= 1
+            if not self._connections[client_ip]:
+                del self._connections[client_ip]
             if peer_name:
                 # Nur entfernen wenn dieser WebSocket noch der aktive ist
                 # (verhindert Löschen nach Ersetzung durch neue Verbindung)
@@ -123,14 +425,166 @@ class BridgeServer:
                 if current_peer and current_peer.websocket is websocket:
                     await self.registry.unregister(peer_name)
 
-    async def _route_message(self, message: dict, from_peer: str) -> None:
-        """Routet eine Nachricht zum Ziel-Peer."""
+    async def _send_unread_page(self, websocket, peer_name: str, after: int) -> None:
+        """Sendet die nächste Seite ungelesener Nachrichten ab Cursor after.
+
+        Zugestellt werden die Nachrichten erst mit dem unread_ack des Clients.
+        Bricht die Verbindung vorher ab, beginnt die Wiedergabe beim nächsten
+        register an derselben Stelle.
+        """
+        messages, cursor, more = await self.store.get_unread_page(
+            peer_name,
+            after=after,
+            limit=self.delivery_config.get("unread_page_size", 100),
+            max_bytes=self.delivery_config.get("unread_page_bytes", 256 * 1024)
+        )
+        if not messages:
+            return
+        await self._send(websocket, {
+            "type": "unread",
+            "messages": messages,
+            "cursor": cursor,
+            "more": more
+        }, BULK)
+
+    async def _send_scrollback(self, websocket, message: dict, observer) -> None:
+        """Sendet eine ältere Seite aus dem Store, gefiltert wie die Firehose.
+
+        Wegen der Filter kann eine Seite weniger als limit Nachrichten
+        enthalten; der Cursor rückt trotzdem um die gelesenen Zeilen vor.
+        """
+        messages, cursor, more = await self.store.get_recent_page(
+            before=_int_field(message, "before", minimum=0),
+            limit=min(_int_field(message, "limit", 100, minimum=0), 500)
+        )
+        await self._send(websocket, {
+            "type": "scrollback",
+            "request_id": message.get("request_id"),
+            "messages": [m for m in messages if observer.matches({"type": "message", **m})],
+            "cursor": cursor,
+            "more": more
+        }, BULK)
+
+    async def _handle_message(
+        self, websocket, message: dict, from_peer: str, limits: PeerLimits, size: int
+    ) -> None:
+        """Nimmt eine Nachricht entgegen - idempotent bei gesetzter client_id.
+
+        Wiederholte Sendeversuche mit derselben client_id werden über das
+        Dedup-Fenster (bzw. den Unique-Index) erkannt und nicht erneut
+        geroutet. Der Sender bekommt in beiden Fällen ein "sent".
+        Überschreitet der Sender seine Limits, bekommt er einen Fehler
+        "rate_limited" mit retry_after und die Nachricht wird verworfen.
+        """
+        client_id = message.get("client_id")
+        try:
+            ttl = _int_field(message, "ttl", minimum=1, maximum=MAX_TTL)
+        except InvalidRequestError as e:
+            await self._send_error(websocket, message, "invalid_request", str(e), client_id=client_id)
+            return
+        if ttl is not None:
+            message["ttl"] = ttl
+
+        key = (from_peer, client_id)
+        message_ids = self.dedup.get(key) if client_id else None
+
+        if message_ids is not None:
+            duplicate = True
+        else:
+            to_peer = message.get("to")
+            exceeded = limits.check(size, broadcast=to_peer == "*" or self.registry.is_pattern(to_peer or ""))
+            if exceeded:
+                limit, retry_after = exceeded
+                self.metrics.incr("messages_rate_limited")
+                await self._send_error(
+                    websocket, message, "rate_limited", f"Limit überschritten: {limit}",
+                    client_id=client_id, retry_after=round(retry_after, 2)
+                )
+                return
+            message_ids, duplicate = await self._route_message(message, from_peer)
+            if client_id:
+                self.dedup.remember(key, message_ids)
+
+        if duplicate:
+            self.metrics.incr("dedup_hits")
+            logger.info(f"Duplikat verworfen: {client_id} von {from_peer}")
+
+        if client_id:
+            await self._send(websocket, {
+                "type": "sent",
+                "client_id": client_id,
+                "message_ids": message_ids,
+                "duplicate": duplicate
+            })
+
+    async def _route_message(self, message: dict, from_peer: str) -> tuple[list[str], bool]:
+        """Routet eine Nachricht zum Ziel-Peer.
+
+        Ziele:
+        - "*": Broadcast an alle
+        - "mini (*)" / "* (Projekt)": Fan-out an alle passenden Peers
+        - Sonst: direkter Peer (exakt oder eindeutig partiell)
+
+        Returns:
+            (gespeicherte Nachrichten-IDs, True wenn alles schon gespeichert war)
+        """
         to_peer = message.get("to")
         content = message.get("content", "")
         context = message.get("context")
+        ttl = message.get("ttl")
+        client_id = message.get("client_id")
+
+        # Große Inhalte einmal in den Blob-Store, Frames tragen nur die Referenz
+        prepared = await self.store.prepare(content, context)
+
+        async def store(recipient: str) -> tuple[str, bool]:
+            try:
+                msg_id = await self.store.store(from_peer, recipient, content, context, prepared, ttl, client_id)
+                self._cache_stored(msg_id, from_peer, recipient, prepared, ttl)
+                return msg_id, True
+            except DuplicateMessageError as e:
+                return e.message_id, False
+
+        if to_peer != "*" and self.registry.is_pattern(to_peer):
+            targets = [p for p in self.registry.resolve(to_peer) if p.name != from_peer]
+            if not targets:
+                logger.warning(f"Keine Peers für Muster {to_peer} (von {from_peer})")
+            # Pro Empfänger speichern, damit die Historie je Paar vollständig ist
+            message_ids = []
+            stored_any = False
+            delivered = []
+            for target in targets:
+                msg_id, stored = await store(target.name)
+                message_ids.append(msg_id)
+                stored_any = stored_any or stored
+                if stored:
+                    delivered.append(target.name)
+                    await self._deliver(target, {
+                        "type": "message",
+                        "id": msg_id,
+                        "from": from_peer,
+                        "to": target.name,
+                        "via": to_peer,
+                        **prepared
+                    })
+            self.metrics.incr("messages_routed")
+            if delivered and len(self.firehose):
+                self.firehose.publish({
+                    "type": "message",
+                    "id": message_ids[0],
+                    "from": from_peer,
+                    "to": to_peer,
+                    "via": to_peer,
+                    "recipients": delivered,
+                    **prepared
+                })
+            return message_ids, bool(targets) and not stored_any
 
         # Nachricht speichern
-        msg_id = await self.store.store(from_peer, to_peer, content, context)
+        msg_id, stored = await store(to_peer)
+        if not stored:
+            return [msg_id], True
+        self.metrics.incr("messages_routed")
 
         # Nachricht für Übertragung vorbereiten
         outgoing = {
@@ -138,35 +592,250 @@ class BridgeServer:
             "id": msg_id,
             "from": from_peer,
             "to": to_peer,
-            "content": content,
-            "context": context
+            **prepared
         }
+        self.firehose.publish(outgoing)
 
         if to_peer == "*":
-            # Broadcast an alle außer Sender
-            for peer in self.registry.get_all():
-                if peer["name"] != from_peer:
-                    target = self.registry.get(peer["name"])
-                    if target and target.websocket:
-                        try:
-                            await target.websocket.send(json.dumps(outgoing))
-                            await self.store.mark_delivered([msg_id])
-                        except Exception as e:
-                            logger.warning(f"Fehler beim Senden an {peer['name']}: {e}")
+            # Broadcast an alle lokalen Peers außer Sender, die übrigen Worker
+            # verteilen an ihre eigenen Peers
+            for target in self.registry.local_peers():
+                if target.name != from_peer:
+                    await self._deliver(target, outgoing)
+            if self.bus:
+                await self.bus.send({"op": "fanout", "exclude": from_peer, "frame": outgoing})
+            if self.federation:
+                await self.federation.fanout(outgoing, exclude=from_peer)
         else:
             # Direkte Nachricht
             target = self.registry.get(to_peer)
-            if target and target.websocket:
-                try:
-                    await target.websocket.send(json.dumps(outgoing))
-                    await self.store.mark_delivered([msg_id])
-                except Exception as e:
-                    logger.warning(f"Fehler beim Senden an {to_peer}: {e}")
+            if target:
+                await self._deliver(target, outgoing)
+
+        return [msg_id], False
+
+    async def _get_history(self, peer: str, other_peer: str, limit: int) -> list[dict]:
+        """Verlauf zweier Peers, wenn möglich aus dem Cache.
+
+        Bei einem Fehlschlag wird mindestens history_cache_tail gelesen,
+        damit auch spätere, etwas größere Anfragen Treffer werden.
+        """
+        history = self.history_cache.get(peer, other_peer, limit)
+        if history is not None:
+            return history
+        fetch = max(limit, self.history_cache.tail) if self.history_cache.enabled else limit
+        history = await self.store.get_history(peer, other_peer, fetch)
+        self.history_cache.fill(peer, other_peer, history, fetch)
+        return history[-limit:] if limit > 0 else []
+
+    def _cache_stored(
+        self, msg_id: str, from_peer: str, to_peer: str, prepared: dict, ttl: Optional[int] = None
+    ) -> None:
+        """Schreibt eine gespeicherte Nachricht im Verlaufs-Cache fort."""
+        timestamp = message_timestamp(msg_id)
+        if ttl or timestamp is None:
+            # Läuft ab bzw. Zeitstempel unbekannt - beim nächsten Mal aus der Datenbank
+            self.history_cache.invalidate(from_peer, to_peer)
+            return
+        message = {
+            "id": msg_id,
+            "from": from_peer,
+            "to": to_peer,
+            "content": prepared["content"],
+            "context": prepared["context"],
+            "timestamp": timestamp
+        }
+        for field in ("content_ref", "context_ref"):
+            if prepared.get(field):
+                message[field] = prepared[field]
+        self.history_cache.append(message)
+
+    async def _deliver(self, target, outgoing: dict) -> None:
+        """Sendet eine gespeicherte Nachricht an einen Peer.
+
+        Clients mit Bestätigungen bekommen eine fortlaufende seq; zugestellt
+        ist die Nachricht erst mit deren ack (at-least-once). Bei älteren
+        Clients gilt weiterhin ein erfolgreiches send() als Zustellung.
+        """
+        if target.link is not None:
+            if await target.link.forward(target.name, outgoing):
+                # Der Zielknoten speichert die Nachricht und stellt sie selbst zu
+                await self.federation.handed_over(outgoing)
+            return
+        if not target.websocket:
+            return
+
+        def with_seq() -> str:
+            # seq erst beim Senden vergeben: Spuren überholen sich, die seq
+            # muss aber der Reihenfolge auf der Leitung folgen (kumulatives ack)
+            target.send_seq += 1
+            target.unacked[target.send_seq] = outgoing["id"]
+            return json.dumps({**outgoing, "seq": target.send_seq})
+
+        try:
+            if target.acks:
+                await self._send(target.websocket, with_seq, _message_lane(outgoing))
+            else:
+                await self._send(
+                    target.websocket, outgoing, _message_lane(outgoing),
+                    on_sent=lambda: self.deliveries.add([outgoing["id"]])
+                )
+        except Exception as e:
+            # Bleibt unzugestellt gespeichert und kommt mit dem nächsten unread
+            logger.warning(f"Fehler beim Senden an {target.name}: {e}")
+
+    async def _handle_search(self, websocket, message: dict, peer_name: Optional[str]) -> None:
+        """Beantwortet eine Volltextsuche (gerankt, seitenweise)."""
+        query = (message.get("query") or "").strip()
+        if not peer_name or not query:
+            await self._send_error(websocket, message, "invalid_request", "Suche benötigt Registrierung und query")
+            return
+        if not self.store.supports_search:
+            await self._not_supported(websocket, message, "Volltextsuche")
+            return
+
+        limit = min(_int_field(message, "limit", 20, minimum=0), 100)
+        offset = _int_field(message, "offset", 0, minimum=0)
+        try:
+            results, has_more = await self.store.search(
+                peer_name,
+                query,
+                other_peer=message.get("peer"),
+                since=message.get("since"),
+                until=message.get("until"),
+                file=message.get("file"),
+                limit=limit,
+                offset=offset
+            )
+        except Exception as e:
+            await self._send_error(websocket, message, "search_failed", str(e))
+            return
+
+        await self._send(websocket, {
+            "type": "search_results",
+            "request_id": message.get("request_id"),
+            "query": query,
+            "offset": offset,
+            "has_more": has_more,
+            "results": results
+        }, INTERACTIVE)
+
+    async def _handle_file_history(self, websocket, message: dict, peer_name: Optional[str]) -> None:
+        """Beantwortet eine Abfrage nach Datei-Kontext (Pfad oder Präfix, seitenweise)."""
+        file = (message.get("file") or "").strip()
+        if not peer_name or not file:
+            await self._send_error(websocket, message, "invalid_request", "Abfrage benötigt Registrierung und file")
+            return
+        if not self.store.supports_file_index:
+            await self._not_supported(websocket, message, "Suche nach Datei-Kontext")
+            return
+
+        limit = min(_int_field(message, "limit", 20, minimum=0), 100)
+        offset = _int_field(message, "offset", 0, minimum=0)
+        messages, has_more = await self.store.find_by_file(
+            peer_name,
+            file,
+            prefix=bool(message.get("prefix")),
+            lines=message.get("lines"),
+            limit=limit,
+            offset=offset
+        )
+        await self._send(websocket, {
+            "type": "file_history",
+            "request_id": message.get("request_id"),
+            "file": file,
+            "offset": offset,
+            "has_more": has_more,
+            "messages": messages
+        }, INTERACTIVE)
+
+    async def _relay_context(self, websocket, message: dict, from_peer: Optional[str]) -> None:
+        """Leitet context_request/context_response an den adressierten Peer weiter."""
+        to_peer = message.get("to")
+        target = self.registry.get(to_peer) if to_peer else None
+        if not target or not (target.websocket or target.link):
+            if message.get("type") == "context_request":
+                await self._send_error(websocket, message, "peer_offline", f"Peer nicht erreichbar: {to_peer}")
+            return
+
+        relayed = {**message, "from": from_peer, "to": target.name}
+        if target.link is not None:
+            await target.link.forward(target.name, relayed)
+            return
+        # Anfragen sind klein, Antworten tragen den (evtl. großen) Dateiinhalt
+        lane = INTERACTIVE if message.get("type") == "context_request" else BULK
+        try:
+            await self._send(target.websocket, relayed, lane)
+        except Exception as e:
+            logger.warning(f"Fehler beim Weiterleiten an {target.name}: {e}")
+
+    async def _send_peer_delta(self, websocket, message: dict) -> None:
+        """Beantwortet "Änderungen seit Version V" mit einem kompakten Delta.
+
+        Bei anderer Epoche (Server neu gestartet) oder zu alter Version
+        gibt es das volle Verzeichnis (full=True).
+        """
+        registry = self.registry
+        since = _int_field(message, "since", 0)
+        changes = None
+        if message.get("epoch") == registry.epoch:
+            changes = registry.changes_since(since)
+
+        reply = {
+            "type": "peer_delta",
+            "request_id": message.get("request_id"),
+            "epoch": registry.epoch,
+            "since": since,
+            "version": registry.version,
+            "full": changes is None
+        }
+        if changes is None:
+            reply["joined"], reply["left"] = registry.get_all(), []
+        else:
+            reply["joined"], reply["left"] = changes
+        await self._send(websocket, reply)
+
+    async def _send(self, websocket, frame, lane: int = CONTROL, on_sent=None) -> None:
+        """Reiht einen Frame (dict, JSON-String oder Funktion) in die
+        Ausgangswarteschlange der Verbindung ein."""
+        outbound = self._outbound.get(websocket)
+        if outbound is None:
+            raise ConnectionError("Verbindung geschlossen")
+        if isinstance(frame, dict):
+            frame = json.dumps(frame)
+        await outbound.send(frame, lane, on_sent)
+
+    async def _send_error(self, websocket, request: dict, code: str, detail: str, **extra) -> None:
+        """Meldet einen Fehler zu einer Anfrage an den Client."""
+        try:
+            await self._send(websocket, {
+                "type": "error",
+                "request_id": request.get("request_id"),
+                "code": code,
+                "error": detail,
+                **extra
+            })
+        except Exception:
+            pass
+
+    async def _not_supported(self, websocket, request: dict, feature: str) -> None:
+        """Meldet eine Funktion, die das Speicher-Backend nicht hat."""
+        await self._send_error(websocket, request, "not_supported", f"{feature} wird von diesem Backend nicht unterstützt")
 
     async def _broadcast_peer_joined(self, peer) -> None:
         """Informiert alle Peers über neuen Teilnehmer."""
+        version = self.registry.version  # Vor den awaits festhalten
+        if self.bus and peer.link is None:
+            await self.bus.send({"op": "join", "peer": peer.describe()})
+        if self.federation and peer.link is None:
+            await self.federation.local_changed(peer, joined=True)
+        self.firehose.publish({"type": "peer_joined", "peer": {"name": peer.name, "ip": peer.ip, "project": peer.project}})
+        if self._coalesce_presence(version):
+            return
         message = json.dumps({
             "type": "peer_joined",
+            "epoch": self.registry.epoch,
+            "version": version,
             "peer": {
                 "name": peer.name,
                 "ip": peer.ip,
@@ -177,41 +846,176 @@ class BridgeServer:
 
     async def _broadcast_peer_left(self, peer) -> None:
         """Informiert alle Peers über Austritt."""
+        version = self.registry.version  # Vor den awaits festhalten
+        if self.bus and peer.link is None:
+            await self.bus.send({"op": "leave", "peer": peer.name})
+        if self.federation and peer.link is None:
+            await self.federation.local_changed(peer, joined=False)
+        self.firehose.publish({"type": "peer_left", "peer": peer.name})
+        if self._coalesce_presence(version):
+            return
         message = json.dumps({
             "type": "peer_left",
+            "epoch": self.registry.epoch,
+            "version": version,
             "peer": peer.name
         })
         await self._broadcast(message, exclude=peer.name)
 
+    def _coalesce_presence(self, version: int) -> bool:
+        """Bündelt Presence-Änderungen, solange sich der Server einpendelt.
+
+        Statt eines peer_joined pro Registrierung an alle (O(n²) Frames bei
+        einem Reconnect-Sturm) geht alle presence_interval Sekunden ein
+        einziges peer_delta raus. Returns True, wenn gebündelt wird.
+        """
+        if asyncio.get_running_loop().time() >= self._settle_until:
+            return False
+        if self._presence_since is None:
+            self._presence_since = version - 1
+        if self._presence_task is None or self._presence_task.done():
+            self._presence_task = asyncio.create_task(self._flush_presence())
+        return True
+
+    async def _flush_presence(self) -> None:
+        await asyncio.sleep(self.presence_interval)
+        registry = self.registry
+        since, self._presence_since = self._presence_since, None
+        changes = registry.changes_since(since)
+        delta = {
+            "type": "peer_delta",
+            "epoch": registry.epoch,
+            "since": since,
+            "version": registry.version,
+            "full": changes is None
+        }
+        if changes is None:
+            delta["joined"], delta["left"] = registry.get_all(), []
+        else:
+            delta["joined"], delta["left"] = changes
+        await self._broadcast(json.dumps(delta))
+
     async def _broadcast(self, message: str, exclude: Optional[str] = None) -> None:
-        """Sendet Nachricht an alle Peers."""
-        for peer_info in self.registry.get_all():
-            if peer_info["name"] != exclude:
-                peer = self.registry.get(peer_info["name"])
-                if peer and peer.websocket:
-                    try:
-                        await peer.websocket.send(message)
-                    except Exception:
-                        pass
+        """Sendet Nachricht an alle lokal verbundenen Peers."""
+        for peer in self.registry.local_peers():
+            if peer.name != exclude and peer.websocket:
+                try:
+                    await self._send(peer.websocket, message)
+                except Exception:
+                    pass
+
+    async def deliver_forwarded(self, peer_name: str, frame: dict, persist: bool) -> None:
+        """Stellt einen von einem anderen Worker/Knoten weitergeleiteten Frame zu.
+
+        persist: Nachricht vorher in der eigenen Datenbank speichern (Föderation),
+                 damit sie bei Offline-Empfängern per unread nachgeliefert wird.
+        """
+        target = self.registry.get(peer_name)
+        local = target if target and target.link is None else None
+
+        if frame.get("type") != "message":
+            if local and local.websocket:
+                try:
+                    await self._send(local.websocket, frame, _message_lane(frame))
+                except Exception as e:
+                    logger.warning(f"Fehler beim Senden an {local.name}: {e}")
+            return
+
+        if persist:
+            frame = await self._persist_forwarded(frame, local.name if local else peer_name)
+            if frame is None:
+                return
+        if local:
+            await self._deliver(local, frame)
+
+    async def fanout_forwarded(self, frame: dict, exclude: Optional[str], persist: bool) -> None:
+        """Verteilt einen weitergeleiteten Broadcast an die lokalen Peers."""
+        if persist:
+            frame = await self._persist_forwarded(frame, "*")
+            if frame is None:
+                return
+        for target in self.registry.local_peers():
+            if target.name != exclude:
+                await self._deliver(target, frame)
+
+    async def _persist_forwarded(self, frame: dict, to_peer: str) -> Optional[dict]:
+        """Speichert eine weitergeleitete Nachricht lokal.
+
+        Die ursprüngliche ID dient als client_id - erneut gesendete Frames
+        (store-and-forward nach Verbindungsabbruch) werden so verworfen.
+        """
+        content = frame.get("content", "")
+        context = frame.get("context")
+        prepared = await self.store.prepare(content, context)
+        try:
+            msg_id = await self.store.store(frame.get("from", "?"), to_peer, content, context, prepared, client_id=frame.get("id"))
+        except DuplicateMessageError:
+            self.metrics.incr("dedup_hits")
+            return None
+        self._cache_stored(msg_id, frame.get("from", "?"), to_peer, prepared)
+        return {**frame, **prepared, "id": msg_id}
+
+    async def _handle_bus(self, message: dict) -> None:
+        """Verarbeitet Nachrichten anderer Worker vom Bus."""
+        op = message.get("op")
+        source = message.get("source")
+
+        if op == "deliver":
+            # Frame für einen bei uns verbundenen Peer (gemeinsame DB, schon gespeichert)
+            await self.deliver_forwarded(message.get("peer", ""), message.get("frame", {}), persist=False)
+
+        elif op == "fanout":
+            await self.fanout_forwarded(message.get("frame", {}), message.get("exclude"), persist=False)
+
+        elif op == "join":
+            link = self._worker_links.setdefault(source, WorkerLink(self.bus, source))
+            info = message.get("peer", {})
+            await self.registry.register_remote(
+                info["name"], info.get("ip", ""), link,
+                project=info.get("project"),
+                machine=info.get("machine"),
+                connected_at=info.get("connected_at")
+            )
+
+        elif op == "leave":
+            link = self._worker_links.get(source)
+            if link:
+                await self.registry.unregister_remote(message.get("peer", ""), link)
+
+        elif op == "sync_request":
+            for peer in self.registry.local_peers():
+                await self.bus.send({"op": "join", "peer": peer.describe()}, target=source)
+
+        elif op == "worker_down":
+            link = self._worker_links.pop(source, None)
+            if link:
+                removed = await self.registry.remove_link(link)
+                logger.warning(f"Worker {source} weg, {len(removed)} Peers entfernt")
 
     async def _heartbeat_loop(self) -> None:
         """Prüft regelmäßig auf inaktive Peers und pingt sie an."""
         while True:
             await asyncio.sleep(60)  # Alle 60 Sekunden statt 10
 
-            # Alle Peers anpingen um tote Verbindungen zu erkennen
-            dead_peers = []
+            # Alle Peers per WebSocket-Ping anpingen um tote Verbindungen zu
+            # erkennen - erst das Pong belegt, dass die Gegenseite noch lebt
+            names = []
+            probes = []
             for peer_info in self.registry.get_all():
                 peer = self.registry.get(peer_info["name"])
                 if peer and peer.websocket:
-                    try:
-                        await peer.websocket.send(json.dumps({"type": "ping"}))
-                        # Ping erfolgreich - Zeitstempel aktualisieren
-                        self.registry.update_ping(peer_info["name"])
-                    except Exception:
-                        # Verbindung tot - sofort entfernen
-                        dead_peers.append(peer_info["name"])
-                        logger.info(f"Verbindung tot: {peer_info['name']}")
+                    names.append(peer.name)
+                    probes.append(self._probe(peer.websocket))
+            results = await asyncio.gather(*probes)
+
+            dead_peers = []
+            for name, alive in zip(names, results):
+                if alive:
+                    self.registry.update_ping(name)
+                else:
+                    # Verbindung tot - sofort entfernen
+                    dead_peers.append(name)
+                    logger.info(f"Verbindung tot: {name}")
 
             # Tote Peers sofort entfernen
             for name in dead_peers:
@@ -221,3 +1025,62 @@ class BridgeServer:
             stale = await self.registry.cleanup_stale()
             for name in stale:
                 logger.info(f"Peer timeout: {name}")
+
+    async def _probe(self, websocket, timeout: float = 10) -> bool:
+        """True, wenn die Verbindung offen ist und rechtzeitig ein Pong kommt."""
+        outbound = self._outbound.get(websocket)
+        if outbound is None or outbound.closed:
+            return False
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, timeout)
+            return True
+        except Exception:
+            return False
+
+
+def _message_lane(frame: dict) -> int:
+    """Spur eines Frames: direkte, kleine Nachrichten sind interaktiv,
+    Broadcasts und ausgelagerte bzw. mit Kontext versehene Inhalte Bulk."""
+    if frame.get("type") != "message":
+        return INTERACTIVE
+    if frame.get("to") == "*" or frame.get("via"):
+        return BULK
+    if frame.get("content_ref") or frame.get("context_ref") or frame.get("context"):
+        return BULK
+    return INTERACTIVE
+
+
+class InvalidRequestError(ValueError):
+    """Ungültiges Feld in einer Client-Anfrage (wird als invalid_request beantwortet)."""
+
+
+def _int_field(
+    message: dict,
+    key: str,
+    default: Optional[int] = None,
+    minimum: Optional[int] = None,
+    maximum: Optional[int] = None
+) -> Optional[int]:
+    """Ganzzahliges Feld einer Anfrage (auch als Ziffern-String).
+
+    Raises:
+        InvalidRequestError: Kein ganzzahliger Wert oder außerhalb [minimum, maximum]
+    """
+    value = message.get(key)
+    if value is None:
+        return default
+    number = None
+    if isinstance(value, int) and not isinstance(value, bool):
+        number = value
+    elif isinstance(value, float) and value.is_integer():
+        number = int(value)
+    elif isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        number = int(value)
+    if number is None:
+        raise InvalidRequestError(f"{key} muss eine ganze Zahl sein")
+    if minimum is not None and number < minimum:
+        raise InvalidRequestError(f"{key} muss mindestens {minimum} sein")
+    if maximum is not None and number > maximum:
+        raise InvalidRequestError(f"{key} darf höchstens {maximum} sein")
+    return number